@@ -0,0 +1,206 @@
+#This file contains the acquisition in a separate process. The measurement loop (MeasurementThread) runs in its own process, which owns the VISA sessions during the measurement
+#The GUI only receives the data, so rendering the plot or writing the files can not delay the sampling (no shared GIL)
+#AcquisitionProcess offers the same signals and functions as the MeasurementThread, so the logic can use both in the same way
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+import multiprocessing
+import threading
+import types
+import pyvisa
+import devices
+import measurement_thread
+
+VISA_BACKEND = '@py' #Same backend as the resource manager of the GUI (main.py)
+CATEGORIES = ['smu_devices', 'voltmeter_devices', 'lowV_devices', 'capacitancemeter_devices'] #Device lists of the device handler
+SIGNALS = ['data_signal', 'finished_signal', 'error_signal', 'burst_signal', 'block_signal', 'checkpoint_signal', 'summary_signal', 'progress_signal', 'ramp_signal'] #Signals of the MeasurementThread that are forwarded to the GUI
+DEFERRED_SIGNALS = ['finished_signal', 'error_signal'] #Only emitted when the process has released the devices, so the GUI can use them again
+
+def describe_driver(driver):
+    #Returns everything needed to rebuild the driver in the acquisition process: class, attributes (settings, cache, retry policy, modes) and the options of the session
+    attributes = {key: value for key, value in driver.__dict__.items() if key not in ('device', 'rm')}
+    options = devices.session_options(driver.device) if hasattr(driver, 'device') else None
+    return type(driver).__name__, attributes, options
+
+def rebuild_driver(class_name, attributes, options, rm):
+    #Creates the driver without calling its constructor, so the device is not reset and keeps the settings made in the GUI
+    driver = object.__new__(getattr(devices, class_name))
+    driver.__dict__.update(attributes)
+    driver.rm = rm
+    if options is not None:
+        driver.device = rm.open_resource(driver.port, **options)
+    return driver
+
+def acquisition_main(specs, commands, pipe):
+    #Entry point of the acquisition process. Opens the sessions, waits for the start command, runs the measurement and forwards all signals through the pipe
+    #At the end the sessions are closed and the caches are sent back, so the drivers in the GUI know the state of the devices
+    rm = pyvisa.ResourceManager(VISA_BACKEND)
+    handler = types.SimpleNamespace(**{category: [] for category in CATEGORIES})
+    try:
+        for category, class_name, attributes, options in specs:
+            getattr(handler, category).append(rebuild_driver(class_name, attributes, options, rm))
+    except Exception as e:
+        pipe.send(('error_signal', (f'Acquisition process could not open the devices: {e}',)))
+        pipe.send(('finished_signal', ()))
+        pipe.send(('exit', ({},)))
+        return
+
+    command = commands.get()
+    measurement = measurement_thread.MeasurementThread(ui = None, device_handler = handler)
+    for name in SIGNALS: #The signals are emitted in this thread, so the connected functions are called directly
+        getattr(measurement, name).connect(lambda *args, name = name: pipe.send((name, args)))
+    try:
+        if command[0] == 'start':
+            _, measurement_type, parameters, resume_plan, resume_point, bias, hold, latencies = command
+            measurement.set_parameters(measurement_type, parameters)
+            measurement.set_recipe_voltages(bias, hold)
+            measurement.set_latencies(latencies)
+            if resume_plan is not None:
+                measurement.set_resume(resume_plan, resume_point)
+
+            def listen(): #Handles the commands sent during the measurement
+                while True:
+                    command = commands.get()
+                    if command[0] == 'abort': #The measurement ramps down the voltage itself
+                        measurement.request_abort()
+                    elif command[0] == 'set': #Changes a setting of the running measurement, e.g. ('set', 'target_rse', 0.001)
+                        setattr(measurement, command[1], command[2])
+            threading.Thread(target = listen, daemon = True).start()
+            measurement.run()
+    finally:
+        caches = {}
+        for category in CATEGORIES:
+            for index, driver in enumerate(getattr(handler, category)):
+                if hasattr(driver, 'cache'):
+                    caches[(category, index)] = driver.cache
+                if hasattr(driver, 'device'):
+                    try:
+                        driver.device.close()
+                    except Exception:
+                        pass
+        pipe.send(('exit', (caches,)))
+
+class AcquisitionProcess(QObject):
+    #Runs the measurement in a separate process and emits the same signals as the MeasurementThread in the GUI
+    data_signal = pyqtSignal(list)
+    finished_signal = pyqtSignal()
+    error_signal = pyqtSignal(str)
+    burst_signal = pyqtSignal(list)
+    block_signal = pyqtSignal(list)
+    checkpoint_signal = pyqtSignal(dict)
+    summary_signal = pyqtSignal(list)
+    progress_signal = pyqtSignal(dict)
+    ramp_signal = pyqtSignal(float, float)
+
+    def __init__(self, ui, device_handler, poll_interval = 20):
+        super().__init__()
+        self.ui = ui
+        self.device_handler = device_handler
+        self.resume_plan = None
+        self.resume_point = (0, 0)
+        self.bias = 0
+        self.hold_voltage = None
+        self.latencies = {}
+        self.running = False
+        self.process = None
+        self.deferred = [] #Finished and error signals, emitted after the devices were handed back
+        self.ramp_thread = None #Ramps the voltage down with the sessions of the GUI after a crash of the process
+        self.timer = QTimer(self) #Polls the pipe for data from the acquisition process
+        self.timer.setInterval(poll_interval)
+        self.timer.timeout.connect(self.poll)
+
+    def set_parameters(self, type, parameters):
+        self.type = type
+        self.parameters = parameters
+
+    def set_resume(self, plan, point):
+        self.resume_plan = plan
+        self.resume_point = tuple(point)
+
+    def set_recipe_voltages(self, bias, hold):
+        self.bias = bias
+        self.hold_voltage = hold
+
+    def set_latencies(self, latencies):
+        self.latencies = dict(latencies)
+
+    def wait(self):
+        #Same as QThread.wait, the devices are already handed back when the finished signal is emitted
+        if self.ramp_thread is not None:
+            return self.ramp_thread.wait()
+        return True
+
+    def isRunning(self):
+        #Same as QThread.isRunning, the process has not handed back the devices yet or the voltage is ramped down after a crash
+        return self.process is not None or (self.ramp_thread is not None and self.ramp_thread.isRunning())
+
+    def drivers(self):
+        for category in CATEGORIES:
+            for index, driver in enumerate(getattr(self.device_handler, category)):
+                yield category, index, driver
+
+    def start(self):
+        #Hands the devices to the acquisition process and starts the measurement
+        specs = []
+        for category, index, driver in self.drivers():
+            specs.append((category,) + describe_driver(driver))
+            if hasattr(driver, 'device'): #Only one session per device, the GUI opens its session again when the process is finished
+                try:
+                    driver.device.close()
+                except Exception:
+                    pass
+        context = multiprocessing.get_context('spawn') #Qt and VISA must not be forked
+        self.commands = context.Queue()
+        self.pipe, child_pipe = context.Pipe(duplex = False)
+        self.process = context.Process(target = acquisition_main, args = (specs, self.commands, child_pipe), daemon = True)
+        self.process.start()
+        self.commands.put(('start', self.type, self.parameters, self.resume_plan, self.resume_point, self.bias, self.hold_voltage, self.latencies))
+        self.running = True
+        self.timer.start()
+
+    def poll(self):
+        #Forwards all messages of the acquisition process to the signals
+        while self.process is not None and self.pipe.poll():
+            name, args = self.pipe.recv()
+            if name == 'exit':
+                self.release(args[0])
+                return
+            if name in DEFERRED_SIGNALS:
+                self.deferred.append((name, args))
+            else:
+                getattr(self, name).emit(*args)
+        if self.process is not None and not self.process.is_alive() and not self.pipe.poll(): #The process ended without handing back the devices (crashed)
+            self.deferred.append(('error_signal', ('Acquisition process terminated unexpectedly',)))
+            self.deferred.append(('finished_signal', ()))
+            self.release(None)
+
+    def release(self, caches):
+        #Takes the devices back from the acquisition process. With the caches of the process the GUI knows the state of the devices, otherwise the settings are written again
+        self.timer.stop()
+        self.running = False
+        self.process.join(1)
+        self.process = None
+        for category, index, driver in self.drivers():
+            if not hasattr(driver, 'device'):
+                continue
+            if caches is not None and (category, index) in caches:
+                driver.cache = caches[(category, index)]
+                devices.reopen_session(driver, restore = False)
+            else:
+                devices.reopen_session(driver)
+        if caches is None: #The process could not ramp down the voltage, this is done in a thread with the sessions of the GUI. The deferred signals are emitted afterwards
+            self.ramp_thread = measurement_thread.RampDownThread(ui = self.ui, device_handler = self.device_handler)
+            self.ramp_thread.ramp_signal.connect(self.ramp_signal.emit)
+            self.ramp_thread.error_signal.connect(lambda reason: print(f'WARNING: {reason} after the crash of the acquisition process'))
+            self.ramp_thread.finished_signal.connect(self.emit_deferred)
+            self.ramp_thread.start()
+            return
+        self.emit_deferred()
+
+    def emit_deferred(self):
+        deferred, self.deferred = self.deferred, []
+        for name, args in deferred:
+            getattr(self, name).emit(*args)
+
+    def request_abort(self):
+        #Asks the acquisition process to stop, returns immediately. The process ramps down the voltage itself, the finished signal is emitted when it handed back the devices
+        if self.process is not None:
+            self.commands.put(('abort',))
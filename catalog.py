@@ -0,0 +1,281 @@
+#This file contains the run catalog, an SQLite database of all measurements. For every data file it stores the file location, the settings of the run (measurement type, parameters,
+#device settings from the _MeasurementSettings.json sidecar or the checkpoint journal), the IDs of the devices, the header and the statistics (count, min, max, mean) of every column
+#The catalog is updated at the end of every run and can be updated from a directory tree, files that did not change since they were cataloged are skipped
+#Command line:
+#   python catalog.py scan <folder> [<folder> ...]                  adds or updates all data files below the folders, removes files that were deleted
+#   python catalog.py query --type IV --name sensorX --min-voltage 500 --where "Temperature_0.mean<=-15"
+#Conditions (--where, also in the history browser): <column>.<min|max|mean|count><op><value> for the statistics of a column, param.<key><op><value> for a parameter of the run
+#with op one of < <= > >= = !=. --min-voltage is compared with the maximum absolute target voltage of the run
+import sqlite3
+import argparse
+import json
+import os
+import re
+import time
+import datetime
+import numpy as np
+import data_handler
+
+DEFAULT_DATABASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config', 'catalog.sqlite')
+TIMESTAMP = re.compile(r'_(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})$') #Timestamp of the DataSaver at the end of the file root
+TIMESTAMP_TOLERANCE = 2 #Sidecars written up to this many seconds after the data file are matched (files written before both used the same timestamp)
+STATISTICS = ['count', 'min', 'max', 'mean']
+OPERATORS = ['<=', '>=', '!=', '<', '>', '=']
+CONDITION = re.compile(r'^\s*(.+?)\s*(<=|>=|!=|<|>|=)\s*(\S+)\s*$')
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    name TEXT,
+    folder TEXT,
+    settings_path TEXT,
+    measurement_type TEXT,
+    started REAL,
+    mtime REAL,
+    size INTEGER,
+    rows INTEGER,
+    max_abs_voltage REAL,
+    parameters TEXT,
+    device_settings TEXT,
+    header TEXT
+);
+CREATE TABLE IF NOT EXISTS devices (run INTEGER NOT NULL, device_id TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS columns (run INTEGER NOT NULL, name TEXT NOT NULL, position INTEGER, count INTEGER, min REAL, max REAL, mean REAL);
+CREATE INDEX IF NOT EXISTS runs_type ON runs (measurement_type, max_abs_voltage);
+CREATE INDEX IF NOT EXISTS runs_started ON runs (started);
+CREATE INDEX IF NOT EXISTS devices_id ON devices (device_id, run);
+CREATE INDEX IF NOT EXISTS devices_run ON devices (run);
+CREATE INDEX IF NOT EXISTS columns_name ON columns (name, run);
+CREATE INDEX IF NOT EXISTS columns_run ON columns (run);
+'''
+
+def find_settings(path):
+    #Returns the settings of a data file (measurement_type, parameters, device_settings) and the file they were read from
+    #The _MeasurementSettings.json sidecar is used, otherwise the checkpoint journal. (None, None) if neither exists
+    root, suffix = data_handler.split_data_path(path)
+    candidates = [root + '_MeasurementSettings.json']
+    match = TIMESTAMP.search(root)
+    if match is not None:
+        started = datetime.datetime.strptime(match.group(1), '%Y-%m-%d_%H-%M-%S')
+        for seconds in range(1, TIMESTAMP_TOLERANCE + 1):
+            timestamp = (started + datetime.timedelta(seconds = seconds)).strftime('%Y-%m-%d_%H-%M-%S')
+            candidates.append(root[:match.start()] + '_' + timestamp + '_MeasurementSettings.json')
+    candidates.append(root + '_checkpoint.json')
+    for candidate in candidates:
+        if os.path.exists(candidate):
+            try:
+                with open(candidate, 'r') as f:
+                    settings = json.load(f)
+                return settings, candidate
+            except (OSError, ValueError) as e:
+                print(f'Settings {candidate} could not be read: {e}')
+    return None, None
+
+def start_time(path, settings_path, stat):
+    #Start of the run from the timestamp of the DataSaver in the file name. Files without timestamp use the modification time of the settings (written at the start) or of the data file
+    match = TIMESTAMP.search(data_handler.split_data_path(path)[0])
+    if match is not None:
+        return datetime.datetime.strptime(match.group(1), '%Y-%m-%d_%H-%M-%S').timestamp()
+    if settings_path is not None and settings_path.endswith('_MeasurementSettings.json'):
+        return os.path.getmtime(settings_path)
+    return stat.st_mtime
+
+def column_statistics(columns):
+    #Count of the finite values, minimum, maximum and mean of every column, None if the column has no finite values
+    statistics = {}
+    for name, values in columns.items():
+        finite = values[np.isfinite(values)]
+        if len(finite):
+            statistics[name] = (len(finite), float(finite.min()), float(finite.max()), float(finite.mean()))
+        else:
+            statistics[name] = (0, None, None, None)
+    return statistics
+
+def parse_condition(condition):
+    #Splits a condition into (kind, name, statistic/key, operator, value), raises a ValueError if the condition is not valid
+    match = CONDITION.match(condition)
+    if match is None:
+        raise ValueError(f'Invalid condition {condition!r}, expected e.g. "Current_SMU_0[A].max<1e-6" or "param.stopV=-500"')
+    left, operator, value = match.groups()
+    try:
+        value = float(value)
+    except ValueError:
+        value = value.strip('"\'')
+    if left.startswith('param.'):
+        return 'param', left[len('param.'):], operator, value
+    name, _, statistic = left.rpartition('.')
+    if not name or statistic not in STATISTICS:
+        raise ValueError(f'Invalid condition {condition!r}, the statistic must be one of {", ".join(STATISTICS)}')
+    return 'column', (name, statistic), operator, value
+
+class Catalog:
+    #Connection to the catalog database. A catalog is used by one thread, every thread (e.g. the update at the end of a run) opens its own
+    def __init__(self, path = DEFAULT_DATABASE):
+        self.path = path
+        folder = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self.connection = sqlite3.connect(path, timeout = 30)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def is_current(self, path, stat):
+        #True if the file is cataloged with the same modification time and size
+        row = self.connection.execute('SELECT mtime, size FROM runs WHERE path = ?', (path,)).fetchone()
+        return row is not None and row[0] == stat.st_mtime and row[1] == stat.st_size
+
+    def add_run(self, path, settings = None, settings_path = None):
+        #Adds or updates the entry of a data file. The settings are searched next to the file if they are not given
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        if settings is None:
+            settings, settings_path = find_settings(path)
+        settings = settings or {}
+        columns = data_handler.read_measurement(path)
+        statistics = column_statistics(columns)
+        header = list(columns)
+        target = statistics.get('Target[V]', (0, None, None, None))
+        max_abs_voltage = max(abs(target[1]), abs(target[2])) if target[0] else None
+        device_settings = settings.get('device_settings', {})
+        device_ids = settings.get('devices', list(device_settings)) #Files written before all IDs were saved only know the SMUs and voltmeters
+        started = start_time(path, settings_path, stat)
+        with self.connection:
+            self.remove(path)
+            run = self.connection.execute(
+                'INSERT INTO runs (path, name, folder, settings_path, measurement_type, started, mtime, size, rows, max_abs_voltage, parameters, device_settings, header) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (path, os.path.basename(path), os.path.dirname(path), settings_path, settings.get('measurement_type'), started, stat.st_mtime, stat.st_size,
+                 len(next(iter(columns.values()), [])), max_abs_voltage, json.dumps(settings.get('parameters', {})), json.dumps(device_settings), json.dumps(header))).lastrowid
+            self.connection.executemany('INSERT INTO devices (run, device_id) VALUES (?, ?)', [(run, device_id) for device_id in device_ids])
+            self.connection.executemany('INSERT INTO columns (run, name, position, count, min, max, mean) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                        [(run, name, position) + statistics[name] for position, name in enumerate(header)])
+        return run
+
+    def remove(self, path):
+        row = self.connection.execute('SELECT id FROM runs WHERE path = ?', (path,)).fetchone()
+        if row is not None:
+            self.connection.execute('DELETE FROM devices WHERE run = ?', row)
+            self.connection.execute('DELETE FROM columns WHERE run = ?', row)
+            self.connection.execute('DELETE FROM runs WHERE id = ?', row)
+
+    def scan(self, folder):
+        #Adds the new and changed data files below the folder and removes the entries of deleted files. Returns the number of added, unchanged, removed and failed files
+        folder = os.path.abspath(folder)
+        added = unchanged = failed = 0
+        found = set()
+        for directory, subdirectories, files in os.walk(folder):
+            for name in files:
+                if not data_handler.is_data_file(name):
+                    continue
+                path = os.path.join(directory, name)
+                found.add(path)
+                try: #The file can be deleted or renamed after it was listed (e.g. a run that is written)
+                    if self.is_current(path, os.stat(path)):
+                        unchanged += 1
+                        continue
+                    self.add_run(path)
+                    added += 1
+                except Exception as e:
+                    print(f'{path} could not be cataloged: {e}')
+                    failed += 1
+        prefix = folder.rstrip(os.sep) + os.sep
+        removed = [path for (path,) in self.connection.execute('SELECT path FROM runs WHERE substr(path, 1, ?) = ?', (len(prefix), prefix)) if path not in found]
+        with self.connection:
+            for path in removed:
+                self.remove(path)
+        return added, unchanged, len(removed), failed
+
+    def query(self, measurement_type = None, name = None, device = None, min_voltage = None, after = None, before = None, where = (), limit = None):
+        #Returns the runs matching all filters as dicts, the newest first. name and device match parts of the file name and the device ID,
+        #after/before are datetimes of the start, where is a list of conditions (see the top of this file)
+        clauses = []
+        arguments = []
+        if measurement_type:
+            clauses.append('runs.measurement_type = ?')
+            arguments.append(measurement_type)
+        if name:
+            clauses.append('runs.name LIKE ?')
+            arguments.append(f'%{name}%')
+        if device:
+            clauses.append('runs.id IN (SELECT run FROM devices WHERE device_id LIKE ?)')
+            arguments.append(f'%{device}%')
+        if min_voltage is not None:
+            clauses.append('runs.max_abs_voltage >= ?')
+            arguments.append(min_voltage)
+        if after is not None:
+            clauses.append('runs.started >= ?')
+            arguments.append(after.timestamp())
+        if before is not None:
+            clauses.append('runs.started < ?')
+            arguments.append(before.timestamp())
+        for condition in where:
+            kind, key, operator, value = parse_condition(condition)
+            if kind == 'param':
+                clauses.append(f"json_extract(runs.parameters, ?) {operator} ?")
+                arguments.extend([f'$.{key}', value])
+            else:
+                column, statistic = key
+                clauses.append(f'runs.id IN (SELECT run FROM columns WHERE name = ? AND {statistic} {operator} ?)') #statistic and operator are checked in parse_condition
+                arguments.extend([column, value])
+        sql = 'SELECT path, name, measurement_type, started, rows, max_abs_voltage, parameters, (SELECT group_concat(device_id, char(31)) FROM devices WHERE devices.run = runs.id) FROM runs'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY started DESC'
+        if limit:
+            sql += f' LIMIT {int(limit)}'
+        runs = []
+        for path, name, measurement_type, started, rows, max_abs_voltage, parameters, device_ids in self.connection.execute(sql, arguments):
+            runs.append({'path': path, 'name': name, 'measurement_type': measurement_type, 'started': started, 'rows': rows, 'max_abs_voltage': max_abs_voltage,
+                         'parameters': json.loads(parameters), 'devices': device_ids.split('\x1f') if device_ids else []})
+        return runs
+
+    def statistics(self, path):
+        #Statistics of the columns of a cataloged file: name -> (count, min, max, mean)
+        rows = self.connection.execute('SELECT columns.name, count, min, max, mean FROM columns JOIN runs ON runs.id = columns.run WHERE runs.path = ? ORDER BY position', (os.path.abspath(path),))
+        return {name: values for name, *values in rows}
+
+def format_started(started):
+    return datetime.datetime.fromtimestamp(started).strftime('%Y-%m-%d %H:%M:%S') if started is not None else ''
+
+def main(arguments = None):
+    parser = argparse.ArgumentParser(description = 'Catalog of the measurement files')
+    parser.add_argument('--db', default = DEFAULT_DATABASE, help = 'catalog database (default: config/catalog.sqlite)')
+    commands = parser.add_subparsers(dest = 'command', required = True)
+    scan = commands.add_parser('scan', help = 'add the new and changed data files below the folders')
+    scan.add_argument('folders', nargs = '+')
+    query = commands.add_parser('query', help = 'list the runs matching all filters')
+    query.add_argument('--type', choices = ['IV', 'CV', 'Constant Voltage'])
+    query.add_argument('--name', help = 'part of the file name')
+    query.add_argument('--device', help = 'part of a device ID')
+    query.add_argument('--min-voltage', type = float, help = 'minimum of the maximum absolute target voltage [V]')
+    query.add_argument('--after', type = datetime.datetime.fromisoformat, help = 'started at or after (YYYY-MM-DD[ HH:MM])')
+    query.add_argument('--before', type = datetime.datetime.fromisoformat, help = 'started before (YYYY-MM-DD[ HH:MM])')
+    query.add_argument('--where', action = 'append', default = [], help = 'condition on a column or parameter, e.g. "Current_SMU_0[A].max<1e-6", can be repeated')
+    query.add_argument('--limit', type = int)
+    query.add_argument('--paths', action = 'store_true', help = 'only print the paths of the files')
+    arguments = parser.parse_args(arguments)
+    catalog = Catalog(arguments.db)
+    try:
+        if arguments.command == 'scan':
+            for folder in arguments.folders:
+                start = time.perf_counter()
+                added, unchanged, removed, failed = catalog.scan(folder)
+                print(f'{folder}: {added} added, {unchanged} unchanged, {removed} removed, {failed} failed ({time.perf_counter() - start:.1f} s)')
+        else:
+            try:
+                runs = catalog.query(arguments.type, arguments.name, arguments.device, arguments.min_voltage, arguments.after, arguments.before, arguments.where, arguments.limit)
+            except ValueError as e:
+                parser.error(str(e))
+            for run in runs:
+                if arguments.paths:
+                    print(run['path'])
+                else:
+                    voltage = f'{run["max_abs_voltage"]:g}' if run['max_abs_voltage'] is not None else '-'
+                    print(f'{format_started(run["started"])}\t{run["measurement_type"] or "-"}\t{voltage} V\t{run["rows"]} rows\t{run["path"]}')
+    finally:
+        catalog.close()
+
+if __name__ == '__main__':
+    main()
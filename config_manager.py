@@ -4,6 +4,8 @@
 # The config files will be saved in the config folder. The config files will be saved as json files.
 
 import json
+import plotting
+import data_handler
 import os
 
 config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config')
@@ -25,7 +27,13 @@ class config_manager:
             'IV' : self.ui.IV_settings,
             'CV' : self.ui.CV_settings,
             'Constant Voltage' : self.ui.constantV_settings, 
-            'darkmode' : self.ui.logic.darkmode
+            'darkmode' : self.ui.logic.darkmode,
+            'separate_process' : self.ui.separate_process_checkBox.isChecked(),
+            'publish' : self.ui.publish_checkBox.isChecked(),
+            'publish_port' : self.ui.publish_port_spinBox.value(),
+            'compression' : self.ui.compression_comboBox.currentText(),
+            'digits' : self.ui.digits_spinBox.value(),
+            'plot_backend' : self.ui.plot_backend_comboBox.currentText()
         }
 
         return config
@@ -34,6 +42,14 @@ class config_manager:
         # This function will extract the parameters from a given config and set them accordingly.
         self.ui.logic.darkmode = config['darkmode']
         self.ui.logic.update_darkmode()
+        self.ui.separate_process_checkBox.setChecked(config.get('separate_process', False))
+        self.ui.publish_checkBox.setChecked(config.get('publish', False))
+        self.ui.publish_port_spinBox.setValue(config.get('publish_port', 5555))
+        if config.get('compression', 'None') in data_handler.COMPRESSIONS: #zstandard may not be installed on this computer
+            self.ui.compression_comboBox.setCurrentText(config.get('compression', 'None'))
+        self.ui.digits_spinBox.setValue(config.get('digits', 0))
+        if config.get('plot_backend', 'matplotlib') in plotting.BACKENDS: #pyqtgraph may not be installed on this computer
+            self.ui.plot_backend_comboBox.setCurrentText(config.get('plot_backend', 'matplotlib'))
         self.ui.measurement_type_comboBox.setCurrentText(config['measurement_type'])
         if config['measurement_type'] == 'IV':
             sub_config = config['IV']
@@ -43,6 +59,8 @@ class config_manager:
             self.ui.time_between_steps_spinBox.setValue(sub_config['time_between_steps'])
             self.ui.time_between_measurements_spinBox.setValue(sub_config['time_between_measurements'])
             self.ui.measurements_per_step_spinBox.setValue(sub_config['measurements_per_step'])
+            self.ui.target_rse_spinBox.setValue(sub_config.get('target_rse', 0))
+            self.ui.min_measurements_spinBox.setValue(sub_config.get('min_measurements_per_step', 2))
             self.ui.limitI_spinBox.setValue(sub_config['limitI'])
             self.ui.use_custom_sweep_checkBox.setChecked(sub_config['custom_sweep'])
             self.ui.custom_sweep_file.setText(sub_config['custom_sweep_file'])
@@ -58,6 +76,8 @@ class config_manager:
             self.ui.time_between_steps_spinBox.setValue(sub_config['time_between_steps'])
             self.ui.time_between_measurements_spinBox.setValue(sub_config['time_between_measurements'])
             self.ui.measurements_per_step_spinBox.setValue(sub_config['measurements_per_step'])
+            self.ui.target_rse_spinBox.setValue(sub_config.get('target_rse', 0))
+            self.ui.min_measurements_spinBox.setValue(sub_config.get('min_measurements_per_step', 2))
             self.ui.limitI_spinBox.setValue(sub_config['limitI'])
             self.ui.use_custom_sweep_checkBox.setChecked(sub_config['custom_sweep'])
             self.ui.custom_sweep_file.setText(sub_config['custom_sweep_file'])
@@ -1,23 +1,199 @@
+#Data files can be written compressed (gzip or zstd). The rows are collected and written as independent frames (gzip members / zstd frames) every FRAME_INTERVAL seconds,
+#a file is a concatenation of complete frames, so everything but the last frame is readable after a crash. read_data_lines reads plain and compressed files
 import os
+import io
+import gzip
+import zlib
+import json
+import time
 import datetime
+import numpy as np
+import devices
+try:
+    import zstandard
+except ImportError:
+    zstandard = None #zstd compression is only offered if the zstandard package is installed
+
+COMPRESSIONS = {'None': '', 'gzip': '.gz'} #Compression -> extension appended to the file suffix
+if zstandard is not None:
+    COMPRESSIONS['zstd'] = '.zst'
+FRAME_INTERVAL = 2 #Maximum time [s] rows are kept in memory before they are written as a frame
+FRAME_SIZE = 1 << 16 #Frames are written earlier if this many characters are collected
+DATA_SUFFIXES = [suffix + compression for suffix in ('.csv', '.dat', '.txt') for compression in ('', '.gz', '.zst')] #Suffixes of the data files, also compressed
+TIME_FORMAT = '.6f' #Format of the time columns if the number of digits is limited, fixed to microseconds so long runs keep their resolution
+
+def split_data_path(path):
+    #Splits a data file into root and suffix, the suffix includes the compression: 'run.csv.gz' -> ('run', '.csv.gz')
+    root, extension = os.path.splitext(path)
+    if extension not in ('.gz', '.zst'):
+        return root, extension
+    root, suffix = os.path.splitext(root)
+    return root, suffix + extension
+
+def is_data_file(path):
+    #True for the data files of the DataSaver, the companion files (bursts, step summaries) are excluded
+    root, suffix = split_data_path(path)
+    return suffix in DATA_SUFFIXES and not root.endswith(('_burst', '_summary'))
+
+def open_data_file(path):
+    #Opens a plain or compressed data file for reading as text
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt')
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise ValueError(f'{path} is compressed with zstd, but the zstandard package is not installed')
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames = True))
+    return open(path, 'r')
+
+def read_data_lines(path):
+    #Reads all lines of a plain or compressed data file. A frame that was cut off (crash while writing) ends the file, the lines before it are returned
+    errors = (EOFError, zlib.error, OSError) + ((zstandard.ZstdError,) if zstandard is not None else ())
+    lines = []
+    with open_data_file(path) as f:
+        try:
+            for line in f:
+                lines.append(line)
+        except errors as e:
+            print(f'{path} ends with an incomplete frame, {len(lines)} lines were read: {e}')
+            if lines and not lines[-1].endswith('\n'):
+                lines.pop()
+    return lines
+
+def read_measurement(path):
+    #Reads a data file written by the DataSaver (plain or compressed). Returns a dict column name -> array
+    lines = read_data_lines(path)
+    if not lines:
+        raise ValueError('The file is empty')
+    header = lines[0].split()
+    data = np.loadtxt(lines[1:], ndmin = 2) if len(lines) > 1 else np.empty((0, len(header)))
+    if data.shape[1] != len(header):
+        raise ValueError(f'{len(header)} columns in the header, but {data.shape[1]} in the data')
+    return {name: data[:, index] for index, name in enumerate(header)}
+
+def open_output(path, mode):
+    #Opens a data file for writing (mode 'x' or 'w') or appending (mode 'a'), compressed according to its extension
+    if path.endswith('.gz'):
+        return CompressedWriter(path, mode, gzip.compress)
+    if path.endswith('.zst'):
+        return CompressedWriter(path, mode, zstandard.ZstdCompressor().compress)
+    return open(path, mode, buffering=1)
+
+class CompressedWriter:
+    #Text file that writes the collected text as independent compressed frames, see the top of this file
+    def __init__(self, path, mode, compress):
+        self.raw = open(path, mode + 'b')
+        self.compress = compress
+        self.buffer = []
+        self.buffered = 0 #Number of collected characters
+        self.last_frame = time.monotonic()
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.buffered += len(text)
+        if self.buffered >= FRAME_SIZE or time.monotonic() - self.last_frame >= FRAME_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        #Writes the collected text as one frame
+        if self.buffer:
+            self.raw.write(self.compress(''.join(self.buffer).encode()))
+            self.raw.flush()
+            self.buffer = []
+            self.buffered = 0
+        self.last_frame = time.monotonic()
+
+    def tell(self):
+        #Only used to check whether the file is empty
+        return self.raw.tell() + self.buffered
+
+    def close(self):
+        self.flush()
+        self.raw.close()
+
+def format_value(value, number_format):
+    #Formats one value of a row, values that are not numbers (e.g. a missing target voltage) are written as they are
+    try:
+        return format(float(value), number_format)
+    except (TypeError, ValueError):
+        return str(value)
+
+def format_row(values, formats):
+    #Formats a row of values, formats None writes the full precision. The target voltage of read_data is a string, so the values are converted first
+    if formats is None or len(formats) != len(values):
+        return ' '.join(map(str, values))
+    return ' '.join(format_value(value, number_format) for value, number_format in zip(values, formats))
 
 class DataSaver:
     #This class is responsible for saving the data to a file
     #It creates the file and writes the data to it
-    def __init__(self, filepath, filename, use_timestamp, ui, functionality):
+    def __init__(self, filepath, filename, use_timestamp, ui, functionality, resume_journal = None):
         self.functionality = functionality
         self.ui = ui
-        self.create_file(filepath=filepath, filename=filename, use_timestamp=use_timestamp)
+        self.rows = 0 # Number of data rows written, used to link the bursts to their row
+        self.burst_file = None # Companion file for the bursts of voltmeters in burst mode, only created if needed
+        self.summary_file = None # Companion file for the step summaries of measurements with early stop, only created if needed
+        self.companion_mode = 'x' # Companion files are created new, when resuming they are appended
+        self.publisher = None # Streams every written row to external programs, if enabled
+        self.journal = {} # Checkpoint journal, rewritten after every completed point so an interrupted run can be resumed
+        digits = ui.digits_spinBox.value()
+        self.number_format = f'.{digits}g' if digits else None # Significant digits of the written values, None for the full precision
+        if resume_journal is None:
+            self.create_file(filepath=filepath, filename=filename, use_timestamp=use_timestamp)
+        else:
+            self.reopen_file(resume_journal)
         
+    def reopen_file(self, journal):
+        #This function reopens the file of an interrupted measurement in append mode, the header has to match the connected devices
+        #The rows written after the last checkpoint (a partly measured point, which is measured again) are removed
+        self.filepath = journal['file']
+        self.journal = journal
+        self.companion_mode = 'a'
+        lines = read_data_lines(self.filepath)
+        header = lines[0].split() if lines else []
+        self.rows = max(len(lines) - 1, 0)
+        self.build_header()
+        if header != self.header:
+            raise ValueError('The connected devices do not match the devices of the interrupted measurement')
+        checkpointed = journal.get('rows', self.rows) #Journals written before the row count was recorded keep all rows
+        if checkpointed < self.rows:
+            print(f'Removing {self.rows - checkpointed} rows of the interrupted point from {self.filepath}')
+            lines = lines[:checkpointed + 1]
+            self.rows = checkpointed
+            self.rewrite(self.filepath, lines)
+            self.truncate_bursts()
+        elif self.filepath.endswith(('.gz', '.zst')): #The readable lines are written again, frames appended after an incomplete frame could not be read
+            self.rewrite(self.filepath, lines)
+        if checkpointed > self.rows:
+            print(f'Warning: {self.filepath} contains {self.rows} rows, but the checkpoint counted {checkpointed}. The lost rows are not measured again')
+        self.file = open_output(self.filepath, 'a')
+
+    def rewrite(self, path, lines):
+        #Replaces the file with the given lines, a temporary file is written first so the file is not lost if this is interrupted
+        temporary = os.path.join(os.path.dirname(path), '.tmp_' + os.path.basename(path)) #Same extension, so it is compressed like the file
+        rewritten = open_output(temporary, 'w')
+        rewritten.write(''.join(lines))
+        rewritten.close()
+        os.replace(temporary, path)
+
+    def truncate_bursts(self):
+        #Removes the bursts of the removed rows from the companion file
+        root, suffix = split_data_path(self.filepath)
+        path = root + '_burst' + suffix
+        if os.path.exists(path):
+            lines = read_data_lines(path)
+            self.rewrite(path, lines[:1] + [line for line in lines[1:] if int(line.split()[0]) < self.rows])
+
+
     def create_file(self, filepath, filename, use_timestamp = True):  
         #This function creates the file and writes the header to it
+        suffix = self.ui.filename_suffix.currentText() + COMPRESSIONS[self.ui.compression_comboBox.currentText()]
         if use_timestamp:
             timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-            self.filepath = os.path.join(filepath, filename + '_' + timestamp + self.ui.filename_suffix.currentText())
+            self.filepath = os.path.join(filepath, filename + '_' + timestamp + suffix)
         else:
-            self.filepath = os.path.join(filepath, filename + self.ui.filename_suffix.currentText())
+            self.filepath = os.path.join(filepath, filename + suffix)
         try:
-            self.file = open(self.filepath, 'x', buffering=1)
+            self.file = open_output(self.filepath, 'x')
             self.write_header()
         except FileExistsError:
             raise FileExistsError
@@ -25,36 +201,159 @@ class DataSaver:
             return  
     
     def write_header(self):
+        self.build_header()
+        self.file.write(' '.join(self.header)+ '\n') 
+
+    def build_header(self):
         #The header is created based on the devices that are connected
         #It provides information on the different channels which are measured
         self.header = [] 
         self.header.append(f'Target[V]')
-        for i in range(len(self.ui.device_handler.smu_devices)):
+        channels = sum(devices.smu_channels(smu) for smu in self.ui.device_handler.smu_devices) #Numbered over all SMUs, a dual-channel SMU has two column pairs
+        for i in range(channels):
             self.header.append(f'Voltage_SMU_{i}[V]')
             self.header.append(f'Current_SMU_{i}[A]')
         for i in range(len(self.ui.device_handler.voltmeter_devices)):
             self.header.append(f'{self.ui.device_handler.voltmeter_devices[i].type}_{i}')
         for i in range(len(self.ui.device_handler.lowV_devices)):
             num_channels = self.ui.device_handler.lowV_devices[i].return_num_channels()
-            if num_channels == 3:
-                self.header.append(f'Voltage_lowV_{i}_Channel_1[V] Voltage_lowV_{i}_Channel_2[V] Voltage_lowV_{i}_Channel_3[V] Current_lowV_{i}_Channel_1[A] Current_lowV_{i}_Channel_2[A] Current_lowV_{i}_Channel_3[A]')
-            else:
-                self.header.append(f'Voltage_lowV_{i}_Channel_1[V] Voltage_lowV_{i}_Channel_2[V] Voltage_lowV_{i}_Channel_3[V] Voltage_lowV_{i}_Channel_4[V] Current_lowV_{i}_Channel_1[A] Current_lowV_{i}_Channel_2[A] Current_lowV_{i}_Channel_3[A] Current_lowV_{i}_Channel_4[A]')
+            #Same order as the row returned by read_output: first the voltages of all channels, then the currents
+            for channel in range(1, num_channels + 1):
+                self.header.append(f'Voltage_lowV_{i}_Channel_{channel}[V]')
+            for channel in range(1, num_channels + 1):
+                self.header.append(f'Current_lowV_{i}_Channel_{channel}[A]')
         for i in range(len(self.ui.device_handler.capacitancemeter_devices)):
             self.header.append(f'Impedance_LCR_{i}[Ohm]')
             self.header.append(f'Phase_LCR_{i}[Deg]')
             self.header.append(f'Frequency_LCR_{i}[Hz]')
-        self.file.write(' '.join(self.header)+ '\n') 
+        #Time of the sample and start/end of the readout of every device in seconds since the start of the measurement
+        self.header.append('Time[s]')
+        readouts = [f'SMU_{i}' for i in range(len(self.ui.device_handler.smu_devices))] #One readout per device, also for dual-channel SMUs
+        readouts += [f'Voltmeter_{i}' for i in range(len(self.ui.device_handler.voltmeter_devices))]
+        readouts += [f'lowV_{i}' for i in range(len(self.ui.device_handler.lowV_devices))]
+        readouts += [f'LCR_{i}' for i in range(len(self.ui.device_handler.capacitancemeter_devices))]
+        for device in readouts:
+            self.header.append(f'ReadStart_{device}[s]')
+            self.header.append(f'ReadEnd_{device}[s]')
+        self.header.append('Failed_Reads') #Number of readings in the row that failed after all retries (written as NaN)
+        #Format of every column if the number of digits is limited, the times are written with a fixed resolution
+        if self.number_format is None:
+            self.formats = None
+        else:
+            self.formats = [TIME_FORMAT if name.endswith('[s]') else self.number_format for name in self.header]
         
 
     def write_data(self, data):
         #This function writes the data to the file
-        data_string = ' '.join(map(str, data)) + '\n'
+        data_string = ' '.join(map(str, data)) + '\n' #Full precision for the error messages if the formatting fails
         try:
+            data_string = format_row(data, self.formats) + '\n'
             self.file.write(data_string)
+            self.rows += 1
         except Exception as e:
             print(f'Data {data_string} could not be safed: {e}') 
+        if self.publisher is not None:
+            try:
+                self.publisher.publish(data)
+            except ValueError as e:
+                print(f'Data {data_string} could not be published: {e}')
+
+    def write_burst(self, burst):
+        #This function writes a burst of readings (voltmeters in burst mode, buffered SMUs) to the companion file (one line per reading)
+        #The row column is the index of the first data row (starting at 0) the burst belongs to
+        name, timestamps, readings = burst
+        if self.burst_file is None:
+            root, suffix = split_data_path(self.filepath)
+            self.burst_file = open_output(root + '_burst' + suffix, self.companion_mode)
+            if self.burst_file.tell() == 0:
+                self.burst_file.write('Row Device Time[s] Reading\n')
+        if self.number_format is None:
+            lines = [f'{self.rows} {name} {t} {r}\n' for t, r in zip(timestamps, readings)]
+        else:
+            lines = [f'{self.rows} {name} {format_value(t, TIME_FORMAT)} {format_value(r, self.number_format)}\n' for t, r in zip(timestamps, readings)]
+        try:
+            self.burst_file.write(''.join(lines))
+        except Exception as e:
+            print(f'Burst of {name} could not be safed: {e}')
+
+    def write_summary(self, summary):
+        #This function writes the summary of a voltage step (measurements with early stop) to the companion file
+        if self.summary_file is None:
+            root, suffix = split_data_path(self.filepath)
+            self.summary_file = open_output(root + '_summary' + suffix, self.companion_mode)
+            if self.summary_file.tell() == 0:
+                self.summary_file.write('Target[V] Frequency[Hz] Quantity N Mean Std Converged\n')
+        try:
+            self.summary_file.write(' '.join(map(str, summary)) + '\n')
+        except Exception as e:
+            print(f'Summary {summary} could not be safed: {e}')
+
+    def journal_path(self):
+        root, suffix = split_data_path(self.filepath)
+        return root + '_checkpoint.json'
+
+    def plan_path(self):
+        root, suffix = split_data_path(self.filepath)
+        return root + '_plan.json'
+
+    def write_plan(self, plan):
+        #Writes a plan that is kept in the journal (not memory-mapped) to its own file, the journal only references it.
+        #The journal is rewritten after every point, a large custom sweep in it would be written again every time. Returns the journal entry of the plan
+        path = self.plan_path()
+        try:
+            with open(path + '.tmp', 'w') as f:
+                json.dump(plan, f)
+            os.replace(path + '.tmp', path)
+        except Exception as e:
+            print(f'Plan could not be safed, it is kept in the checkpoint: {e}')
+            return plan
+        return {'file': os.path.abspath(path)}
+
+    def start_journal(self, measurement_type, parameters, device_settings, device_ids = None):
+        #This function creates the checkpoint journal of a new measurement
+        self.journal = {
+            'devices': device_ids if device_ids is not None else list(device_settings), # IDs of all connected devices
+            'file': os.path.abspath(self.filepath),
+            'measurement_type': measurement_type,
+            'parameters': parameters,
+            'device_settings': device_settings,
+            'plan': None,
+            'next': [0, 0],
+            'rows': 0, # Data rows of the completed points, the rows after them are removed when the measurement is resumed
+            'completed': False,
+        }
+        self.write_checkpoint({})
+
+    def write_checkpoint(self, checkpoint):
+        #This function updates the journal with the checkpoint sent by the measurement thread (plan, next unmeasured point)
+        #The journal is written to a temporary file first, so an interruption while writing does not destroy the old journal
+        if checkpoint.get('plan') is not None and 'path' not in checkpoint['plan'] and 'file' not in checkpoint['plan']: #Sent once at the start
+            checkpoint = dict(checkpoint, plan = self.write_plan(checkpoint['plan']))
+        self.journal.update(checkpoint)
+        if 'next' in checkpoint: #All rows written so far belong to completed points
+            self.flush() #Compressed files keep the last rows in memory, the journal must not count rows that are lost in a crash
+            self.journal['rows'] = self.rows
+        path = self.journal_path()
+        try:
+            with open(path + '.tmp', 'w') as f:
+                json.dump(self.journal, f, indent = 4)
+            os.replace(path + '.tmp', path)
+        except Exception as e:
+            print(f'Checkpoint could not be safed: {e}')
+
+    def flush(self):
+        #Writes the collected rows of the data and companion files
+        for file in (self.file, self.burst_file, self.summary_file):
+            if file is not None:
+                try:
+                    file.flush()
+                except Exception as e:
+                    print(f'{file} could not be flushed: {e}')
 
     def close(self):
         #This function closes the file
-        self.file.close()
\ No newline at end of file
+        self.file.close()
+        if self.burst_file is not None:
+            self.burst_file.close()
+        if self.summary_file is not None:
+            self.summary_file.close()
\ No newline at end of file
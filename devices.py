@@ -12,6 +12,7 @@
 # - set_limit(self, limitI): Sets the current limit of the device
 # - measure_current(self): Measures the current output of the device
 # - measure_voltage(self): Measures the voltage at the device
+# - measure_iv(self): Measures voltage and current of all channels at once (optional, currently only for K2600)
 # - measure_resistance(self): Measures the resistance at the device
 # - read_output(self): Reads the output low voltage power devices
 # - enable_highC(self, highC): Enables or disables the high current mode of the device (Currently only for K2600)
@@ -19,10 +20,195 @@
 # Currently supported devices: Keithley 2000 Voltmeter, Keithley 2200 SMU, Keithley 2600 SMU, Rhode&Schwarz NGE100 Power Supply and HAMEG HMP4040 Power Supply 
 import pyvisa
 import numpy as np
+import re
+import threading
+from contextlib import contextmanager
+
+
+class StateCache: # Write-through cache of the last confirmed settings of a device, used to skip redundant writes
+    # Every setting is stored under a key together with the commands that were sent for it. If the same commands are requested again, nothing is written.
+    # The cache has to be invalidated whenever the state of the device is unknown (reset, errors, reconnects)
+    def __init__(self):
+        self.state = {}
+        self.wanted = {} # Last requested settings, kept when the state becomes unknown so they can be restored after a reconnect
+        self.volatile = set()
+        self.batch = None # List of collected commands while a transaction is open
+        self.writes_sent = 0 # Counts the writes that went over the bus
+        self.writes_skipped = 0 # Counts the writes that were saved by the cache
+
+    def write(self, device, key, *commands, volatile = False):
+        # Sends the commands for the setting key, if they differ from the last confirmed ones. Returns True if something was written.
+        # Volatile entries (e.g. clearing the buffer) are only valid until the next other command or measurement is sent to the device
+        if self.state.get(key) == commands:
+            self.writes_skipped += len(commands)
+            return False
+        if not volatile:
+            self.wanted[key] = commands
+        self.state.pop(key, None)
+        self.touch()
+        if self.batch is not None: # Inside a transaction the commands are only collected and sent on commit
+            self.batch.extend(commands)
+            self.state[key] = commands
+            if volatile:
+                self.volatile.add(key)
+            return True
+        try:
+            for command in commands:
+                device.write(command)
+                self.writes_sent += 1
+        except Exception:
+            self.invalidate() # If a write fails, the state of the device is unknown
+            raise
+        self.state[key] = commands
+        if volatile:
+            self.volatile.add(key)
+        return True
+
+    def touch(self):
+        # Called whenever other traffic reaches the device, drops all volatile entries
+        for key in self.volatile:
+            self.state.pop(key, None)
+        self.volatile.clear()
+
+    def forget(self, key):
+        # Removes a single setting from the cache, so it is written again the next time
+        self.state.pop(key, None)
+
+    def invalidate(self):
+        self.state = {}
+        self.volatile.clear()
+
+    def clear(self):
+        # Called on a reset of the device, the requested settings are gone as well
+        self.invalidate()
+        self.wanted = {}
+
+    def restore(self, device):
+        # Writes all requested settings to the device again, e.g. after its session was reopened
+        for key, commands in list(self.wanted.items()):
+            self.write(device, key, *commands)
+
+    @contextmanager
+    def transaction(self, send_batch):
+        # Collects all commands written inside the with block and hands them to send_batch as one list at the end.
+        # Nested transactions are merged into the outermost one. If sending fails, the cache is invalidated as the state of the device is unknown
+        if self.batch is not None:
+            yield
+            return
+        self.batch = []
+        try:
+            yield
+            commands, self.batch = self.batch, None
+            if commands:
+                send_batch(commands)
+                self.writes_sent += 1
+        except Exception:
+            self.batch = None
+            self.invalidate()
+            raise
+
+    def statistics(self):
+        return f'{self.writes_sent} writes sent, {self.writes_skipped} redundant writes skipped'
+
+
+class RetryPolicy: # How a driver is recovered from transient communication errors (timeouts, broken USB-serial links, garbled answers) during a measurement
+    def __init__(self, attempts = 3, delay = 0.5, backoff = 2, max_failed_rows = 5):
+        self.attempts = attempts # Retries of a failed command, before every retry the session is reopened
+        self.delay = delay # Waiting time before the first retry [s]
+        self.backoff = backoff # The waiting time is multiplied by this factor for every further retry
+        self.max_failed_rows = max_failed_rows # Number of consecutive data rows with a failed reading of the device, before the measurement is aborted
+        self.failed_rows = 0
+
+    def wait_time(self, attempt):
+        return self.delay*self.backoff**attempt
+
+
+RECOVERABLE_ERRORS = (pyvisa.errors.VisaIOError, pyvisa.errors.InvalidSession, ValueError) # Errors after which a reconnect is worth a try (ValueError: answer could not be parsed)
+
+
+def smu_channels(smu):
+    # Number of channels of an SMU, every channel has its own voltage and current column (2 for dual-channel Keithley 2600, otherwise 1)
+    return len(getattr(smu, 'channels', [None]))
+
+
+def session_options(session):
+    # Options to open a new session like the given one (terminations, timeout)
+    options = {'read_termination': session.read_termination, 'write_termination': session.write_termination}
+    try:
+        options['timeout'] = session.timeout
+    except Exception:
+        pass # Not available for closed sessions
+    return options
+
+
+def reopen_session(driver, restore = True):
+    # Closes the VISA session of a driver and opens a new one with the same terminations, afterwards the cached settings are restored
+    # Without restore the cache is trusted, e.g. when the session was only handed to another process that kept the cache up to date
+    if not hasattr(driver, 'device'):
+        return
+    old = driver.device
+    options = session_options(old)
+    try:
+        old.close() # Close the broken session first, otherwise the session pool would hand out the same session again
+    except Exception:
+        pass
+    driver.device = driver.rm.open_resource(driver.port, **options)
+    if restore and hasattr(driver, 'cache'):
+        driver.cache.invalidate() # The state of the device is unknown after a reconnect
+        driver.cache.restore(driver.device)
+
+
+class LazyResourceManager: # Resource manager that is only created when it is used the first time, as loading the VISA backend takes long (pyvisa-py imports the USB, serial and network backends)
+    # It offers the same functions as the pyvisa ResourceManager. The first use is usually the port scan in the background after the window is shown
+    def __init__(self, backend = '@py'):
+        self.backend = backend
+        self.rm = None
+        self.lock = threading.Lock() # The port scan runs in a worker thread
+
+    def manager(self):
+        with self.lock:
+            if self.rm is None:
+                self.rm = pyvisa.ResourceManager(self.backend)
+            return self.rm
+
+    def list_resources(self):
+        rm = self.manager()
+        with self.lock: # No parallel scans of the GUI and the worker thread
+            return rm.list_resources()
+
+    def open_resource(self, port, **kwargs):
+        return self.manager().open_resource(port, **kwargs)
+
+    def __getattr__(self, name):
+        if name in ('backend', 'rm', 'lock'): # Not set yet (e.g. while copying)
+            raise AttributeError(name)
+        return getattr(self.manager(), name)
+
+
+def parse_readings(answer):
+    # Converts a comma seperated list of readings (e.g. from TRAC:DATA?) into an array. Units attached to the numbers (e.g. VDC, SECS, A) are removed
+    return np.array([float(re.sub('[A-Za-z]+$', '', element.strip())) for element in answer.strip().split(',') if element.strip()], dtype = float)
+
+
+MAX_ERRORS = 32 # Maximum number of entries read from an error queue, so a device that keeps reporting errors can not block the batch
+
+def send_scpi_batch(device, commands, id):
+    # Sends a list of SCPI commands as one semicolon-joined program message. Every command gets a leading ':' so it is parsed from the root of the command tree.
+    # The error queue is cleared first (*CLS), so only errors of this batch are reported. Afterwards the device is asked once to finish all commands, the whole queue is read
+    device.write(';'.join(['*CLS'] + [command if command.startswith((':', '*')) else ':' + command for command in commands]))
+    answer = device.query('*OPC?;:SYST:ERR?').strip()
+    error = answer.split(';')[-1]
+    errors = []
+    while not error.startswith(('0', '+0')) and len(errors) < MAX_ERRORS:
+        errors.append(error)
+        error = device.query(':SYST:ERR?').strip()
+    if errors:
+        raise RuntimeError(f'{id}: configuration failed with {"; ".join(errors)}')
 
 
 class Dummy_Device: # Dummy Device for testing purposes
     def __init__(self, port, id, rm): 
+        self.retry = RetryPolicy()
         self.port = port
         self.assigned_id = id
         self.reset()
@@ -67,6 +253,9 @@ class Dummy_Device: # Dummy Device for testing purposes
 class K2000: # K2000 Voltmeter (able to measure Voltage/Resistance)
     def __init__(self, port, id, rm):
         self.device = rm.open_resource(port)
+        self.cache = StateCache() # Cache of the last written settings, to skip redundant writes
+        self.retry = RetryPolicy() # Recovery from transient communication errors
+        self.rm = rm
         self.port = port
         self.assigned_id = id
         self.settings = {  #Standard settings for the Keithley 2000 (loaded when the device is connected)
@@ -77,17 +266,23 @@ class K2000: # K2000 Voltmeter (able to measure Voltage/Resistance)
             'use_filter': False,
             'filter_num': 10,
             'filter_type': 'Moving Average',
+            'burst_mode': False,
+            'burst_count': 100,
             }
+        self.burst_mode = False # In burst mode the device collects burst_count readings into its buffer on its own, which are fetched at once
+        self.burst_count = 100
         self.type = 'VOLT:DC'   # Sets the default measurement type to DC Voltage
         self.set_measurement_type(self.type)
         self.reset()
         self.clear_buffer()
 
     def reset(self):
+        self.cache.clear()
         self.device.write('*RST')
+        self.type = 'VOLT:DC' # Default measurement type after a reset
 
     def clear_buffer(self):
-        self.device.write('*CLS')
+        self.cache.write(self.device, 'clear_buffer', '*CLS', volatile = True)
 
     def return_port(self):
         return self.port
@@ -101,60 +296,99 @@ class K2000: # K2000 Voltmeter (able to measure Voltage/Resistance)
     def close(self):
         self.device.close()
 
+    def transaction(self):
+        # Settings written inside "with device.transaction():" are sent as one message, errors are only checked once at the end
+        return self.cache.transaction(self.send_batch)
+
+    def send_batch(self, commands):
+        send_scpi_batch(self.device, commands, self.assigned_id)
+
     def measure(self):
+        self.cache.touch()
         return self.device.query('READ?').strip('').strip('').strip('\n').strip() #Try to strip the unwanted characters from the output. (Sometimes doesnt work for some reason)
     
     def set_measurement_type(self, type):
         self.type = type
-        self.device.write('SENS:FUNC "{}"'.format(type))
+        self.cache.write(self.device, 'function', 'SENS:FUNC "{}"'.format(type))
 
     def update_voltage_range(self, range):
         if range == 'AUTO':
-            self.device.write('SENS:VOLT:DC:RANG:AUTO ON')
+            self.cache.write(self.device, 'voltage_range', 'SENS:VOLT:DC:RANG:AUTO ON')
         else:
-            self.device.write('SENS:VOLT:DC:RANG:AUTO OFF')
-            self.device.write(f'SENS:VOLT:DC:RANG {range}')
+            self.cache.write(self.device, 'voltage_range', 'SENS:VOLT:DC:RANG:AUTO OFF', f'SENS:VOLT:DC:RANG {range}')
 
     def update_current_range(self, range):
         if range == 'AUTO':
-            self.device.write('SENS:CURR:DC:RANG:AUTO ON')
+            self.cache.write(self.device, 'current_range', 'SENS:CURR:DC:RANG:AUTO ON')
         else:
-            self.device.write('SENS:CURR:DC:RANG:AUTO OFF')
-            self.device.write(f'SENS:CURR:DC:RANG {range}')
+            self.cache.write(self.device, 'current_range', 'SENS:CURR:DC:RANG:AUTO OFF', f'SENS:CURR:DC:RANG {range}')
 
     def update_resistance_range(self, range):
         if range == 'AUTO':
-            self.device.write('SENS:RES:RANG:AUTO ON')
+            self.cache.write(self.device, 'resistance_range', 'SENS:RES:RANG:AUTO ON')
         else:
-            self.device.write('SENS:RES:RANG:AUTO OFF')
-            self.device.write(f'SENS:RES:RANG {range}')
+            self.cache.write(self.device, 'resistance_range', 'SENS:RES:RANG:AUTO OFF', f'SENS:RES:RANG {range}')
  
     def update_filter(self, filter, filter_type, filter_num):
-        
-        if filter:
-            self.device.write(f'SENS:{self.type}:AVER:STAT ON')
-        else:
-            self.device.write(f'SENS:{self.type}:AVER:STAT OFF')
-        self.device.write(f'SENS:{self.type}:AVER:COUNT {str(filter_num)}')
-        if filter_type == 'Moving Average':
-            self.device.write(f'SENS:{self.type}:AVER:TCON MOV')
-        elif filter_type == 'Repeat Average':
-            self.device.write(f'SENS:{self.type}:AVER:TCON REP')
+        with self.transaction():
+            if filter:
+                self.cache.write(self.device, 'filter_enable', f'SENS:{self.type}:AVER:STAT ON')
+            else:
+                self.cache.write(self.device, 'filter_enable', f'SENS:{self.type}:AVER:STAT OFF')
+            self.cache.write(self.device, 'filter_count', f'SENS:{self.type}:AVER:COUNT {str(filter_num)}')
+            if filter_type == 'Moving Average':
+                self.cache.write(self.device, 'filter_type', f'SENS:{self.type}:AVER:TCON MOV')
+            elif filter_type == 'Repeat Average':
+                self.cache.write(self.device, 'filter_type', f'SENS:{self.type}:AVER:TCON REP')
+
+    def set_burst(self, burst_mode, burst_count):
+        # Enables or disables the burst mode. The device is only configured when the measurement starts (configure_burst)
+        self.burst_mode = burst_mode
+        self.burst_count = int(burst_count)
+        if not burst_mode:
+            with self.transaction(): # Back to single readings with READ?
+                self.cache.write(self.device, 'sample_count', 'SAMP:COUN 1')
+                self.cache.write(self.device, 'buffer_feed', 'TRAC:FEED NONE')
+                self.cache.write(self.device, 'elements', 'FORM:ELEM READ')
+
+    def configure_burst(self):
+        # Sets up the sample count and the internal buffer, so one INIT collects burst_count readings (max. 1024) with their timestamps
+        with self.transaction():
+            self.cache.write(self.device, 'trigger', 'TRIG:SOUR IMM', 'TRIG:COUN 1')
+            self.cache.write(self.device, 'sample_count', f'SAMP:COUN {self.burst_count}')
+            self.cache.write(self.device, 'buffer_points', f'TRAC:POIN {self.burst_count}')
+            self.cache.write(self.device, 'buffer_feed', 'TRAC:FEED SENS')
+            self.cache.write(self.device, 'elements', 'FORM:ELEM READ,TST')
+
+    def start_burst(self):
+        # Clears the buffer and starts the next burst. Does not wait for the readings, so the other devices can be read in the meantime
+        self.cache.touch()
+        self.device.write('TRAC:CLE;:TRAC:FEED:CONT NEXT;:INIT')
+
+    def fetch_burst(self):
+        # Waits for the running burst to finish and reads the whole buffer at once. Returns the timestamps [s] and the readings as arrays
+        self.cache.touch()
+        elements = parse_readings(self.device.query('*WAI;:TRAC:DATA?'))
+        return elements[1::2], elements[0::2]
         
 
 class K2200:
     def __init__(self, port, id, rm):
         self.device = rm.open_resource(port)
+        self.cache = StateCache() # Cache of the last written settings, to skip redundant writes
+        self.retry = RetryPolicy() # Recovery from transient communication errors
+        self.rm = rm
         self.port = port
         self.assigned_id = id
         self.reset()
         self.clear_buffer()
 
     def reset(self):
+        self.cache.clear()
         self.device.write('*RST')
 
     def clear_buffer(self):
-        self.device.write('*CLS')
+        self.cache.write(self.device, 'clear_buffer', '*CLS', volatile = True)
 
     def return_port(self):
         return self.port
@@ -168,35 +402,55 @@ class K2200:
     def close(self):
         self.device.close()
 
+    def transaction(self):
+        # Settings written inside "with device.transaction():" are sent as one message, errors are only checked once at the end
+        return self.cache.transaction(self.send_batch)
+
+    def send_batch(self, commands):
+        send_scpi_batch(self.device, commands, self.assigned_id)
+
     def enable_output(self, enable):
         if enable:
-            self.device.write('OUTPUT ON')
+            self.cache.write(self.device, 'output', 'OUTPUT ON')
         else:
-            self.device.write('OUTPUT OFF')
+            self.cache.write(self.device, 'output', 'OUTPUT OFF')
     
     def set_limit(self, limitI):
-        self.device.write('CURR {:.4f}'.format(limitI))
+        self.cache.write(self.device, 'limit', 'CURR {:.4f}'.format(limitI))
 
     def set_voltage(self, voltage):
-            self.device.write('VOLT {:.4f}'.format(abs(voltage)))
+            self.cache.write(self.device, 'voltage', 'VOLT {:.4f}'.format(abs(voltage)))
     
     def measure_current(self):
+        self.cache.touch()
         current = float(self.device.query('MEAS:CURR?').strip('\n'))
         return current
 
     def measure_voltage(self):
+        self.cache.touch()
         voltage = float(self.device.query('MEAS:VOLT?').strip('\n'))
         return voltage
 
 class K2400:
+    CURRENT_RANGES = [1e-8, 1e-7, 1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.0] # Measure ranges [A], used by the predictive ranging
+    NPLC_LIMITS = (0.01, 10) # Shortest and longest integration time, used by the adaptive NPLC
+
     def __init__(self, port, id, rm):
         self.device = rm.open_resource(port)
+        self.cache = StateCache() # Cache of the last written settings, to skip redundant writes
+        self.retry = RetryPolicy() # Recovery from transient communication errors
+        self.rm = rm
         self.port = port
         self.assigned_id = id
+        self.predictive_ranging = False
+        self.adaptive_nplc = False # The NPLC is chosen for every voltage step by the measurement (see measurement_thread.NplcController)
+        self.noise_target = 0.1 # Noise of a reading relative to the current [%] for the adaptive NPLC
         self.settings = { #Standard settings for the Keithley 2400 (loaded when the device is connected)
             'voltage_range': 'Auto',
             'current_range': 'Auto',
             'nplc': 1,
+            'adaptive_nplc': False,
+            'noise_target': 0.1,
             'high_capacitance': False,
             'use_filter': False,
             'filter_num': 10,
@@ -205,16 +459,15 @@ class K2400:
         }
         self.reset()
         self.clear_buffer()
-        self.device.write(':SOUR:FUNC VOLT') # Sets Source to voltage mode (needed for IV Curves)
-        self.device.write(':SOUR:VOLT 0') #Sets the output voltage to 0
+        self.cache.write(self.device, 'source_function', ':SOUR:FUNC VOLT') # Sets Source to voltage mode (needed for IV Curves)
+        self.set_voltage(0) #Sets the output voltage to 0
 
     def reset(self):
+        self.cache.clear()
         self.device.write('*RST')
 
     def clear_buffer(self):
-        self.device.write('*CLS')
-        self.device.write('TRAC:CLE "defbuffer1"')
-        self.device.write('TRAC:CLE "defbuffer2"')
+        self.cache.write(self.device, 'clear_buffer', '*CLS', 'TRAC:CLE "defbuffer1"', 'TRAC:CLE "defbuffer2"', volatile = True)
 
     def return_port(self):
         return self.port
@@ -228,89 +481,164 @@ class K2400:
     def close(self):
         self.device.close()
 
+    def transaction(self):
+        # Settings written inside "with device.transaction():" are sent as one message, errors are only checked once at the end
+        return self.cache.transaction(self.send_batch)
+
+    def send_batch(self, commands):
+        send_scpi_batch(self.device, commands, self.assigned_id)
+
     def enable_highC(self, highC):
         if highC:
-            self.device.write(':SOUR:VOLT:HIGH:CAP ON')
+            self.cache.write(self.device, 'high_capacitance', ':SOUR:VOLT:HIGH:CAP ON')
         else:
-            self.device.write(':SOUR:VOLT:HIGH:CAP OFF')
+            self.cache.write(self.device, 'high_capacitance', ':SOUR:VOLT:HIGH:CAP OFF')
     
     def set_voltage_range(self, range):
         if range == 'Auto':
-            self.device.write(':SOUR:VOLT:RANG:AUTO ON')
+            self.cache.write(self.device, 'voltage_range', ':SOUR:VOLT:RANG:AUTO ON')
         else:
-            self.device.write(':SOUR:VOLT:RANG:AUTO OFF')
-            self.device.write(f':SOUR:VOLT:RANG {range}')
+            self.cache.write(self.device, 'voltage_range', ':SOUR:VOLT:RANG:AUTO OFF', f':SOUR:VOLT:RANG {range}')
     
     def set_current_range(self, range):
+        # 'Predictive': the measurement sets a fixed range before every reading from the expected current (see measurement_thread.RangePredictor)
+        self.predictive_ranging = range == 'Predictive'
+        self.set_measure_range('Auto' if self.predictive_ranging else range)
+
+    def set_measure_range(self, range):
         if range == 'Auto':
-            self.device.write(':SENS:CURR:RANG:AUTO ON')
+            self.cache.write(self.device, 'current_range', ':SENS:CURR:RANG:AUTO ON')
         else:
-            self.device.write(':SENS:CURR:RANG:AUTO OFF')
-            self.device.write(f':SENS:CURR:RANG {range}')
+            self.cache.write(self.device, 'current_range', ':SENS:CURR:RANG:AUTO OFF', f':SENS:CURR:RANG {range}')
 
     def set_filter(self, filter, filter_type, filter_num):
-        self.device.write(f':SENS:CURR:AVER:COUN {str(filter_num)}')
-        if filter_type == 'Moving Average':
-            self.device.write(f':SENS:CURR:AVER:TCON MOV')
-        elif filter_type == 'Repeat Average':
-            self.device.write(f':SENS:CURR:AVER:TCON REP')
-        if filter:
-            self.device.write(':SENS:CURR:AVER ON')
-        else:
-            self.device.write(':SENS:CURR:AVER OFF')
+        with self.transaction():
+            self.cache.write(self.device, 'filter_count', f':SENS:CURR:AVER:COUN {str(filter_num)}')
+            if filter_type == 'Moving Average':
+                self.cache.write(self.device, 'filter_type', f':SENS:CURR:AVER:TCON MOV')
+            elif filter_type == 'Repeat Average':
+                self.cache.write(self.device, 'filter_type', f':SENS:CURR:AVER:TCON REP')
+            if filter:
+                self.cache.write(self.device, 'filter_enable', ':SENS:CURR:AVER ON')
+            else:
+                self.cache.write(self.device, 'filter_enable', ':SENS:CURR:AVER OFF')
 
     def set_nplc(self, nplc):
-        self.device.write(f':SENS:CURR:NPLC {str(nplc)}')
+        self.cache.write(self.device, 'nplc', f':SENS:CURR:NPLC {str(nplc)}')
+
+    def set_adaptive_nplc(self, adaptive, noise_target):
+        self.adaptive_nplc = adaptive
+        self.noise_target = noise_target
 
     def set_auto_zero(self, auto_zero):
         if auto_zero:
-            self.device.write(':SENS:CURR:AZER ON')
+            self.cache.write(self.device, 'auto_zero', ':SENS:CURR:AZER ON')
         else:
-            self.device.write(':SENS:CURR:AZER OFF')
+            self.cache.write(self.device, 'auto_zero', ':SENS:CURR:AZER OFF')
 
     def enable_output(self, enable):
         if enable:
-            self.device.write(':OUTP ON')
+            self.cache.write(self.device, 'output', ':OUTP ON')
         else:
-            self.device.write(':OUTP OFF')
+            self.cache.write(self.device, 'output', ':OUTP OFF')
 
     def set_limit(self, limitI):
-        self.device.write(f':SOUR:VOLT:ILIM {str(limitI)}')
+        self.cache.write(self.device, 'limit', f':SOUR:VOLT:ILIM {str(limitI)}')
 
     def set_voltage(self, voltage):
-        self.device.write(f':SOUR:VOLT {str(voltage)}')
+        self.cache.write(self.device, 'voltage', f':SOUR:VOLT {str(voltage)}')
 
     def measure_current(self):
+        self.cache.touch()
         current = float(self.device.query(':MEAS:CURR?').strip('\n'))
         return current
 
     def measure_voltage(self):
+        self.cache.touch()
         voltage = float(self.device.query(':MEAS:VOLT?').strip('\n'))
         return voltage
 
+LOG_SCRIPT = '''function log_start(interval)
+{abort}
+{setup}
+trigger.timer[1].delay = interval trigger.timer[1].count = 0 trigger.timer[1].passthrough = true trigger.timer[1].stimulus = smua.trigger.ARMED_EVENT_ID
+{initiate}
+end
+function log_fetch(first, count)
+local n = {count}
+print(n, smua.nvbuffer1.basetimestamp)
+if n >= first then printbuffer(first, math.min(n, first + count - 1), smua.nvbuffer1.timestamps, {readings}) end
+end'''
+LOG_SETUP = ('{ch}.nvbuffer1.clear() {ch}.nvbuffer1.appendmode = 1 {ch}.nvbuffer1.collecttimestamps = 1 {ch}.nvbuffer1.fillmode = {ch}.FILL_ONCE '
+             '{ch}.trigger.source.action = {ch}.DISABLE {ch}.trigger.measure.action = {ch}.ENABLE {ch}.trigger.measure.i({ch}.nvbuffer1) '
+             '{ch}.trigger.measure.stimulus = trigger.timer[1].EVENT_ID {ch}.trigger.endpulse.action = {ch}.SOURCE_HOLD {ch}.trigger.endsweep.action = {ch}.SOURCE_HOLD '
+             '{ch}.trigger.arm.count = 1 {ch}.trigger.count = 0')
+LOG_FETCH_MAX = 5000 # Maximum number of buffer entries fetched with one query
+LOG_RESTART = 0.8 # The buffer is cleared and restarted, when it is filled to this fraction and all entries were fetched
+
 class K2600: #K2600 SMU (up to 200V bias Voltage)
+    #Dual-channel models (2602, 2604, 2612, 2614, 2634, 2636) measure two DUTs in parallel: both channels get the same settings and voltage,
+    #every channel has its own voltage and current column in the data (see smu_channels)
+    #In logging mode (Constant Voltage measurements) a script on the instrument samples the current at a fixed interval into nvbuffer1 with timestamps,
+    #the PC only fetches the new entries in bulk (read_block), so gaps on the PC side do not leave gaps in the data
+    CURRENT_RANGES = [1e-7, 1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.0, 1.5] # Measure ranges [A], used by the predictive ranging
+    NPLC_LIMITS = (0.001, 25) # Shortest and longest integration time, used by the adaptive NPLC
+
     def __init__(self, port, id, rm):
         self.device = rm.open_resource(port)
+        self.cache = StateCache() # Cache of the last written settings, to skip redundant writes
+        self.retry = RetryPolicy() # Recovery from transient communication errors
+        self.rm = rm
         self.port = port
         self.assigned_id = id
+        self.dual_channel = re.search(r'Model 26\d[246]', id, re.IGNORECASE) is not None # The model number is part of the id (*IDN?)
+        self.channels = ['smua', 'smub'] if self.dual_channel else ['smua']
+        self.voltage = 0
+        self.buffered = False # Logging mode, same interface as the buffered mode of the K6487 (configure_block, start_block, read_block)
+        self.log_interval = 1.0 # Sample interval of the logging script [s]
+        self.logging = False # The logging script is sampling
+        self.predictive_ranging = False
+        self.adaptive_nplc = False # The NPLC is chosen for every voltage step by the measurement (see measurement_thread.NplcController)
+        self.noise_target = 0.1 # Noise of a reading relative to the current [%] for the adaptive NPLC
         self.reset()
         self.settings = { #Standard settings for the Keithley 2600 (loaded when the device is connected)
             'voltage_range': 'Auto',
             'current_range': 'Auto',
             'nplc': 1,
+            'adaptive_nplc': False,
+            'noise_target': 0.1,
             'high_capacitance': False,
             'use_filter': False,
             'filter_num': 10,
             'filter_type': 'Moving Average',
             'auto_zero': True,
+            'use_smub': self.dual_channel,
+            'logging': False,
+            'log_interval': 1.0,
         }
 
+    def tsp(self, statement):
+        # Repeats a TSP statement for all used channels ({ch} is replaced by the channel), so they are sent as one chunk
+        return ' '.join(statement.format(ch = channel) for channel in self.channels)
+
     def reset(self):
+        self.cache.clear()
+        self.set_voltage(0)
+        self.enable_output(False)
+
+    def use_smub(self, use):
+        # Dual-channel models: measures the second channel as well. An unused channel is set to 0 V and switched off
+        if not self.dual_channel or use == ('smub' in self.channels):
+            return
+        if not use:
+            self.device.write('smub.source.levelv=0 smub.source.output = smub.OUTPUT_OFF')
+        self.channels = ['smua', 'smub'] if use else ['smua']
+        self.cache.invalidate() # The cached commands were written for the other channels, the settings have to be applied again (see ParameterDialog_K2600)
         self.set_voltage(0)
         self.enable_output(False)
 
     def clear_buffer(self):
-        self.device.write('*CLS')
+        self.cache.write(self.device, 'clear_buffer', '*CLS', volatile = True)
 
     def return_port(self):
         return self.port
@@ -324,57 +652,167 @@ class K2600: #K2600 SMU (up to 200V bias Voltage)
     def close(self):
         self.device.close()
 
+    def transaction(self):
+        # Settings written inside "with device.transaction():" are sent as one TSP chunk, errors are only checked once at the end
+        return self.cache.transaction(self.send_batch)
+
+    def send_batch(self, commands):
+        # Common commands (e.g. *CLS) are no TSP statements and have to be sent on their own, all other commands are sent as one chunk
+        chunk = ' '.join(command for command in commands if not command.startswith('*'))
+        for command in commands:
+            if command.startswith('*'):
+                self.device.write(command)
+        self.device.write('errorqueue.clear()') # Only errors of this batch are reported
+        if chunk:
+            self.device.write(chunk)
+        self.check_errors()
+
+    def check_errors(self):
+        # Reads the whole error queue in one query, so no stale entries are left for the next batch
+        answer = self.device.query(f'waitcomplete() local errors = "" local n = 0 while errorqueue.count > 0 and n < {MAX_ERRORS} do local code, message = errorqueue.next() errors = errors .. code .. " " .. message .. "; " n = n + 1 end errorqueue.clear() print("errors: " .. errors)').strip()
+        errors = answer[len('errors:'):].strip().rstrip(';') if answer.startswith('errors:') else answer
+        if errors:
+            raise RuntimeError(f'{self.assigned_id}: configuration failed with {errors}')
+
     def enable_output(self, enable):
         if enable:
-            self.device.write('smua.source.output = smua.OUTPUT_ON')
+            self.cache.write(self.device, 'output', self.tsp('{ch}.source.output = {ch}.OUTPUT_ON'))
         else:
-            self.device.write('smua.source.output = smua.OUTPUT_OFF')
+            self.cache.write(self.device, 'output', self.tsp('{ch}.source.output = {ch}.OUTPUT_OFF'))
 
     def set_limit(self, limitI):
-        self.device.write(f'smua.source.limiti= {str(limitI)}')   
+        self.cache.write(self.device, 'limit', self.tsp('{ch}.source.limiti= ' + str(limitI)))
 
     def enable_highC(self, highC): #In normal operation, the SMU in the Series 2600A can drive capacitive loads as large as 10 nF. In 
         #high-capacitance mode, the SMU can drive a maximum of 50 μF of capacitance.
         if highC:
-            self.device.write('smua.source.highc = smua.ENABLE')
+            self.cache.write(self.device, 'high_capacitance', self.tsp('{ch}.source.highc = {ch}.ENABLE'))
         else:
-            self.device.write('smua.source.highc = smua.DISABLE')
+            self.cache.write(self.device, 'high_capacitance', self.tsp('{ch}.source.highc = {ch}.DISABLE'))
 
     def set_current_range(self, range):
+        # 'Predictive': the measurement sets a fixed range before every reading from the expected current (see measurement_thread.RangePredictor)
+        self.predictive_ranging = range == 'Predictive'
+        self.set_measure_range('Auto' if self.predictive_ranging else range)
+
+    def set_measure_range(self, range):
         if range == 'Auto':
-            self.device.write('smua.measure.autorangei = smua.AUTORANGE_ON')
+            self.cache.write(self.device, 'current_range', self.tsp('{ch}.measure.autorangei = {ch}.AUTORANGE_ON'))
         else:
-            self.device.write('smua.measure.autorangei = smua.AUTORANGE_OFF')
-            self.device.write('smua.measure.rangei = {}'.format(range))
+            self.cache.write(self.device, 'current_range', self.tsp('{ch}.measure.autorangei = {ch}.AUTORANGE_OFF'), self.tsp('{ch}.measure.rangei = ' + str(range)))
 
     def set_voltage_range(self, range):
         if range == 'Auto':
-            self.device.write('smua.source.autorangev = smua.AUTORANGE_ON')
+            self.cache.write(self.device, 'voltage_range', self.tsp('{ch}.source.autorangev = {ch}.AUTORANGE_ON'))
         else:
-            self.device.write('smua.source.autorangev = smua.AUTORANGE_OFF')
-            self.device.write('smua.source.rangev = {}'.format(range))
+            self.cache.write(self.device, 'voltage_range', self.tsp('{ch}.source.autorangev = {ch}.AUTORANGE_OFF'), self.tsp('{ch}.source.rangev = ' + str(range)))
+
+    def set_nplc(self, nplc):
+        self.cache.write(self.device, 'nplc', self.tsp('{ch}.measure.nplc = ' + str(nplc)))
+
+    def set_adaptive_nplc(self, adaptive, noise_target):
+        self.adaptive_nplc = adaptive
+        self.noise_target = noise_target
 
     def set_filter(self, filter, filter_type, filter_num):
-        self.device.write(f'smua.measure.filter.count = {str(filter_num)}')
-        if filter_type == 'Moving Average':
-            self.device.write('smua.measure.filter.type = smua.FILTER_MOVING_AVG')
-        elif filter_type == 'Repeat Average':
-            self.device.write('smua.measure.filter.type = smua.FILTER_REPEAT_AVG')
-        elif filter_type == 'Median':
-            self.device.write('smua.measure.filter.type = smua.FILTER_MEDIAN')
-        if filter:
-            self.device.write('smua.measure.filter.enable = smua.FILTER_ON')
-        else:
-            self.device.write('smua.measure.filter.enable = smua.FILTER_OFF')
+        with self.transaction():
+            self.cache.write(self.device, 'filter_count', self.tsp('{ch}.measure.filter.count = ' + str(filter_num)))
+            if filter_type == 'Moving Average':
+                self.cache.write(self.device, 'filter_type', self.tsp('{ch}.measure.filter.type = {ch}.FILTER_MOVING_AVG'))
+            elif filter_type == 'Repeat Average':
+                self.cache.write(self.device, 'filter_type', self.tsp('{ch}.measure.filter.type = {ch}.FILTER_REPEAT_AVG'))
+            elif filter_type == 'Median':
+                self.cache.write(self.device, 'filter_type', self.tsp('{ch}.measure.filter.type = {ch}.FILTER_MEDIAN'))
+            if filter:
+                self.cache.write(self.device, 'filter_enable', self.tsp('{ch}.measure.filter.enable = {ch}.FILTER_ON'))
+            else:
+                self.cache.write(self.device, 'filter_enable', self.tsp('{ch}.measure.filter.enable = {ch}.FILTER_OFF'))
 
     def set_voltage(self, voltage):
-        self.device.write('smua.source.levelv={:.1f}'.format(voltage))
+        self.cache.write(self.device, 'voltage', self.tsp('{ch}.source.levelv=' + '{:.1f}'.format(voltage)))
+        self.voltage = voltage
+
+    def set_logging(self, logging, interval):
+        # Enables or disables the logging mode. The script is only loaded when the measurement starts (configure_block)
+        self.buffered = logging
+        self.log_interval = float(interval)
+
+    def configure_block(self):
+        # Loads the logging script into the instrument. It defines log_start (starts the trigger model, one current reading per channel every interval)
+        # and log_fetch (prints the number of readings, the time of the first one and the requested entries of the buffers)
+        self.stop_block()
+        script = LOG_SCRIPT.format(
+            abort = self.tsp('{ch}.abort()'),
+            setup = '\n'.join(LOG_SETUP.format(ch = channel) for channel in self.channels),
+            initiate = self.tsp('{ch}.trigger.initiate()'),
+            count = 'math.min(' + ', '.join(f'{channel}.nvbuffer1.n' for channel in self.channels) + ')' if len(self.channels) > 1 else 'smua.nvbuffer1.n',
+            readings = ', '.join(f'{channel}.nvbuffer1.readings' for channel in self.channels))
+        self.device.write('errorqueue.clear()')
+        self.device.write('loadscript StressLog')
+        for line in script.splitlines():
+            self.device.write(line)
+        self.device.write('endscript')
+        self.device.write('StressLog()') # Defines the functions
+        self.check_errors()
+        self.log_capacity = int(float(self.device.query('print(smua.nvbuffer1.capacity)')))
+
+    def start_block(self):
+        # Starts the logging script, if it is not running yet. It keeps sampling until stop_block, the entries are fetched with read_block
+        if self.logging:
+            return
+        self.cache.touch()
+        self.device.write(f'log_start({self.log_interval})')
+        self.logging = True
+        self.log_next = 1 # Next buffer entry to fetch
+        self.log_origin = None # Time of the first reading of the measurement, the timestamps are relative to it
+
+    def read_block(self):
+        # Fetches the buffer entries added since the last call (at most LOG_FETCH_MAX). Returns the timestamps [s] and the currents [A] with one column per channel
+        # When the buffer is mostly filled and all entries were fetched, it is cleared and the script restarted (one sample interval is lost)
+        self.cache.touch()
+        n, base = [float(value) for value in self.device.query(f'log_fetch({self.log_next}, {LOG_FETCH_MAX})').split()]
+        n = int(n)
+        entries = np.empty((0, 1 + len(self.channels)))
+        if n >= self.log_next:
+            entries = parse_readings(self.device.read()).reshape(-1, 1 + len(self.channels))
+            if self.log_origin is None:
+                self.log_origin = base
+            self.log_next += len(entries)
+        if n >= self.log_capacity:
+            print(f'{self.assigned_id}: the logging buffer was full, readings were lost. Fetch the data more often (time between measurements)')
+        if self.logging and self.log_next > n and n >= LOG_RESTART*self.log_capacity:
+            self.device.write(f'log_start({self.log_interval})')
+            self.log_next = 1
+        return entries[:, 0] + (base - (self.log_origin if self.log_origin is not None else base)), entries[:, 1:]
+
+    def stop_block(self):
+        # Stops the logging script, the buffer keeps its readings
+        if self.logging:
+            self.device.write(self.tsp('{ch}.abort()'))
+            self.logging = False
+
+    def measure_iv(self):
+        # Measures voltage and current of all channels in one TSP chunk (one round trip), returns [voltage, current] for every channel
+        # measure.iv() returns the current first
+        self.stop_block()
+        self.cache.touch()
+        measure = ' '.join(f'i_{channel}, v_{channel} = {channel}.measure.iv()' for channel in self.channels)
+        values = ', '.join(f'v_{channel}, i_{channel}' for channel in self.channels)
+        answer = self.device.query(f'{measure} print({values})').split()
+        if len(answer) != 2*len(self.channels):
+            raise ValueError(f'{self.assigned_id}: unexpected answer {answer}')
+        return [float(value) for value in answer]
 
     def measure_current(self):
+        self.stop_block()
+        self.cache.touch()
         current = self.device.query('print(smua.measure.i())').strip('\n')
         return current
     
     def measure_voltage(self):
+        if self.logging: # The script is measuring, the voltage is the source level
+            return self.voltage
+        self.cache.touch()
         voltage = self.device.query('print(smua.measure.v())').strip('\n')
         return voltage
     
@@ -382,23 +820,35 @@ class K2600: #K2600 SMU (up to 200V bias Voltage)
 class K6487: #K6487 Voltage source/piccoammeter 
     def __init__(self, port, id, rm):
         self.device = rm.open_resource(port)
+        self.cache = StateCache() # Cache of the last written settings, to skip redundant writes
+        self.retry = RetryPolicy() # Recovery from transient communication errors
+        self.rm = rm
         self.port = port
         self.assigned_id = id
         self.reset()
         self.voltage = 0 #As the device can only measure current, the voltage that is returned is the same as the set voltage.
         self.settings = { #Standard settings for the Keithley 6487 (loaded when the device is connected)
+            'current_range': 'Auto',
+            'nplc': 1,
+            'auto_zero': True,
+            'buffered': False,
+            'buffer_count': 100,
             }
+        self.buffered = False # In buffered mode the device collects buffer_count readings on its own, which are fetched as one block (only used for Constant Voltage measurements)
+        self.buffer_count = 100
     
     def reset(self):
+        self.single_mode = False # Set up for single readings (configure_single), changed by configure_block and by a reset
+        self.cache.clear()
         self.device.write('*RST')
         self.device.write('SOUR:FUNC VOLT')
-        self.device.write('SOUR:VOLT 0')
-        self.device.write('SOUR:VOLT:STAT OFF')
-        self.device.write('SOUR:VOLT:RANGE 500')
+        self.set_voltage(0)
+        self.enable_output(False)
+        self.cache.write(self.device, 'voltage_range', 'SOUR:VOLT:RANGE 500')
         
     
     def clear_buffer(self):
-        self.device.write('*CLS')
+        self.cache.write(self.device, 'clear_buffer', '*CLS', volatile = True)
 
     def return_port(self):
         return self.port
@@ -412,21 +862,88 @@ class K6487: #K6487 Voltage source/piccoammeter
     def close(self):
         self.device.close()
 
+    def transaction(self):
+        # Settings written inside "with device.transaction():" are sent as one message, errors are only checked once at the end
+        return self.cache.transaction(self.send_batch)
+
+    def send_batch(self, commands):
+        send_scpi_batch(self.device, commands, self.assigned_id)
+
     def enable_output(self, enable):
         if enable:
-            self.device.write('SOUR:VOLT:STAT ON')
+            self.cache.write(self.device, 'output', 'SOUR:VOLT:STAT ON')
         else:
-            self.device.write('SOUR:VOLT:STAT OFF')
+            self.cache.write(self.device, 'output', 'SOUR:VOLT:STAT OFF')
 
     def set_limit(self, limitI):
-        self.device.write(f'SOUR:VOLT:ILIM {limitI}')
+        self.cache.write(self.device, 'limit', f'SOUR:VOLT:ILIM {limitI}')
         return
     
     def set_voltage(self, voltage):
-        self.device.write(f'SOUR:VOLT {voltage}')
+        self.cache.write(self.device, 'voltage', f'SOUR:VOLT {voltage}')
         self.voltage = voltage
 
+    def set_current_range(self, range):
+        if range == 'Auto':
+            self.cache.write(self.device, 'current_range', 'SENS:CURR:RANG:AUTO ON')
+        else:
+            self.cache.write(self.device, 'current_range', 'SENS:CURR:RANG:AUTO OFF', f'SENS:CURR:RANG {range}')
+
+    def set_nplc(self, nplc):
+        self.cache.write(self.device, 'nplc', f'SENS:CURR:NPLC {str(nplc)}')
+
+    def set_auto_zero(self, auto_zero):
+        if auto_zero:
+            self.cache.write(self.device, 'auto_zero', 'SYST:AZER ON')
+        else:
+            self.cache.write(self.device, 'auto_zero', 'SYST:AZER OFF')
+
+    def disable_zero_check(self):
+        # Zero check is enabled after a reset and shorts the input, readings taken with it are meaningless. As the state is cached, this is only sent once after a reset
+        self.cache.write(self.device, 'zero_check', 'SYST:ZCH OFF')
+
+    def set_buffer(self, buffered, buffer_count):
+        # Enables or disables the buffered mode. The device is only configured when the measurement starts (configure_block)
+        self.buffered = buffered
+        self.buffer_count = int(buffer_count)
+        if not buffered:
+            self.configure_single()
+
+    def configure_single(self):
+        # Sets up the device for single readings with READ?. Only needed after a reset, a block or when the state of the device is unknown
+        self.single_mode = True
+        with self.transaction():
+            self.disable_zero_check()
+            self.cache.write(self.device, 'trigger_count', 'TRIG:COUN 1')
+            self.cache.write(self.device, 'buffer_feed', 'TRAC:FEED:CONT NEV')
+            self.cache.write(self.device, 'display', 'DISP:ENAB ON')
+
+    def configure_block(self):
+        # Sets up the trigger count and the buffer, so one INIT collects buffer_count readings (max. 3000) with their timestamps as fast as the NPLC allows
+        self.single_mode = False
+        with self.transaction():
+            self.disable_zero_check()
+            self.cache.write(self.device, 'elements', 'FORM:ELEM READ,TIME')
+            self.cache.write(self.device, 'trigger', 'TRIG:SOUR IMM', 'TRIG:DEL 0')
+            self.cache.write(self.device, 'trigger_count', f'TRIG:COUN {self.buffer_count}')
+            self.cache.write(self.device, 'buffer_points', f'TRAC:POIN {self.buffer_count}', 'TRAC:FEED SENS')
+            self.cache.write(self.device, 'display', 'DISP:ENAB OFF') # Updating the display slows down fast acquisitions
+
+    def start_block(self):
+        # Clears the buffer and starts collecting the next block. Does not wait for the readings
+        self.cache.touch()
+        self.device.write('TRAC:CLE;:TRAC:FEED:CONT NEXT;:INIT')
+
+    def read_block(self):
+        # Waits for the running block to finish and reads the whole buffer at once. Returns the instrument timestamps [s] and the currents [A] as arrays
+        self.cache.touch()
+        elements = parse_readings(self.device.query('*WAI;:TRAC:DATA?'))
+        return elements[1::2], elements[0::2]
+
     def measure_current(self):
+        if not self.single_mode or 'trigger_count' not in self.cache.state: # The cache loses the mode when the state of the device becomes unknown
+            self.configure_single()
+        self.cache.touch()
         data = self.device.query('READ?')
         data = data.split(',')  
         current = float(data[0].strip('A'))
@@ -438,8 +955,10 @@ class K6487: #K6487 Voltage source/piccoammeter
 class LowVoltagePowerSupplies: #Rhode&Schwarz NGE 100 and HAMEG HMP4040 
     def __init__(self,  port, id, rm):
         self.device = rm.open_resource(port)
+        self.retry = RetryPolicy() # Recovery from transient communication errors
+        self.rm = rm
         self.port = port
-        self.return_assigned_id = id
+        self.assigned_id = id
         self.device.write('*RST')
         #Test if the device is a Rhode&Schwarz NGE 100 or a HAMEG HMP4040 by testing if channel 4 exists (only i  HAMEG). Should maybe be changed in seperate classes, if more functionallity is needed.
         self.device.write('INST:NSEL 4')
@@ -447,6 +966,7 @@ class LowVoltagePowerSupplies: #Rhode&Schwarz NGE 100 and HAMEG HMP4040
             self.number_of_channels = 4
         else:
             self.number_of_channels = 3
+        self.read_command = ';:'.join(f'INST:NSEL {i};:MEAS:VOLT?;:MEAS:CURR?' for i in range(1, self.number_of_channels + 1)) # Chained readout of all channels, built once as the number of channels does not change
         self.port = port
         self.settings = { #Standard settings for the Keithley 6487 (loaded when the device is connected)
             }
@@ -464,7 +984,7 @@ class LowVoltagePowerSupplies: #Rhode&Schwarz NGE 100 and HAMEG HMP4040
         return self.device.query('*IDN?')
     
     def return_assigned_id(self):
-        return self.return_assigned_id
+        return self.assigned_id
     
     def return_num_channels(self):
         return self.number_of_channels
@@ -473,23 +993,34 @@ class LowVoltagePowerSupplies: #Rhode&Schwarz NGE 100 and HAMEG HMP4040
         self.device.close()
 
     def read_output(self):
-        U = []
-        I = []
+        # Reads voltage and current of all channels in a single transaction. The channel select and measure commands of all channels are chained into one program message,
+        # the device answers with all values in one response message seperated by ';'.
+        # Returns a fixed width row [U_1, ..., U_n, I_1, ..., I_n], which matches the columns in DataSaver.write_header
+        values = self.device.query(self.read_command).strip().split(';')
+        if len(values) != 2*self.number_of_channels: # Some firmware versions do not answer chained queries, fall back to reading the channels one by one
+            return self.read_output_per_channel()
+        values = np.array(values, dtype = float)
+        return np.concatenate((values[0::2], values[1::2]))
+
+    def read_output_per_channel(self):
+        # Slow readout of all channels (2 queries per channel), only used if the chained readout fails
+        row = np.full(2*self.number_of_channels, np.nan)
         for i in range(self.number_of_channels):
-            self.device.write(f'INST:NSEL {i}')
-            I.append(float(self.device.query('MEAS:CURR?')))
-            U.append(float(self.device.query('MEAS:VOLT?')))
-        
-        return U, I
+            self.device.write(f'INST:NSEL {i+1}') # Channels are numbered starting at 1
+            row[i] = float(self.device.query('MEAS:VOLT?'))
+            row[self.number_of_channels + i] = float(self.device.query('MEAS:CURR?'))
+        return row
 
 class Hameg8118:
     def __init__(self, port, id, rm):
         self.device = rm.open_resource(port, read_termination='\r', write_termination='\r')
+        self.cache = StateCache() # Cache of the last written settings, to skip redundant writes
+        self.retry = RetryPolicy(attempts = 5, delay = 1) # The serial link of the Hameg is known to drop out from time to time
         self.rm = rm
         self.port = port
         self.assigned_id = id
         self.clear_buffer()
-        self.device.write('PMOD 6') # Sets the device to measure Impedance and Phase
+        self.cache.write(self.device, 'mode', 'PMOD 6') # Sets the device to measure Impedance and Phase
         self.settings = { #Standard settings for the Keithley 6487 (loaded when the device is connected)
             }
 
@@ -497,7 +1028,7 @@ class Hameg8118:
         pass #Does not work on Hameg8118 (breaks the communication)
         
     def clear_buffer(self):
-        self.device.write('*CLS')
+        self.cache.write(self.device, 'clear_buffer', '*CLS', volatile = True)
     
     def return_port(self):
         return self.port
@@ -515,7 +1046,7 @@ class Hameg8118:
         self.device.close()
     
     def set_frequency(self, frequency):
-        self.device.write(f'FREQ {frequency}')
+        self.cache.write(self.device, 'frequency', f'FREQ {frequency}')
 
     def set_voltage(self, voltage):
         pass 
@@ -535,28 +1066,21 @@ class Hameg8118:
         
     def query_failsave(self, command):
         # This function is used to query the device and handle timeouts
-        # It will try to reconnect to the device if a timeout occurs
-        # If the reconnection fails, it will raise an error which will result in the measurement being aborted, but as the device is not responding, thats the only feasible option. 
+        # After a timeout the session is reopened (the settings are restored) and the command is sent once more
+        # If this fails as well, the error is handed to the recovery of the measurement thread (retries with backoff, afterwards NaN)
+        self.cache.touch()
         try:
             ans = self.device.query(command)
             ans = ans.strip('\n')
             if ans == 'ERROR':
-                ans = self.decive.query(command) # If the device returns an error, try to query again
+                ans = self.device.query(command) # If the device returns an error, try to query again
                 ans = ans.strip('\n')
-
-                
         except pyvisa.errors.VisaIOError as e:
-            if 'timeout' in str(e):
-                print(f'{self.id} timeout, trying to reconnect.')
-                self.device = self.rm.open_resource(self.port, read_termination='\r', write_termination='\r')
-                self.device.write('PMOD 6')
-            else:
+            if 'timeout' not in str(e):
                 raise e
-            try:
-                ans = self.device.query('MEAS?')
-            except:
-                raise f'Reestablishing connection with {self.id} failed, measurement was aborted.'
-            
+            print(f'{self.assigned_id} timeout, trying to reconnect.')
+            reopen_session(self)
+            ans = self.device.query(command).strip('\n')
         return ans 
         
 
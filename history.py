@@ -0,0 +1,372 @@
+#This file contains the history browser, which overlays previous measurements (IV, CV and constant voltage) on the live plot
+#The files are parsed in a pool of worker threads, the GUI is never blocked. Parsed files and their decimated display versions are cached by path, modification time and size,
+#so files that were loaded once are shown again immediately (e.g. after changing the measurement type)
+#Files can also be found in the run catalog (catalog.py) by their settings, devices and column statistics
+from PyQt5 import QtCore
+from PyQt5.QtCore import QObject, pyqtSignal, Qt
+from PyQt5.QtGui import QColor
+from PyQt5.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QGridLayout, QPushButton, QListWidget, QListWidgetItem, QFileDialog, QLabel, QComboBox, QLineEdit, QDoubleSpinBox, QTableWidget, QTableWidgetItem, QAbstractItemView
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+import threading
+import os
+import numpy as np
+import data_handler
+import catalog
+
+MAX_DISPLAY_POINTS = 2000 #Maximum number of points of an overlay, longer series are decimated
+COLORS = ['#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf'] #Colors of the overlays (matplotlib tab colors, blue and orange are used by the live data)
+
+def decimate(x, y, max_points = MAX_DISPLAY_POINTS):
+    #Reduces a series to at most max_points points. The minimum and maximum of every bucket are kept, so peaks stay visible
+    if len(y) <= max_points:
+        return x, y
+    buckets = np.array_split(np.arange(len(y)), max_points // 2)
+    keep = []
+    for bucket in buckets:
+        values = y[bucket]
+        if np.all(np.isnan(values)):
+            continue
+        keep.extend(sorted({bucket[np.nanargmin(values)], bucket[np.nanargmax(values)]}))
+    return x[keep], y[keep]
+
+def join_curves(curves):
+    #Joins several curves into one series separated by NaN, so they are drawn with a single artist
+    x = []
+    y = []
+    for curve_x, curve_y in curves:
+        x.extend([curve_x, [np.nan]])
+        y.extend([curve_y, [np.nan]])
+    if not x:
+        return np.array([]), np.array([])
+    return np.concatenate(x), np.concatenate(y)
+
+def display_series(columns, plot_type):
+    #Returns the decimated series to overlay for the plot type as dict panel -> (x, y), or None if the file does not fit the plot type
+    #Panels: 'main' for IV and constant voltage, 'phase_voltage', 'impedance_voltage', 'phase_frequency' and 'impedance_frequency' for CV
+    is_cv = 'Impedance_LCR_0[Ohm]' in columns
+    if plot_type == 'CV':
+        if not is_cv:
+            return None
+        voltage = columns['Voltage_SMU_0[V]']
+        frequency = columns['Frequency_LCR_0[Hz]']
+        impedance = columns['Impedance_LCR_0[Ohm]']
+        phase = columns['Phase_LCR_0[Deg]']
+        curves = [np.flatnonzero(frequency == f) for f in np.unique(frequency)] #One curve per frequency
+        return {
+            'phase_voltage': join_curves(decimate(voltage[c], phase[c]) for c in curves),
+            'impedance_voltage': join_curves(decimate(voltage[c], impedance[c]) for c in curves),
+            'phase_frequency': decimate(frequency, phase),
+            'impedance_frequency': decimate(frequency, impedance),
+        }
+    if is_cv or 'Current_SMU_0[A]' not in columns:
+        return None
+    current = columns['Current_SMU_0[A]']
+    if plot_type == 'IV':
+        return {'main': decimate(columns['Voltage_SMU_0[V]'], current)}
+    return {'main': decimate(np.arange(len(current), dtype = float), current)} #Constant voltage: over the number of the measurement, like the live data
+
+class HistoryCache:
+    #Parsed files and their display series, keyed by path, modification time and size. The least recently used files are dropped first
+    def __init__(self, max_files = 512):
+        self.max_files = max_files
+        self.entries = OrderedDict()
+        self.lock = threading.Lock() #Used by the worker threads
+
+    def key(self, path):
+        stat = os.stat(path)
+        return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+    def get(self, path, plot_type):
+        #Returns the display series of the file for the plot type, the file is only parsed if it is not cached or has changed
+        key = self.key(path)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+        if entry is None:
+            entry = {'columns': data_handler.read_measurement(path), 'display': {}}
+            with self.lock:
+                self.entries[key] = entry
+                while len(self.entries) > self.max_files:
+                    self.entries.popitem(last = False)
+        if plot_type not in entry['display']:
+            entry['display'][plot_type] = display_series(entry['columns'], plot_type)
+        return entry['display'][plot_type]
+
+class HistoryLoader(QObject):
+    #Loads files in a pool of worker threads, the results are delivered to the GUI thread with the loaded signal
+    loaded_signal = pyqtSignal(str, str, object, str) #path, plot type, display series (or None), error message
+
+    def __init__(self, cache, workers = 4):
+        super().__init__()
+        self.cache = cache
+        self.pool = ThreadPoolExecutor(max_workers = workers)
+
+    def load(self, path, plot_type):
+        self.pool.submit(self.work, path, plot_type)
+
+    def work(self, path, plot_type):
+        try:
+            series = self.cache.get(path, plot_type)
+            self.loaded_signal.emit(path, plot_type, series, '')
+        except Exception as e:
+            self.loaded_signal.emit(path, plot_type, None, str(e))
+
+    def close(self):
+        self.pool.shutdown(wait = False, cancel_futures = True)
+
+class HistoryBrowser(QDialog):
+    #List of previous measurements, every checked file is overlaid on the live plot
+    def __init__(self, ui):
+        super().__init__()
+        self.ui = ui
+        self.setWindowTitle('Measurement History')
+        self.setGeometry(320, 180, 600, 500)
+        self.cache = HistoryCache()
+        self.loader = HistoryLoader(self.cache)
+        self.loader.loaded_signal.connect(self.show_loaded)
+        self.items = {} #List items by path
+        self.catalog_dialog = None #Created when it is opened the first time
+        self.setup_ui()
+
+    def setup_ui(self):
+        layout = QVBoxLayout(self)
+        layout.setAlignment(QtCore.Qt.AlignTop)
+
+        buttons = QHBoxLayout()
+        self.add_files_button = QPushButton('Add Files')
+        self.add_files_button.clicked.connect(self.add_files)
+        buttons.addWidget(self.add_files_button)
+        self.add_folder_button = QPushButton('Add Folder')
+        self.add_folder_button.clicked.connect(self.add_folder)
+        buttons.addWidget(self.add_folder_button)
+        self.show_all_button = QPushButton('Show All')
+        self.show_all_button.clicked.connect(lambda: self.set_all_visible(True))
+        buttons.addWidget(self.show_all_button)
+        self.hide_all_button = QPushButton('Hide All')
+        self.hide_all_button.clicked.connect(lambda: self.set_all_visible(False))
+        buttons.addWidget(self.hide_all_button)
+        self.remove_button = QPushButton('Remove Selected')
+        self.remove_button.clicked.connect(self.remove_selected)
+        buttons.addWidget(self.remove_button)
+        self.catalog_button = QPushButton('Search Catalog')
+        self.catalog_button.clicked.connect(self.show_catalog)
+        buttons.addWidget(self.catalog_button)
+        layout.addLayout(buttons)
+
+        self.file_list = QListWidget() #Checked files are shown in the plot, the text color is the color of the overlay
+        self.file_list.setSelectionMode(QListWidget.ExtendedSelection)
+        self.file_list.itemChanged.connect(self.toggle)
+        layout.addWidget(self.file_list)
+
+        self.status = QLabel('')
+        layout.addWidget(self.status)
+
+    def add_files(self):
+        files = QFileDialog.getOpenFileNames(self, 'Add Measurements', self.ui.data_path, 'Data files (*.csv *.dat *.txt *.gz *.zst);;All files (*)')[0]
+        self.add(files)
+
+    def add_folder(self):
+        folder = QFileDialog.getExistingDirectory(self, 'Add Folder', self.ui.data_path)
+        if folder:
+            files = sorted(os.path.join(folder, name) for name in os.listdir(folder) if data_handler.is_data_file(name))
+            self.add(files)
+
+    def add(self, files):
+        for path in files:
+            path = os.path.abspath(path)
+            if path in self.items:
+                continue
+            item = QListWidgetItem(os.path.basename(path))
+            item.setToolTip(path)
+            item.setData(Qt.UserRole, path)
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Checked)
+            color = COLORS[len(self.items) % len(COLORS)]
+            item.setData(Qt.UserRole + 1, color)
+            self.items[path] = item
+            self.file_list.blockSignals(True)
+            self.file_list.addItem(item)
+            self.file_list.blockSignals(False)
+        self.refresh()
+
+    def refresh(self):
+        #Requests the display series of all checked files for the current plot type (from the cache or the workers)
+        #Called when files are added, the measurement type or the plot backend changes
+        plot_type = self.ui.canvas.parameters['type']
+        pending = 0
+        for path, item in self.items.items():
+            if item.checkState() == Qt.Checked:
+                self.loader.load(path, plot_type)
+                pending += 1
+        self.status.setText(f'Loading {pending} files...' if pending else '')
+
+    def show_loaded(self, path, plot_type, series, error):
+        #Called in the GUI thread when a worker has loaded a file
+        item = self.items.get(path)
+        if item is None or plot_type != self.ui.canvas.parameters['type']:
+            return
+        name = os.path.basename(path)
+        if error:
+            item.setText(f'{name} (error: {error})')
+            return
+        if series is None:
+            item.setText(f'{name} (not a {plot_type} measurement)')
+            return
+        item.setText(name)
+        color = item.data(Qt.UserRole + 1)
+        item.setForeground(QColor(color))
+        self.ui.canvas.set_overlay(path, series, color, item.checkState() == Qt.Checked)
+        self.status.setText('')
+
+    def toggle(self, item):
+        #Shows or hides the overlay of the file, files that were not loaded yet are loaded
+        path = item.data(Qt.UserRole)
+        visible = item.checkState() == Qt.Checked
+        if not self.ui.canvas.set_overlay_visible(path, visible) and visible:
+            self.loader.load(path, self.ui.canvas.parameters['type'])
+
+    def set_all_visible(self, visible):
+        self.file_list.blockSignals(True)
+        for item in self.items.values():
+            item.setCheckState(Qt.Checked if visible else Qt.Unchecked)
+        self.file_list.blockSignals(False)
+        for item in self.items.values():
+            self.toggle(item)
+
+    def remove_selected(self):
+        for item in self.file_list.selectedItems():
+            path = item.data(Qt.UserRole)
+            self.ui.canvas.remove_overlay(path)
+            self.items.pop(path, None)
+            self.file_list.takeItem(self.file_list.row(item))
+
+    def show_catalog(self):
+        if self.catalog_dialog is None:
+            self.catalog_dialog = CatalogDialog(self)
+        self.catalog_dialog.show()
+        self.catalog_dialog.search()
+
+    def closeEvent(self, event):
+        #The browser is only hidden, the overlays stay in the plot
+        self.hide()
+        event.ignore()
+
+class CatalogDialog(QDialog):
+    #Searches the run catalog, the selected files are added to the history browser
+    scanned_signal = pyqtSignal(str) #Result of a folder scan in the background
+    COLUMNS = ['Started', 'Type', 'Max |V| [V]', 'Rows', 'File']
+
+    def __init__(self, browser):
+        super().__init__()
+        self.browser = browser
+        self.setWindowTitle('Run Catalog')
+        self.setGeometry(340, 200, 900, 500)
+        self.catalog = catalog.Catalog()
+        self.scanned_signal.connect(self.scan_finished)
+        self.setup_ui()
+
+    def setup_ui(self):
+        layout = QVBoxLayout(self)
+        filters = QGridLayout()
+        self.type_comboBox = QComboBox()
+        self.type_comboBox.addItems(['Any', 'IV', 'CV', 'Constant Voltage'])
+        filters.addWidget(QLabel('Type'), 0, 0)
+        filters.addWidget(self.type_comboBox, 0, 1)
+        self.name_edit = QLineEdit()
+        self.name_edit.setPlaceholderText('Part of the file name')
+        filters.addWidget(QLabel('Name'), 0, 2)
+        filters.addWidget(self.name_edit, 0, 3)
+        self.device_edit = QLineEdit()
+        self.device_edit.setPlaceholderText('Part of a device ID')
+        filters.addWidget(QLabel('Device'), 0, 4)
+        filters.addWidget(self.device_edit, 0, 5)
+        self.min_voltage_spinBox = QDoubleSpinBox()
+        self.min_voltage_spinBox.setRange(0, 100000)
+        self.min_voltage_spinBox.setSuffix(' V')
+        self.min_voltage_spinBox.setToolTip('Minimum of the maximum absolute target voltage of the run')
+        filters.addWidget(QLabel('Max |V| at least'), 1, 0)
+        filters.addWidget(self.min_voltage_spinBox, 1, 1)
+        self.where_edit = QLineEdit()
+        self.where_edit.setPlaceholderText('e.g. Current_SMU_0[A].max<1e-6; param.stepV=-5')
+        self.where_edit.setToolTip('Conditions separated by ";": <column>.<min|max|mean|count><op><value> or param.<key><op><value>')
+        filters.addWidget(QLabel('Conditions'), 1, 2)
+        filters.addWidget(self.where_edit, 1, 3, 1, 3)
+        layout.addLayout(filters)
+
+        buttons = QHBoxLayout()
+        self.search_button = QPushButton('Search')
+        self.search_button.clicked.connect(self.search)
+        buttons.addWidget(self.search_button)
+        self.scan_button = QPushButton('Scan Folder')
+        self.scan_button.setToolTip('Adds the new and changed data files below a folder to the catalog')
+        self.scan_button.clicked.connect(self.scan)
+        buttons.addWidget(self.scan_button)
+        self.add_button = QPushButton('Add Selected to History')
+        self.add_button.clicked.connect(self.add_selected)
+        buttons.addWidget(self.add_button)
+        layout.addLayout(buttons)
+
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        self.table.doubleClicked.connect(self.add_selected)
+        layout.addWidget(self.table)
+
+        self.status = QLabel('')
+        layout.addWidget(self.status)
+
+    def search(self):
+        measurement_type = self.type_comboBox.currentText()
+        where = [condition for condition in self.where_edit.text().split(';') if condition.strip()]
+        try:
+            runs = self.catalog.query(
+                measurement_type = None if measurement_type == 'Any' else measurement_type,
+                name = self.name_edit.text().strip(),
+                device = self.device_edit.text().strip(),
+                min_voltage = self.min_voltage_spinBox.value() or None,
+                where = where)
+        except ValueError as e:
+            self.status.setText(str(e))
+            return
+        self.table.setRowCount(len(runs))
+        for row, run in enumerate(runs):
+            voltage = f'{run["max_abs_voltage"]:g}' if run['max_abs_voltage'] is not None else ''
+            values = [catalog.format_started(run['started']), run['measurement_type'] or '', voltage, str(run['rows']), run['path']]
+            for column, value in enumerate(values):
+                item = QTableWidgetItem(value)
+                item.setToolTip(run['path'] + '\nDevices: ' + ', '.join(run['devices']))
+                self.table.setItem(row, column, item)
+        self.status.setText(f'{len(runs)} runs')
+
+    def scan(self):
+        folder = QFileDialog.getExistingDirectory(self, 'Scan Folder', self.browser.ui.data_path)
+        if not folder:
+            return
+        self.scan_button.setEnabled(False)
+        self.status.setText(f'Scanning {folder}...')
+        threading.Thread(target = self.scan_work, args = (folder,), daemon = True).start()
+
+    def scan_work(self, folder):
+        #Runs in a background thread with its own connection
+        try:
+            scan_catalog = catalog.Catalog(self.catalog.path)
+            try:
+                added, unchanged, removed, failed = scan_catalog.scan(folder)
+            finally:
+                scan_catalog.close()
+            self.scanned_signal.emit(f'{folder}: {added} added, {unchanged} unchanged, {removed} removed, {failed} failed')
+        except Exception as e:
+            self.scanned_signal.emit(f'{folder} could not be scanned: {e}')
+
+    def scan_finished(self, message):
+        self.scan_button.setEnabled(True)
+        self.search()
+        self.status.setText(message)
+
+    def add_selected(self):
+        rows = sorted({index.row() for index in self.table.selectedIndexes()})
+        self.browser.add([self.table.item(row, len(self.COLUMNS) - 1).text() for row in rows])
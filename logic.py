@@ -3,15 +3,21 @@ from PyQt5 import QtCore, QtGui
 from PyQt5.QtWidgets import QApplication, QWidget, QGridLayout, QPushButton, QLabel, QMessageBox, QLineEdit, QComboBox, QScrollArea, QFrame, QVBoxLayout, QGroupBox, QSpinBox, QDoubleSpinBox, QCheckBox, QRadioButton, QFileDialog
 from PyQt5.QtCore import QThread, pyqtSignal
 import measurement_thread
+import acquisition_process
+import publisher
+import recipe
+import sweep_plan
 import parameter_dialog
 import devices
 import data_handler
+import catalog
 import config_manager
 import numpy as np
 import json
 import os
-from datetime import datetime 
-import qdarkstyle
+import re
+import time
+import threading
 
 
 class Functionality:
@@ -20,11 +26,22 @@ class Functionality:
         self.darkmode = False
         self.config_manager = config_manager.config_manager(self.ui)
         self.open_parameter_dialogs = [] #List of open parameter dialogs, to be closed when the measurement is started
+        self.publisher = None #Streams the data to external programs, if enabled
+        self.recipe_runner = None #Runs the steps of a recipe, if one is running
+        self.latencies = sweep_plan.CommandLatencies() #Duration of the commands, measured in every measurement and used to estimate the duration of the next one
+        self.latencies_measured = False
 
     def openEvent(self):
         #This is called at the start of the program and sets up the UI
         config = self.config_manager.load_config(os.path.join(os.path.dirname(__file__), 'config', 'latest.json')) #Loads the latest config file (created on closing the program)
         self.change_measurement_type(type = config['measurement_type'] ,config = config) #Set the measurement type to the one in the config file for the UI to load properly
+        QtCore.QTimer.singleShot(0, self.start_port_scan) #Runs as soon as the event loop is started, i.e. after the window is shown
+
+    def start_port_scan(self):
+        #Lists the available ports in the background, this also loads the VISA backend. Until then the window can already be used
+        self.port_scanner = PortScanner(self.ui.device_handler.rm)
+        self.port_scanner.ports_signal.connect(self.ui.device_handler.set_ports)
+        self.port_scanner.start()
 
     def closeEvent(self):
         #This function is called when the program is closed and saves the current settings to a config file
@@ -35,6 +52,10 @@ class Functionality:
             device.close()  
         for device in self.ui.device_handler.lowV_devices:
             device.close()
+        self.ui.device_handler.sessions.close_all() #Closes the remaining sessions (e.g. devices found but not added)
+        if self.publisher is not None:
+            self.publisher.close()
+        self.ui.history_browser.loader.close()
         self.update_measurement_settings()
         config = self.config_manager.assemble_config()
         self.config_manager.save_config(config, os.path.join(os.path.dirname(__file__), 'config', 'latest.json'))
@@ -44,6 +65,7 @@ class Functionality:
         app = QApplication.instance()
         self.darkmode = not self.darkmode
         if self.darkmode:
+            import qdarkstyle #Only loaded when needed, it takes long to import
             app.setStyleSheet(qdarkstyle.load_stylesheet_pyqt5())
         else:
             app.setStyleSheet("")
@@ -52,6 +74,7 @@ class Functionality:
         #This function updates the dark mode when the program is started
         app = QApplication.instance()
         if self.darkmode:
+            import qdarkstyle
             app.setStyleSheet(qdarkstyle.load_stylesheet_pyqt5())
         else:
             app.setStyleSheet("")
@@ -77,32 +100,32 @@ class Functionality:
             self.ui.device_handler.device_candidates.remove(candidate) #Remove the selected device from the list of candidates
             self.ui.device_handler.used_ids.append(candidate[1]) #Add the selected device to the list of used ids to not be able to select it again
             if 'Keithley K2200 SMU' in candidate[2]: # Check the type of the device and create the respective object 
-                device = devices.K2200(port = candidate[0], id = candidate[1], rm =  self.ui.rm)
+                device = devices.K2200(port = candidate[0], id = candidate[1], rm =  self.ui.device_handler.sessions)
                 self.ui.device_handler.smu_devices.append(device)
                 self.K2200_warning()
             elif 'Keithley K2400 SMU' in candidate[2]:
-                device = devices.K2400(port = candidate[0], id = candidate[1], rm =  self.ui.rm)
+                device = devices.K2400(port = candidate[0], id = candidate[1], rm =  self.ui.device_handler.sessions)
                 self.ui.device_handler.smu_devices.append(device)
             elif 'Keithley K2600 SMU' in candidate[2]:
-                device = devices.K2600(port = candidate[0], id = candidate[1], rm =  self.ui.rm)
+                device = devices.K2600(port = candidate[0], id = candidate[1], rm =  self.ui.device_handler.sessions)
                 self.ui.device_handler.smu_devices.append(device)
             elif 'Keithley K6487 SMU' in candidate[2]:
-                device = devices.K6487(port = candidate[0], id = candidate[1], rm =  self.ui.rm)
+                device = devices.K6487(port = candidate[0], id = candidate[1], rm =  self.ui.device_handler.sessions)
                 self.ui.device_handler.smu_devices.append(device)
             elif 'Keithley K2000 Voltmeter' in candidate[2]:
-                device = devices.K2000(port = candidate[0], id = candidate[1], rm =  self.ui.rm)
+                device = devices.K2000(port = candidate[0], id = candidate[1], rm =  self.ui.device_handler.sessions)
                 self.ui.device_handler.voltmeter_devices.append(device)
             elif 'Rhode&Schwarz NGE103B' in candidate[2]:
-                device = devices.LowVoltagePowerSupplies(port = candidate[0], id = candidate[1], rm =  self.ui.rm)
+                device = devices.LowVoltagePowerSupplies(port = candidate[0], id = candidate[1], rm =  self.ui.device_handler.sessions)
                 self.ui.device_handler.lowV_devices.append(device)
             elif 'HAMEG HMP4040' in candidate[2]:
-                device = devices.LowVoltagePowerSupplies(port = candidate[0], id = candidate[1], rm =  self.ui.rm)
+                device = devices.LowVoltagePowerSupplies(port = candidate[0], id = candidate[1], rm =  self.ui.device_handler.sessions)
                 self.ui.device_handler.lowV_devices.append(device)
             elif 'HAMEG HM8118' in candidate[2]:
-                device = devices.Hameg8118(port = candidate[0], id = candidate[1], rm =  self.ui.rm)
+                device = devices.Hameg8118(port = candidate[0], id = candidate[1], rm =  self.ui.device_handler.sessions)
                 self.ui.device_handler.capacitancemeter_devices.append(device)
             elif 'Dummy' in candidate[2]: #For testing purposes 
-                device = devices.Dummy_Device(port = candidate[0], id = candidate[1], rm =  self.ui.rm)
+                device = devices.Dummy_Device(port = candidate[0], id = candidate[1], rm =  self.ui.device_handler.sessions)
             else:
                 print('Device not supported')
                 return 
@@ -118,29 +141,29 @@ class Functionality:
         for candidate in self.ui.device_handler.device_candidates:
             self.ui.device_handler.used_ids.append(candidate[1])
             if 'Keithley K2200 SMU' in candidate[2]: # Check the type of the device and create the respective object 
-                device = devices.K2200(port = candidate[0], id = candidate[1], rm =  self.ui.rm)
+                device = devices.K2200(port = candidate[0], id = candidate[1], rm =  self.ui.device_handler.sessions)
                 self.ui.device_handler.smu_devices.append(device)
                 self.K2200_warning()
             elif 'Keithley K2400 SMU' in candidate[2]:
-                device = devices.K2400(port = candidate[0], id = candidate[1], rm =  self.ui.rm)
+                device = devices.K2400(port = candidate[0], id = candidate[1], rm =  self.ui.device_handler.sessions)
                 self.ui.device_handler.smu_devices.append(device)
             elif 'Keithley K2600 SMU' in candidate[2]:
-                device = devices.K2600(port = candidate[0], id = candidate[1], rm =  self.ui.rm)
+                device = devices.K2600(port = candidate[0], id = candidate[1], rm =  self.ui.device_handler.sessions)
                 self.ui.device_handler.smu_devices.append(device)
             elif 'Keithley K6487 SMU' in candidate[2]:
-                device = devices.K6487(port = candidate[0], id = candidate[1], rm =  self.ui.rm)
+                device = devices.K6487(port = candidate[0], id = candidate[1], rm =  self.ui.device_handler.sessions)
                 self.ui.device_handler.smu_devices.append(device)
             elif 'Keithley K2000 Voltmeter' in candidate[2]:
-                device = devices.K2000(port = candidate[0], id = candidate[1], rm =  self.ui.rm)
+                device = devices.K2000(port = candidate[0], id = candidate[1], rm =  self.ui.device_handler.sessions)
                 self.ui.device_handler.voltmeter_devices.append(device)
             elif 'Rhode&Schwarz NGE103B' in candidate[2]:
-                device = devices.LowVoltagePowerSupplies(port = candidate[0], id = candidate[1], rm =  self.ui.rm)
+                device = devices.LowVoltagePowerSupplies(port = candidate[0], id = candidate[1], rm =  self.ui.device_handler.sessions)
                 self.ui.device_handler.lowV_devices.append(device)
             elif 'HAMEG HMP4040' in candidate[2]:
-                device = devices.LowVoltagePowerSupplies(port = candidate[0], id = candidate[1], rm =  self.ui.rm)
+                device = devices.LowVoltagePowerSupplies(port = candidate[0], id = candidate[1], rm =  self.ui.device_handler.sessions)
                 self.ui.device_handler.lowV_devices.append(device)
             elif 'Dummy' in candidate[2]: #For testing purposes 
-                device = devices.Dummy_Device(port = candidate[0], id = candidate[1], rm =  self.ui.rm)
+                device = devices.Dummy_Device(port = candidate[0], id = candidate[1], rm =  self.ui.device_handler.sessions)
             else:
                 print('Device not supported')
                 return 
@@ -179,6 +202,10 @@ class Functionality:
             advanced_settings = QPushButton('Advanced Settings')
             advanced_settings.clicked.connect(lambda : self.open_parameter_dialog(device, candidate[1], candidate[2]))
             device_layout.addWidget(advanced_settings, 2, 0, 1, 3)
+        if candidate[2] == 'Keithley K6487 SMU':  # Add the pop up window to allow for advanced settings for the Keithley K6487 picoammeters
+            advanced_settings = QPushButton('Advanced Settings')
+            advanced_settings.clicked.connect(lambda : self.open_parameter_dialog(device, candidate[1], candidate[2]))
+            device_layout.addWidget(advanced_settings, 2, 0, 1, 3)
         
         device_widget.setLayout(device_layout) 
         return device_widget
@@ -198,6 +225,10 @@ class Functionality:
             dialog = parameter_dialog.ParameterDialog_K2600(device, id, self.ui.rm, self)
             dialog.show()
             self.open_parameter_dialogs.append(dialog)
+        if type == 'Keithley K6487 SMU':
+            dialog = parameter_dialog.ParameterDialog_K6487(device, id, self.ui.rm, self)
+            dialog.show()
+            self.open_parameter_dialogs.append(dialog)
         
         
 
@@ -233,6 +264,7 @@ class Functionality:
             self.ui.device_handler.capacitancemeter_devices.remove(device)
 
         device.close()
+        self.ui.device_handler.sessions.close(device.return_port()) #The session is removed from the pool, so the device is opened again when it is added the next time
         return
      
     def enable_custom_sweep(self):
@@ -266,6 +298,7 @@ class Functionality:
             config = self.config_manager.assemble_config() #Assemble the config from the UI
         self.config_manager.apply_config(config) #Apply the config to the new layout
         self.ui.canvas.change_plot_type(type) #Change the plot type to the new measurement type
+        self.ui.history_browser.refresh() #Shows the loaded measurements that fit the new type
         return
 
     def K2200_warning(self):
@@ -276,6 +309,9 @@ class Functionality:
         #This function changes the UI when the measurement is started
         self.ui.abort_button.setEnabled(True)
         self.ui.start_button.setEnabled(False)
+        self.ui.resume_button.setEnabled(False)
+        self.ui.run_recipe_button.setEnabled(False)
+        self.ui.separate_process_checkBox.setEnabled(False)
         self.ui.measurement_settings.setEnabled(False)
         for widget in self.ui.device_widgets:
             widget.setEnabled(False)
@@ -284,6 +320,9 @@ class Functionality:
         #This function changes the UI when the measurement is stopped
         self.ui.abort_button.setEnabled(False)
         self.ui.start_button.setEnabled(True)
+        self.ui.resume_button.setEnabled(True)
+        self.ui.run_recipe_button.setEnabled(True)
+        self.ui.separate_process_checkBox.setEnabled(True)
         self.ui.measurement_settings.setEnabled(True)
         for widget in self.ui.device_widgets:
             widget.setEnabled(True)
@@ -298,6 +337,8 @@ class Functionality:
         'stopV': self.ui.stopV_spinBox.value(),
         'stepV': self.ui.stepV_spinBox.value(),
         'measurements_per_step': self.ui.measurements_per_step_spinBox.value(),
+        'target_rse': self.ui.target_rse_spinBox.value(),
+        'min_measurements_per_step': self.ui.min_measurements_spinBox.value(),
         'time_between_measurements': self.ui.time_between_measurements_spinBox.value(),
         'time_between_steps': self.ui.time_between_steps_spinBox.value(),
         'limitI': self.ui.limitI_spinBox.value(),
@@ -320,6 +361,8 @@ class Functionality:
         'time_between_steps': self.ui.time_between_steps_spinBox.value(),
         'time_between_measurements': self.ui.time_between_measurements_spinBox.value(),
         'measurements_per_step': self.ui.measurements_per_step_spinBox.value(),
+        'target_rse': self.ui.target_rse_spinBox.value(),
+        'min_measurements_per_step': self.ui.min_measurements_spinBox.value(),
         'limitI': self.ui.limitI_spinBox.value(),
         'custom_sweep': self.ui.use_custom_sweep_checkBox.isChecked(),
         'custom_sweep_file': self.ui.custom_sweep_file.text(),
@@ -351,49 +394,178 @@ class Functionality:
         
         if not self.safety_check(parameters = parameters, type = self.ui.measurement_type): #Perform various sanity checks before starting the measurement, mainly to prevent the user from doing things that are not intended
             return
+        self.launch_measurement(self.ui.measurement_type, parameters, self.ui.filename.text())
 
+    def launch_measurement(self, measurement_type, parameters, filename, bias = 0, hold = None):
+        #Creates the data saver and starts the measurement thread, used for single measurements and the steps of recipes
+        #bias and hold: voltage at the SMUs at the start and voltage kept at the end (recipes). Returns False if the measurement could not be started
+        if self.ui.measurement_type != measurement_type: #Steps of recipes can have a different type than the GUI
+            self.ui.measurement_type_comboBox.setCurrentText(measurement_type)
         try:  #try to create the data saver object, if the file already exists, raise an error
             self.data_saver = data_handler.DataSaver(   #start the data save thread 
                 filepath = self.ui.folder_path.text(),
-                filename = self.ui.filename.text(),
+                filename = filename,
                 use_timestamp = self.ui.use_timestamp_checkBox.isChecked(),
                 ui = self.ui,
                 functionality = self)
             
         except FileExistsError:
             self.file_exists_error()
-            return        
+            return False
         
-        self.measurement_thread = measurement_thread.MeasurementThread(ui = self.ui, device_handler= self.ui.device_handler) #Create the measurement thread 
+        self.measurement_thread = self.create_measurement_thread() #Create the measurement thread 
         try:
             self.measurement_thread.finished_signal.disconnect(self.finish_measurement)
         except TypeError:
             pass  # No existing connection, safe to proceed
+        self.measurement_thread.set_recipe_voltages(bias, hold)
         
         self.ui.canvas.clear_live_data() #Clear the live data from the plot
         self.ui_changes_start() #Change the UI to show that the measurement is running
         
-        if self.ui.measurement_type == 'IV':  #Start IV measurement
-            self.write_parameters(self.ui.IV_settings)
-            self.measurement_thread.set_parameters('IV', self.ui.IV_settings)
-            self.measurement_thread.data_signal.connect(self.receive_data)  #Handles the data signal from the measurement thread
-            self.measurement_thread.finished_signal.connect(self.finish_measurement) # Handles the finished signal from the measurement thread
-            self.measurement_thread.error_signal.connect(self.abort_measurement) #Handles the error signal from the measurement thread
-            self.measurement_thread.start() #Start the measurement thread
-        elif self.ui.measurement_type == 'CV': #Start CV measurement
-            self.write_parameters(self.ui.CV_settings)
-            self.measurement_thread.set_parameters('CV', self.ui.CV_settings)
-            self.measurement_thread.data_signal.connect(self.receive_data)  #Handles the data signal from the measurement thread
-            self.measurement_thread.finished_signal.connect(self.finish_measurement) # Handles the finished signal from the measurement thread
-            self.measurement_thread.error_signal.connect(self.abort_measurement) #Handles the error signal from the measurement thread
-            self.measurement_thread.start() #Start the measurement thread
-        elif self.ui.measurement_type == 'Constant Voltage': #Start Constant Voltage measurement
-            self.write_parameters(self.ui.constantV_settings)
-            self.measurement_thread.set_parameters('Constant Voltage', self.ui.constantV_settings) 
-            self.measurement_thread.data_signal.connect(self.receive_data)  #Handles the data signal from the measurement thread
-            self.measurement_thread.finished_signal.connect(self.finish_measurement) # Handles the finished signal from the measurement thread
-            self.measurement_thread.error_signal.connect(self.abort_measurement) #Handles the error signal from the measurement thread
-            self.measurement_thread.start() #Start the measurement thread
+        self.write_parameters(parameters, measurement_type)
+        self.data_saver.start_journal(measurement_type, parameters, self.collect_device_settings(), self.collect_device_ids())
+        self.run_measurement_thread(measurement_type, parameters)
+        return True
+
+    def run_recipe(self):
+        #Runs all steps of a recipe file back to back (see recipe.py for the format)
+        filename, ok = QFileDialog.getOpenFileName(self.ui, 'Run Recipe', os.path.join(os.path.dirname(__file__), 'config'), 'Recipe Files (*.json)')
+        if not ok:
+            return
+        self.update_measurement_settings()
+        defaults = {'IV': self.ui.IV_settings, 'CV': self.ui.CV_settings, 'Constant Voltage': self.ui.constantV_settings} #Same format as in the config
+        try:
+            loaded = recipe.load_recipe(filename, defaults)
+        except Exception as e:
+            QMessageBox.warning(self.ui, 'Warning', f'The recipe could not be loaded: {e}', QMessageBox.Ok, QMessageBox.Ok)
+            return
+        for dialog in self.open_parameter_dialogs:
+            dialog.close()
+        for step in loaded['steps']: #All checks (and warnings) before the start, so the recipe runs without an operator
+            if not self.safety_check(parameters = step['parameters'], type = step['measurement_type']):
+                return
+        self.recipe_runner = recipe.RecipeRunner(self, loaded)
+        self.recipe_runner.start()
+
+    def create_measurement_thread(self):
+        #The measurement runs either in a thread of the GUI process or in a separate process that owns the devices during the measurement
+        if self.ui.separate_process_checkBox.isChecked():
+            return acquisition_process.AcquisitionProcess(ui = self.ui, device_handler = self.ui.device_handler)
+        return measurement_thread.MeasurementThread(ui = self.ui, device_handler = self.ui.device_handler)
+
+    def run_measurement_thread(self, measurement_type, parameters):
+        #Connects the signals of the measurement thread and starts it (IV, CV or Constant Voltage)
+        self.update_publisher()
+        self.measurement_thread.set_parameters(measurement_type, parameters)
+        self.measurement_thread.set_latencies(self.latencies.as_dict())
+        self.estimate_duration(measurement_type, parameters)
+        self.measurement_thread.progress_signal.connect(self.show_progress) #Remaining time after every point
+        self.measurement_thread.ramp_signal.connect(self.show_ramp) #Progress of the ramp down at the end
+        self.measurement_thread.data_signal.connect(self.receive_data)  #Handles the data signal from the measurement thread
+        self.measurement_thread.burst_signal.connect(self.data_saver.write_burst) #Handles the bursts of voltmeters in burst mode
+        self.measurement_thread.summary_signal.connect(self.data_saver.write_summary) #Handles the step summaries of measurements with early stop
+        self.measurement_thread.checkpoint_signal.connect(self.data_saver.write_checkpoint) #Records the progress in the checkpoint journal
+        self.measurement_thread.block_signal.connect(self.receive_data_block) #Handles whole blocks of data rows from buffered SMUs
+        self.measurement_thread.finished_signal.connect(self.finish_measurement) # Handles the finished signal from the measurement thread
+        self.measurement_thread.error_signal.connect(self.measurement_failed) #Handles the error signal from the measurement thread
+        self.measurement_thread.start() #Start the measurement thread
+
+    def estimate_duration(self, measurement_type, parameters):
+        #Shows the expected duration before the start, calculated from the plan, the waiting times and the command latencies. The measurement thread updates it during the measurement
+        thread = self.measurement_thread
+        self.ui.live_eta_label.setText('Remaining time:')
+        try:
+            if measurement_type == 'Constant Voltage':
+                duration = parameters.get('duration', 0) #Only limited in recipes
+            else:
+                plan = sweep_plan.plan_from_journal(thread.resume_plan) if thread.resume_plan is not None else sweep_plan.compile_plan(measurement_type, parameters)
+                if plan.frequencies is not None: #The colors of the CV curves are spread over the measured frequencies
+                    self.ui.canvas.set_frequency_range(np.min(plan.frequencies), np.max(plan.frequencies))
+                model = sweep_plan.DurationModel(plan, parameters, early_stop = parameters.get('target_rse', 0) > 0)
+                duration = model.total(self.latencies, thread.bias, *thread.resume_point)
+        except Exception as e:
+            print(f'The duration could not be estimated: {e}')
+            return
+        if duration > 0:
+            print(f'Estimated duration: {sweep_plan.format_duration(duration)}' + (' (maximum, early stop enabled)' if parameters.get('target_rse', 0) > 0 else '') + ('' if self.latencies_measured else ' (command latencies not measured yet)'))
+            self.ui.live_eta_data.setText(sweep_plan.format_duration(duration))
+        else:
+            self.ui.live_eta_data.setText('-')
+
+    def show_progress(self, progress):
+        self.ui.live_eta_label.setText('Remaining time:')
+        self.ui.live_eta_data.setText(sweep_plan.format_duration(progress['remaining']))
+        self.latencies.update(progress['latencies'])
+        self.latencies_measured = True
+
+    def show_ramp(self, voltage, remaining):
+        #Shows the voltage while the measurement thread ramps down
+        self.ui.live_eta_label.setText('Ramping down:')
+        self.ui.live_eta_data.setText(f'{voltage:.0f} V ({sweep_plan.format_duration(remaining)})')
+
+    def update_publisher(self):
+        #Starts or stops the publisher according to the UI and announces the columns of the new measurement to the subscribers
+        port = self.ui.publish_port_spinBox.value()
+        if self.publisher is not None and (not self.ui.publish_checkBox.isChecked() or self.publisher.port != port):
+            self.publisher.close()
+            self.publisher = None
+        if self.ui.publish_checkBox.isChecked() and self.publisher is None:
+            try:
+                self.publisher = publisher.DataPublisher(port = port)
+            except OSError as e:
+                print(f'Publisher could not be started on port {port}: {e}')
+                return
+        if self.publisher is not None:
+            self.publisher.set_schema(self.data_saver.header, self.data_saver.filepath)
+        self.data_saver.publisher = self.publisher
+
+    def resume_measurement(self):
+        #This function continues an interrupted IV or CV measurement from its checkpoint journal
+        #The data is appended to the file of the interrupted measurement, the voltage is ramped to the next unmeasured voltage
+        filename, ok = QFileDialog.getOpenFileName(self.ui, 'Resume Measurement', self.ui.folder_path.text(), 'Checkpoint Files (*_checkpoint.json)')
+        if not ok:
+            return
+        try:
+            with open(filename, 'r') as f:
+                journal = json.load(f)
+        except Exception as e:
+            QMessageBox.warning(self.ui, 'Warning', f'The checkpoint could not be loaded: {e}', QMessageBox.Ok, QMessageBox.Ok)
+            return
+        if journal['completed'] or journal['plan'] is None or journal['measurement_type'] not in ('IV', 'CV'):
+            QMessageBox.warning(self.ui, 'Warning', 'There is nothing to resume in this checkpoint.', QMessageBox.Ok, QMessageBox.Ok)
+            return
+        device_settings = json.loads(json.dumps(self.collect_device_settings())) #Same representation as in the journal
+        if set(journal['device_settings']) != set(device_settings):
+            QMessageBox.warning(self.ui, 'Warning', 'The connected devices do not match the devices of the interrupted measurement.', QMessageBox.Ok, QMessageBox.Ok)
+            return
+        if journal['device_settings'] != device_settings:
+            reply = QMessageBox.question(self.ui, 'Resume?', 'The device settings differ from the settings of the interrupted measurement. Resume anyway?', QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+            if reply != QMessageBox.Yes:
+                return
+        for dialog in self.open_parameter_dialogs:
+            dialog.close()
+        self.ui.measurement_type_comboBox.setCurrentText(journal['measurement_type'])
+        if not self.safety_check(parameters = journal['parameters'], type = journal['measurement_type'], check_sweep = False):
+            return
+        try:
+            self.data_saver = data_handler.DataSaver(
+                filepath = None,
+                filename = None,
+                use_timestamp = False,
+                ui = self.ui,
+                functionality = self,
+                resume_journal = journal)
+        except Exception as e:
+            QMessageBox.warning(self.ui, 'Warning', f'The measurement could not be resumed: {e}', QMessageBox.Ok, QMessageBox.Ok)
+            return
+        print(f'Resuming {journal["measurement_type"]} measurement at point {journal["next"]}, appending to {journal["file"]}')
+
+        self.measurement_thread = self.create_measurement_thread()
+        self.measurement_thread.set_resume(journal['plan'], journal['next'])
+        self.ui.canvas.clear_live_data()
+        self.ui_changes_start()
+        self.run_measurement_thread(journal['measurement_type'], journal['parameters'])
 
     def receive_data(self, data):
         self.data_saver.write_data(data)
@@ -403,14 +575,25 @@ class Functionality:
         if self.ui.measurement_type == 'IV' or self.ui.measurement_type == 'Constant Voltage':
             self.ui.canvas.update_data(data[1], data[2]) #update the plot with the new data    
         elif self.ui.measurement_type == 'CV':
-            self.ui.canvas.update_cv_data(data[1], data[-1], data[-3], data[-2])
+            lcr = self.data_saver.header.index('Impedance_LCR_0[Ohm]') #Position of the first LCR bridge in the row (impedance, phase, frequency)
+            self.ui.canvas.update_cv_data(data[1], data[lcr+2], data[lcr], data[lcr+1])
         self.ui.canvas.draw_plot() #draw the plot with the new data
 
+    def receive_data_block(self, rows):
+        #Handles a whole block of rows at once, the plot is only redrawn once per block
+        for data in rows:
+            self.data_saver.write_data(data)
+            self.ui.canvas.update_data(data[1], data[2])
+        if rows:
+            self.ui.live_current_data.setText(f'{float(rows[-1][2])*1e9:.3f} nA')
+            self.ui.live_voltage_data.setText(f'{float(rows[-1][1]):.3f} V')
+            self.ui.canvas.draw_plot()
+
     def file_exists_error(self): #Handles the case when the file already exists
         self.ui.abort_button.setEnabled(False)
         warning = QMessageBox.warning(self.ui, 'Warning', 'Afile with this name already exists, please enter a different filename.', QMessageBox.Ok, QMessageBox.Ok)
 
-    def safety_check(self, parameters=None, type = 'IV'): #This function performs various checks before starting the measurement
+    def safety_check(self, parameters=None, type = 'IV', check_sweep = True): #This function performs various checks before starting the measurement
         #Check if all connected devices are communicating correctly
         if len(self.ui.device_handler.smu_devices) == 0:
             self.abort_measurement('No SMU connected. Not able to perform a measurement')
@@ -469,7 +652,14 @@ class Functionality:
                 self.abort_measurement('Start and stop frequency are the same, please enter different values.')
                 return False
             
-        elif type == 'Constant Voltage':
+        if type in ('IV', 'CV') and check_sweep: #Resumed measurements use the sweep of the interrupted measurement
+            try:
+                sweep_plan.compile_plan(type, parameters) #Checks the sweep, also custom sweep files
+            except Exception as e:
+                self.abort_measurement(f'The sweep is not valid: {e}')
+                return False
+
+        if type == 'Constant Voltage':
             if parameters['constant_voltage'] > 0:
                 response = QMessageBox.warning(self.ui, 'Warning', 'You are about to apply a positive voltage to the device. Only proceed if this is intended, as it could damage the DUT.', QMessageBox.Ok | QMessageBox.Cancel, QMessageBox.Ok)
                 if response == QMessageBox.Cancel:
@@ -479,38 +669,103 @@ class Functionality:
         return True #If all checks are passed, return True
 
     def test_communication(self): #This function tests the communication with the connected devices by sending a *IDN? command and checking if the response is valid. If any of the devices fail, it will disconnect them and give a warning
+        #The duration of the queries is used to estimate the command latencies, until they are measured in a measurement
+        query_times = {}
         for device in self.ui.device_handler.smu_devices:
             try:
+                start = time.monotonic()
                 device.return_id()
+                query_times[device] = time.monotonic() - start
             except:
                 self.abort_measurement(f'Communication with {device.return_assigned_id()} failed. Please reconnect this device and try again.')
                 return
         for device in self.ui.device_handler.voltmeter_devices:
             try:
+                start = time.monotonic()
                 device.return_id()
+                query_times[device] = time.monotonic() - start
             except:
                 self.abort_measurement(f'Communication with {device.return_assigned_id()} failed. Please reconnect this device and try again.')
                 return
         for device in self.ui.device_handler.lowV_devices:
             try:
+                start = time.monotonic()
                 device.return_id()
+                query_times[device] = time.monotonic() - start
             except:
                 self.abort_measurement(f'Communication with {device.return_assigned_id()} failed. Please reconnect this device and try again.')
                 return
+        if not self.latencies_measured: #A row reads the voltage and current of every SMU and the other devices about twice as well
+            smu_time = sum(query_times[device] for device in self.ui.device_handler.smu_devices)
+            self.latencies.update({'read_row': 2*sum(query_times.values()), 'set_voltage': smu_time})
         return True
 
+    def measurement_failed(self, reason):
+        #Called when the measurement thread stopped with an error. In a recipe the next step may be run instead
+        if self.recipe_runner is not None and self.recipe_runner.step_failed(reason):
+            return #The measurement thread ramps down the voltage, finish_measurement then starts the next step
+        self.abort_measurement(reason)
+
+    def ramp_down(self):
+        #Ramps the voltage down in a thread when no measurement is running (voltage kept by a recipe), so the GUI stays responsive
+        #The buttons are enabled again when the outputs are off
+        self.ramp_thread = measurement_thread.RampDownThread(ui = self.ui, device_handler = self.ui.device_handler)
+        self.ramp_thread.ramp_signal.connect(self.show_ramp)
+        self.ramp_thread.error_signal.connect(lambda reason: print(f'WARNING: {reason}'))
+        self.ramp_thread.finished_signal.connect(self.ui_changes_stop)
+        self.ui_changes_start()
+        self.ui.abort_button.setEnabled(False)
+        self.ramp_thread.start()
+
+    def ramping(self):
+        thread = getattr(self, 'ramp_thread', None)
+        return thread is not None and thread.isRunning()
+
+    def measurement_running(self):
+        #True while the measurement thread (or acquisition process) has not ended, this includes the ramp down
+        thread = getattr(self, 'measurement_thread', None)
+        return thread is not None and thread.isRunning()
+
     def abort_measurement(self, reason: str): #This function aborts the measurement and shows a message on why this happened
         #It is called when the measurement thread emits an error signal or when the user clicks the abort button
-        self.ui_changes_stop()
-        try:
-            self.measurement_thread.abort_measurement()
-        except Exception as e:
-            print('WARNING: Measurement thread could not be stopped', e)
+        #The abort is only requested, the measurement thread ramps down the voltage itself and emits the finished signal, so the GUI stays responsive
+        running = self.measurement_running()
+        if self.recipe_runner is not None: #The remaining steps of a recipe are not run, a voltage kept between two steps is ramped down by the runner
+            self.recipe_runner.stop(reason, release = not running)
+        if running:
+            self.ui.abort_button.setEnabled(False) #The other buttons are enabled in finish_measurement, when the voltage is ramped down
+            self.ui.live_eta_label.setText('Ramping down:')
+            self.measurement_thread.request_abort()
+        elif not self.ramping(): #A voltage kept by a recipe is ramped down in a thread, which enables the buttons at the end
+            self.ui_changes_stop()
         warning = QMessageBox.warning(self.ui, 'Measurement aborted', 'The following problem has occured and your measurement has been stopped for safety reasons: \n' + reason, QMessageBox.Ok, QMessageBox.Ok)
 
     def finish_measurement(self): #Function that is called when the measurement is finished ordinally (only for IV and CV measurements, as constant voltage measurements are only finished manually)
         self.ui_changes_stop()
         self.data_saver.close()
+        self.catalog_run(self.data_saver.filepath)
+        self.print_bus_statistics()
+        if self.recipe_runner is not None: #Starts the next step, after the measurement thread has ended
+            QtCore.QTimer.singleShot(0, self.recipe_runner.step_finished)
+
+    def catalog_run(self, path):
+        #Adds the finished run to the catalog. The file is parsed in a background thread, so long runs do not block the GUI
+        def work():
+            try:
+                run_catalog = catalog.Catalog()
+                try:
+                    run_catalog.add_run(path)
+                finally:
+                    run_catalog.close()
+            except Exception as e:
+                print(f'{path} could not be added to the catalog: {e}')
+        threading.Thread(target = work, daemon = True).start()
+
+    def print_bus_statistics(self):
+        #Prints how many writes were sent to each device and how many were skipped, because the setting was already applied
+        for device in self.ui.device_handler.smu_devices + self.ui.device_handler.voltmeter_devices + self.ui.device_handler.capacitancemeter_devices:
+            if hasattr(device, 'cache'):
+                print(f'{device.return_assigned_id()}: {device.cache.statistics()}')
     
     def save_config(self):
         #This function saves the current settings to a config file
@@ -533,34 +788,116 @@ class Functionality:
         self.ui.canvas.restart_plot()
         self.ui.canvas.update_plot()
 
-    def write_parameters(self, parameters):
+    def write_parameters(self, parameters, measurement_type):
         # This function writes the parameters of the measurement to a file so they can be used later
-        filepath = self.ui.folder_path.text()
-        filename = self.ui.filename.text()
-        if self.ui.use_timestamp_checkBox.isChecked():
-            timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-            file = os.path.join(filepath, filename+ '_' +  timestamp + '_MeasurementSettings' + '.json')
-        else:
-            file = os.path.join(filepath, filename + '_MeasurementSettings' + '.json')
+        # The file is named after the data file (same timestamp), so the catalog can find the settings of every data file
+        root, suffix = data_handler.split_data_path(self.data_saver.filepath)
+        file = root + '_MeasurementSettings' + '.json'
+        settings = {
+            'measurement_type': measurement_type,
+            'parameters': parameters,
+            'device_settings': self.collect_device_settings(),
+            'devices': self.collect_device_ids()
+        }
+
+        with open(file, 'w') as f:
+            json.dump(settings, f, indent = 4)
+
+    def collect_device_ids(self):
+        #IDs of all connected devices (SMUs, voltmeters, lowV power supplies and LCR bridges), saved with the measurement for the catalog
+        handler = self.ui.device_handler
+        return [device.return_assigned_id() for device in handler.smu_devices + handler.voltmeter_devices + handler.lowV_devices + handler.capacitancemeter_devices]
+
+    def collect_device_settings(self):
+        #Settings of the SMUs and voltmeters, saved with the measurement and in the checkpoint journal
         device_settings = {}
         for device in self.ui.device_handler.smu_devices:
             device_settings[device.return_assigned_id()] = device.settings
         for device in self.ui.device_handler.voltmeter_devices:
             device_settings[device.return_assigned_id()] = device.settings
+        return device_settings
 
-        settings = {
-            'measurement_type': self.ui.measurement_type,
-            'parameters': parameters,
-            'device_settings': device_settings
-        }
+class SessionPool: #Keeps the VISA sessions opened during the device search, so the drivers do not have to open them a second time
+    #It offers the same open_resource function as the resource manager and is handed to the drivers instead of it
+    #Sessions are only closed when the device is removed or the program is closed
+    def __init__(self, rm, timeout = 2000):
+        self.rm = rm
+        self.timeout = timeout # Timeout [ms] for the measurement, the device search uses a shorter one
+        self.sessions = {} # Open sessions by port
+        self.in_use = set() # Ports whose sessions are owned by a driver
+
+    def get(self, port):
+        #Returns the open session of the port or None, if there is no session or it has been closed in the meantime
+        session = self.sessions.get(port)
+        if session is None:
+            return None
+        try:
+            session.session # Raises an error if the session was closed
+        except Exception:
+            self.sessions.pop(port)
+            self.in_use.discard(port)
+            return None
+        return session
+
+    def probe(self, port):
+        #Returns a session for the device search. Ports used by a driver are not touched (returns None)
+        if port in self.in_use and self.get(port) is not None:
+            return None
+        session = self.get(port)
+        if session is None:
+            session = self.rm.open_resource(port)
+            self.sessions[port] = session
+        return session
+
+    def open_resource(self, port, **kwargs):
+        #Hands the session of the port to a driver (opens a new one if there is none). Termination settings found during the search are kept, unless the driver sets its own
+        session = self.get(port)
+        if session is None:
+            session = self.rm.open_resource(port, **kwargs)
+            self.sessions[port] = session
+        else:
+            for key, value in kwargs.items():
+                setattr(session, key, value)
+        if 'timeout' not in kwargs:
+            session.timeout = self.timeout
+        self.in_use.add(port)
+        return session
+
+    def list_resources(self):
+        return self.rm.list_resources()
+
+    def close(self, port):
+        #Closes the session of the port (if it is still open) and removes it from the pool
+        session = self.sessions.pop(port, None)
+        self.in_use.discard(port)
+        if session is not None:
+            try:
+                session.close()
+            except Exception:
+                pass
 
-        with open(file, 'w') as f:
-            json.dump(settings, f, indent = 4)
+    def close_all(self):
+        for port in list(self.sessions):
+            self.close(port)
+
+class PortScanner(QThread): #Lists the available ports without blocking the GUI
+    ports_signal = pyqtSignal(list)
+
+    def __init__(self, rm):
+        super().__init__()
+        self.rm = rm
+
+    def run(self):
+        try:
+            self.ports_signal.emit(list(self.rm.list_resources()))
+        except Exception as e:
+            print(f'Ports could not be listed: {e}')
 
 class Device_Handler:   #Class that handles the devices and their IDs
     def __init__(self, rm):
         self.rm = rm
-        self.ports = self.rm.list_resources() # Get all available ports for possible devices
+        self.sessions = SessionPool(rm) # Pool of open VISA sessions, shared between the device search and the drivers
+        self.ports = [] # Available ports for possible devices, listed in the background after the window is shown (PortScanner)
         self.device_candidates = [] # List of device candidates, contains [port, id, type] 
         self.smu_devices = [] # List of used SMUs
         self.voltmeter_devices = [] # List of used voltmeters
@@ -568,15 +905,21 @@ class Device_Handler:   #Class that handles the devices and their IDs
         self.capacitancemeter_devices = [] # List of used capacitance meters
         self.used_ids = [] # List of the ids of used devices
 
+    def set_ports(self, ports):
+        self.ports = ports
+        print(f'{len(ports)} ports found')
+
     def find_devices(self):
         self.ports = self.rm.list_resources() # search devices and clear all canidates for that, to prevent double entries
         self.clear()
 #        self.device_candidates.append(['Dummy Port', 'Dummy Device', 'Dummy']) # Add a dummy device for testing purposes
         for port in self.ports:
             try:
-                device = self.rm.open_resource(port) # Try to open the port 
+                device = self.sessions.probe(port) # Try to open the port (or reuse the session from an earlier search)
             except:
-                continue                    
+                continue
+            if device is None: # The port is already used by a connected device
+                continue
             #As some devices use different termination characters, we need to try different ones, if "\n" does not work we try "\r"
             device.write_termination = '\n'
             device.read_termination = '\n'
@@ -592,6 +935,7 @@ class Device_Handler:   #Class that handles the devices and their IDs
                     id = device.query('*IDN?').strip('').strip('') #Try again if the device is not responding with "\n" terminations  
                 except:
                     #print('Could not get ID from', port) #Debug message
+                    self.sessions.close(port)
                     continue
             # Now we need to sort the devices into their respective categories.
             # If you want to add a new device, you need to add it here 
@@ -602,7 +946,7 @@ class Device_Handler:   #Class that handles the devices and their IDs
                 self.device_candidates.append([port, id, 'Keithley K2200 SMU'])
             elif 'KEITHLEY' in id and ('2470' in id or '2450' in id):
                 self.device_candidates.append([port, id, 'Keithley K2400 SMU'])
-            elif 'Keithley' in id and '2611' in id:
+            elif 'Keithley' in id and re.search(r'Model 26\d\d', id, re.IGNORECASE): #Single (2601, 2611, 2635) and dual-channel models (2602, 2612, 2636, ...)
                 self.device_candidates.append([port, id, 'Keithley K2600 SMU'])
             elif 'KEITHLEY' in id and 'MODEL 6487' in id:
                 self.device_candidates.append([port, id, 'Keithley K6487 SMU'])
@@ -616,7 +960,7 @@ class Device_Handler:   #Class that handles the devices and their IDs
                 self.device_candidates.append([port, id, 'HAMEG HM8118'])
             else:
                 self.device_candidates.append([port, id, 'Uncharacterized'])
-            device.close()
+            #The session stays open with the working terminations, it is handed to the driver when the device is added
         print('Found devices:', self.device_candidates)
         return np.array(self.device_candidates)
 
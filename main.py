@@ -1,9 +1,9 @@
 from PyQt5.QtWidgets import QApplication
 import sys
 from ui import Ui_MainWindow
-import pyvisa as visa
+import devices
 
-ResourceManager = visa.ResourceManager('@py') # Set up the resource manager
+ResourceManager = devices.LazyResourceManager('@py') # Set up the resource manager, the VISA backend is only loaded when it is used (port scan after the window is shown)
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
@@ -1,23 +1,228 @@
 #This file contains the MeasurementThread class, which is used to run the measurement in a separate thread
 from PyQt5.QtCore import QThread, pyqtSignal
+import threading
 import time
 import numpy as np
+import devices
+import sweep_plan
+
+class RunningStatistics:
+    #Running mean and standard deviation of a series of values, updated with every value (Welford), so no values have to be stored
+    def __init__(self):
+        self.n = 0
+        self.mean = 0
+        self.m2 = 0 #Sum of the squared deviations from the mean
+
+    def add(self, value):
+        if np.isnan(value): #Failed readings do not count
+            return
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta/self.n
+        self.m2 += delta*(value - self.mean)
+
+    def std(self):
+        return (self.m2/(self.n - 1))**0.5 if self.n > 1 else 0
+
+    def relative_sem(self):
+        #Standard error of the mean relative to the mean
+        if self.n < 2:
+            return np.inf
+        if self.mean == 0:
+            return 0 if self.m2 == 0 else np.inf
+        return self.std()/self.n**0.5/abs(self.mean)
+
+class SampleScheduler:
+    #Plans the sample times against fixed deadlines (time.monotonic_ns), so the time needed to read the devices does not add up with the waiting time and the sample rate does not drift
+    #Deadlines that can not be met (reading the devices takes longer than the period) are counted as missed, the schedule then continues with the next deadline in the future
+    #The waits end immediately when the stop event is set (abort of the measurement)
+    def __init__(self, period_ms, stop_event = None):
+        self.period = int(period_ms*1e6) #Period between two samples [ns]
+        self.stop_event = stop_event if stop_event is not None else threading.Event()
+        self.deadline = time.monotonic_ns()
+        self.missed = 0 #Number of missed deadlines
+        self.lateness = RunningStatistics() #Lateness after waking up [ns]
+        self.max_lateness = 0
+
+    def restart(self):
+        #Starts a new series of deadlines, the current sample is due now (e.g. after a voltage step)
+        self.deadline = time.monotonic_ns()
+
+    def wait(self):
+        #Waits until the next deadline
+        self.deadline += self.period
+        now = time.monotonic_ns()
+        if now > self.deadline:
+            if self.period > 0:
+                skipped = (now - self.deadline) // self.period + 1 #Number of deadlines that passed while the devices were read
+                self.missed += skipped
+                self.deadline += skipped*self.period
+            else:
+                self.deadline = now
+        if self.stop_event.wait(max(self.deadline - time.monotonic_ns(), 0)/1e9):
+            return #Aborted, the sample is not taken
+        lateness = time.monotonic_ns() - self.deadline
+        self.lateness.add(lateness)
+        self.max_lateness = max(self.max_lateness, lateness)
+
+    def statistics(self):
+        return f'Sampling: {self.lateness.n} samples, {self.missed} missed deadlines, jitter {self.lateness.mean/1e6:.3f} ms +- {self.lateness.std()/1e6:.3f} ms (max {self.max_lateness/1e6:.3f} ms)'
+
+class RangePredictor:
+    #Predictive ranging of an SMU: the current of the next reading is extrapolated from the last readings (exponential in the voltage, as leakage currents change by decades),
+    #the smallest measure range with enough headroom is set before the reading. Readings that do not fit the range (overflow or a poor resolution) are repeated once with autorange
+    OVERFLOW = 9.9e37 #Returned by Keithley SMUs when the reading is out of the range
+    def __init__(self, ranges, headroom = 2, resolution = 1e-3, max_change = 100):
+        self.ranges = sorted(ranges)
+        self.headroom = headroom #The expected current has to be below range/headroom
+        self.resolution = resolution #Readings below range*resolution are measured again with autorange (only if a smaller range exists)
+        self.max_change = max_change #Maximum factor between the last and the expected current
+        self.points = [] #(voltage, log10 of the largest absolute current of the channels) of the last readings
+        self.readings = 0
+        self.retries = 0 #Readings that had to be repeated with autorange
+
+    def add(self, voltage, currents):
+        currents = np.abs(np.asarray(currents, dtype = float))
+        currents = currents[np.isfinite(currents) & (currents > 0) & (currents < self.OVERFLOW)]
+        self.readings += 1
+        if len(currents) == 0:
+            return
+        self.points = self.points[-9:] + [(voltage, np.log10(currents.max()))]
+
+    def predict(self, voltage):
+        #Expected absolute current at the voltage, None if nothing was measured yet
+        if not self.points:
+            return None
+        last_voltage, last_log = self.points[-1]
+        previous = [(v, log) for v, log in self.points if v is not None and last_voltage is not None and v != last_voltage]
+        if not previous or voltage is None or voltage == last_voltage: #Constant voltage or the first step: the current stays the same
+            return 10**last_log
+        previous_voltage, previous_log = previous[-1]
+        slope = (last_log - previous_log)/(last_voltage - previous_voltage)
+        change = np.clip(slope*(float(voltage) - last_voltage), -np.log10(self.max_change), np.log10(self.max_change))
+        return 10**(last_log + change)
+
+    def select(self, voltage):
+        #Range for the next reading, None for autorange (nothing measured yet or the current is above all ranges)
+        expected = self.predict(voltage)
+        if expected is None:
+            return None
+        for current_range in self.ranges:
+            if expected*self.headroom <= current_range:
+                return current_range
+        return None
+
+    def fits(self, currents, current_range):
+        #False if a reading is out of the range or measured with a poor resolution
+        for current in np.abs(np.asarray(currents, dtype = float)):
+            if not np.isfinite(current) or current >= self.OVERFLOW or current > current_range:
+                return False
+            if current < current_range*self.resolution and current_range > self.ranges[0]:
+                return False
+        return True
+
+    def statistics(self):
+        return f'Predictive ranging: {self.readings} readings, {self.retries} repeated with autorange'
+
+class NplcController:
+    #Adaptive integration time of an SMU: every voltage step is measured with the shortest NPLC that keeps the noise of a reading below the target (relative to the current)
+    #Noise model of a reading: variance = white/NPLC. It is learned at the first step from readings at two NPLCs
+    #and updated with the scatter of the readings of every step, so the model follows the noise of the DUT
+    LADDER = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 25] #The NPLC is rounded up to these values, so it is only written when it changes noticeably
+
+    def __init__(self, target, limits, learn_nplc = (0.1, 1), learn_readings = 10, smoothing = 0.3):
+        self.target = target #Relative noise of a reading
+        self.limits = limits
+        self.learn_nplc = learn_nplc
+        self.learn_readings = learn_readings
+        self.smoothing = smoothing #Weight of the scatter of the last step in the noise model
+        self.white = None #Variance of a reading at 1 NPLC [A^2], None until the model is learned
+        self.current = None #Last absolute current
+        self.nplc = None
+        self.step = RunningStatistics() #Currents of the running step
+        self.integration = RunningStatistics() #NPLC of every reading
+
+    def learn(self, read):
+        #read(nplc) returns the absolute currents of learn_readings readings with the given NPLC
+        estimates = []
+        for nplc in self.learn_nplc:
+            currents = np.asarray(read(nplc), dtype = float)
+            estimates.append(np.var(currents, ddof = 1)*nplc)
+            self.current = float(np.mean(currents))
+        self.white = float(np.mean(estimates))
+        print(f'Noise model: {self.white**0.5:.3e} A at 1 NPLC')
+
+    def select(self, expected = None):
+        #NPLC for the next step. expected: expected absolute current (e.g. from the predictive ranging), otherwise the last current is used
+        self.finish_step()
+        current = expected if expected is not None else self.current
+        allowed = (self.target*current)**2 if current else 0 #Allowed variance of a reading
+        if allowed <= 0: #No current measured, the longest integration is used
+            nplc = self.limits[1]
+        else:
+            nplc = self.white/allowed
+        nplc = min(max(nplc, self.limits[0]), self.limits[1])
+        nplc = next((value for value in self.LADDER if value >= nplc), self.limits[1])
+        self.nplc = min(max(nplc, self.limits[0]), self.limits[1])
+        return self.nplc
+
+    def add(self, currents):
+        currents = np.abs(np.asarray(currents, dtype = float))
+        currents = currents[np.isfinite(currents)]
+        if len(currents) == 0:
+            return
+        self.current = float(currents.max())
+        self.step.add(self.current)
+        if self.nplc is not None:
+            self.integration.add(self.nplc)
+
+    def finish_step(self):
+        #Updates the white noise from the scatter of the readings of the last step
+        if self.nplc is not None and self.step.n >= 3:
+            observed = self.step.std()**2*self.nplc
+            if observed > 0:
+                self.white = (1 - self.smoothing)*self.white + self.smoothing*observed
+        self.step = RunningStatistics()
+
+    def statistics(self):
+        return f'Adaptive NPLC: {self.integration.n} readings, mean NPLC {self.integration.mean:.3f}'
 
 class MeasurementThread(QThread):
     #Class that runs the actual measurement in a seperate thread, to prevent the UI Thread from being interupted
     data_signal = pyqtSignal(list)  #signal that is emitted when data is available
     finished_signal = pyqtSignal() #signal that is emitted when the measurement is finished or aborted
     error_signal = pyqtSignal(str) #signal that is emitted when an error occurs
+    burst_signal = pyqtSignal(list) #signal that is emitted when a device delivered a burst of readings [column name, timestamps, readings]
+    block_signal = pyqtSignal(list) #signal that is emitted with a whole block of data rows (buffered SMUs in Constant Voltage measurements)
+    checkpoint_signal = pyqtSignal(dict) #signal that is emitted with the sweep plan and after every completed point, used to resume interrupted measurements
+    summary_signal = pyqtSignal(list) #signal that is emitted after every step with early stop enabled [target voltage, frequency, column name, n, mean, std, converged]
+    progress_signal = pyqtSignal(dict) #signal that is emitted after every point with the remaining time and the measured command latencies
+    ramp_signal = pyqtSignal(float, float) #signal that is emitted during the ramp down with the voltage and the remaining time of the ramp [s]
 
     def __init__(self, ui, device_handler): #Set up the thread
         super().__init__()
         self.ui = ui
         self.device_handler = device_handler
+        self.resume_plan = None #Plan and next point of an interrupted measurement that is resumed
+        self.resume_point = (0, 0)
+        self.bias = 0 #Voltage the SMUs are at when the measurement starts (kept from the previous step of a recipe)
+        self.hold_voltage = None #If the measurement ends at this voltage, it is kept for the next step of a recipe instead of ramping down
+        self.latencies = sweep_plan.CommandLatencies() #Used for the remaining time until they are measured
+        self.duration_model = None
+        self.timing = {'read_row': RunningStatistics(), 'set_voltage': RunningStatistics(), 'set_frequency': RunningStatistics()} #Measured duration of the commands [s]
+        self.stop_event = threading.Event() #Set by request_abort, interrupts all waits of the measurement
+        self.running = False
+        self.ended = False #The voltage was ramped down or kept for the next step of a recipe
+        self.range_predictors = {} #Predictive ranging by SMU
+        self.nplc_controllers = {} #Adaptive NPLC by SMU
     
     def run(self): #This function is called when the thread is started
         # Before this function is called, the set_parameters function is called to set the parameters for the measurement
+        #The voltage is always ramped down in this thread (also after an abort or an error), so the GUI is never blocked and the devices are only used by one thread
         try:
             self.running = True
+            self.ended = False
+            self.stop_event.clear()
             if self.type == 'IV':
                 self.run_IV_measurement(self.parameters)
             elif self.type == 'Constant Voltage':
@@ -26,26 +231,95 @@ class MeasurementThread(QThread):
                 self.run_cv_measurement(self.parameters)
             else:
                 raise ValueError('Unknown measurement type')
-            self.abort_measurement() #call the abort function when the measurement is finished or aborted
+            if not self.ended: #Aborted, or not finished by one of the run functions (e.g. nothing left to resume)
+                self.abort_measurement()
         except Exception as e:
+            self.running = False
+            self.invalidate_caches() #After an error the state of the devices is unknown, so all settings have to be written again
+            self.restore_integration()
+            try:
+                self.ramp_down()
+            except Exception as ramp_error:
+                print(f'WARNING: The voltage could not be ramped down after the error: {ramp_error}')
             self.error_signal.emit(str(e))
+            self.finished_signal.emit()
+
+    def request_abort(self):
+        #Called from the GUI thread (or the command listener of the acquisition process), returns immediately
+        #The measurement loop stops at its next check, waits are interrupted within milliseconds. The thread then ramps down the voltage itself and emits the finished signal
+        self.running = False
+        self.stop_event.set()
+
+    def pause(self, seconds):
+        #Waits the given time, returns early if the measurement is aborted
+        self.stop_event.wait(seconds)
             
     def set_parameters(self, type, parameters):
         self.type = type
         self.parameters = parameters
         # This function is called to set the parameters for the measurement
 
+    def set_resume(self, plan, point):
+        #The measurement continues an interrupted measurement with the same plan at the given point (voltage index, frequency index)
+        self.resume_plan = plan
+        self.resume_point = tuple(point)
+
+    def set_recipe_voltages(self, bias, hold):
+        #Used by recipes: the SMUs are at the bias voltage at the start, the hold voltage is kept at the end (None: ramp down to 0 V)
+        self.bias = bias
+        self.hold_voltage = hold
+
+    def set_latencies(self, latencies):
+        #Command latencies measured before (dict, see sweep_plan.CommandLatencies), used for the remaining time until this measurement measured its own
+        self.latencies.update(latencies)
+
+    def compile_plan(self, parameters):
+        #Creates the sweep plan (see sweep_plan.py), a resumed measurement uses the plan of the interrupted one. The plan is sent to the journal
+        if self.resume_plan is not None:
+            self.plan = sweep_plan.plan_from_journal(self.resume_plan)
+        else:
+            self.plan = sweep_plan.compile_plan(self.type, parameters)
+        self.voltages = self.plan.voltages
+        self.duration_model = sweep_plan.DurationModel(self.plan, parameters, early_stop = self.target_rse > 0)
+        self.checkpoint_signal.emit({'plan': self.plan.to_journal()})
+
+    def send_checkpoint(self, step, frequency = 0):
+        #Sends the next unmeasured point to the journal and the remaining time to the main thread
+        completed = step >= len(self.plan)
+        self.checkpoint_signal.emit({'next': [step, frequency], 'completed': completed})
+        self.send_progress(self.duration_model.remaining(self.measured_latencies(), step, frequency))
+
+    def measured_latencies(self):
+        #Command latencies measured in this measurement, the ones not measured yet are taken from before
+        self.latencies.update({name: statistics.mean for name, statistics in self.timing.items() if statistics.n > 0})
+        return self.latencies
+
+    def send_progress(self, remaining):
+        self.progress_signal.emit({'remaining': float(remaining), 'latencies': self.latencies.as_dict()})
+
     def start_measurement(self, start):
         #Function that is called when the measurement is started
         #This function sets the voltage and current limits for the SMUs and clears the buffer
         #It also enables the output of the SMUs
         #and sets the voltage to the start voltage 
         self.running = True #Flag to indicate that the measurement is running 
+        self.start_time = time.monotonic_ns() #Reference for the timestamps in the data rows
+        self.scheduler = SampleScheduler(self.time_between_measurements, self.stop_event) #Plans the time between measurements
+        self.range_predictors = {smu: RangePredictor(smu.CURRENT_RANGES) for smu in self.device_handler.smu_devices if getattr(smu, 'predictive_ranging', False)}
+        self.nplc_controllers = {smu: NplcController(smu.noise_target/100, smu.NPLC_LIMITS) for smu in self.device_handler.smu_devices if getattr(smu, 'adaptive_nplc', False)}
+        for device in self.device_handler.smu_devices + self.device_handler.voltmeter_devices + self.device_handler.lowV_devices + self.device_handler.capacitancemeter_devices:
+            if hasattr(device, 'retry'): #Failed rows of the previous measurement do not count
+                device.retry.failed_rows = 0
         for smu in self.device_handler.smu_devices:   #Reset the SMUs and set the current limit
-            smu.set_limit(float(self.limit_I*1e-6))
-            smu.enable_output(True)
-            smu.clear_buffer()
-        if start == 0:   #If the start voltage is not 0, a rampup sequence is started
+            with smu.transaction(): #The settings are sent to each SMU as one message
+                smu.set_limit(float(self.limit_I*1e-6))
+                smu.enable_output(True)
+                smu.clear_buffer()
+        for voltmeter in self.device_handler.voltmeter_devices: #Voltmeters in burst mode collect their first burst during the ramp up
+            if getattr(voltmeter, 'burst_mode', False):
+                voltmeter.configure_burst()
+                voltmeter.start_burst()
+        if np.isclose(start, self.bias):   #If the start voltage is not the voltage at the SMUs (0 V, unless kept by a recipe), a rampup sequence is started
             return 
         else:
             self.rampup(start)
@@ -54,201 +328,416 @@ class MeasurementThread(QThread):
         #Ramps up the voltage to the target voltage
         #This function is called when the measurement is started
         #It sets the voltage to the target voltage in steps of 10V, as big voltage steps are not optimal for the measurement
-        if target < 0:
-            voltages = np.arange(0, target, -10)
+        if target < self.bias:
+            voltages = np.arange(self.bias, target, -10)
         else:
-            voltages = np.arange(0, target, 10)
+            voltages = np.arange(self.bias, target, 10)
 
         for voltage in voltages:
+            if not self.running: #Aborted during the ramp up
+                return
             self.set_voltages(voltage) 
-            QThread.msleep(100)
-        self.set_voltages(target)
+            self.pause(sweep_plan.RAMP_UP_WAIT)
+        if self.running:
+            self.set_voltages(target)
 
         
 
     def run_IV_measurement(self, parameters):
         #Function that is called when the measurement is a IV measurement
-        if parameters['custom_sweep'] == True:  #Checks wether a sweep needs to be created or read from a file
-            self.voltages, self.number_of_measurements = self.read_sweep(parameters['custom_sweep_file'])
-        else: #Creates the linear sweep 
-            self.voltages, self.number_of_measurements = self.linear_sweep(parameters['startV'], parameters['stopV'], parameters['stepV'], parameters['measurements_per_step'])
         self.time_between_steps = int(parameters['time_between_steps']*1000)
         self.time_between_measurements = int(parameters['time_between_measurements']*1000)
         self.limit_I = parameters['limitI']  
+        self.set_early_stop(parameters)
+        self.compile_plan(parameters) #Linear sweep or custom sweep file
+        first_step = self.resume_point[0]
+        if first_step >= len(self.voltages):
+            return
+        self.send_progress(self.duration_model.remaining(self.latencies, first_step))
 
-        self.start_measurement(self.voltages[0]) #The measurement is started with the first voltage
-        for i in range(len(self.voltages)):  #Loops over all voltages
+        self.start_measurement(self.voltages[first_step]) #The measurement is started with the first voltage (the next unmeasured voltage when resuming)
+        for i in range(first_step, len(self.voltages)):  #Loops over all voltages
             if not self.running:  #Checks if the measurement is still running or has been aborted by the user
                 break
             self.set_voltages(self.voltages[i]) #Set the voltage at the SMUs
-            QThread.msleep(self.time_between_steps)  #Wait for built up charge to flow away 
-            for j in range(int(self.number_of_measurements[i])): #Loop over the number of measurements for this voltage
+            self.pause(self.time_between_steps/1000)  #Wait for built up charge to flow away 
+            self.adapt_integration(self.voltages[i]) #Adaptive NPLC
+            self.scheduler.restart() #The first measurement of the step is due now
+            statistics = RunningStatistics() #Current of the first SMU at this step
+            for j in range(int(self.plan.repeats[i])): #Loop over the number of measurements for this voltage (maximum if early stop is enabled)
                 if not self.running:  #Checks if the measurement is still running or has been aborted by the user
                     break 
                 data = self.read_data(self.voltages[i]) #Accumulate the data from all devices
                 self.send_data(data) #Sends the data to the main thread to be saved
-                QThread.msleep(self.time_between_measurements) #Sleep for the time between measurements
+                self.scheduler.wait() #Wait until the next measurement is due
+                statistics.add(data[2])
+                if self.converged(statistics):
+                    break
+            self.send_summary(self.voltages[i], np.nan, 'Current_SMU_0[A]', statistics)
+            if self.running: #Only completed steps are recorded in the journal
+                self.send_checkpoint(i + 1)
         if self.running: #  If the measurement is still running, the abort function is called, after the measurement is finished
-            self.abort_measurement()
+            self.end_measurement(self.voltages[-1])
 
     def run_constantV_measurement(self, parameters):
         #Function that is called when the measurement is a constant voltage measurement
         self.constant_voltage = parameters['constant_voltage']
         self.time_between_measurements = int(parameters['time_between_measurements']*1000)
         self.limit_I = parameters['limitI']
+        duration = parameters.get('duration', 0) #Duration of the measurement [s] (used by recipes), 0: until it is aborted
 
         self.start_measurement(self.constant_voltage) #Start the measurement with the constant voltage
-        while self.running: #Continuously measure the current at the constant voltage as long as the measurement flag is set to True
-            data = self.read_data(self.constant_voltage) #Accumulate the data from all devices
-            self.send_data(data) #Sends the data to the main thread to be saved
-            QThread.msleep(self.time_between_measurements) #Sleep for the time between measurements
+        self.adapt_integration(self.constant_voltage) #Adaptive NPLC, chosen once for the constant voltage
+        buffered_smus = [smu for smu in self.device_handler.smu_devices if getattr(smu, 'buffered', False)]
+        for smu in buffered_smus: #SMUs in buffered mode start collecting their first block
+            smu.configure_block()
+            smu.start_block()
+        self.scheduler.restart()
+        last_progress = -1
+        while self.running and (duration <= 0 or self.clock() < duration): #Continuously measure the current at the constant voltage as long as the measurement flag is set to True
+            if duration > 0 and self.clock() - last_progress >= 1: #Remaining time, once per second
+                last_progress = self.clock()
+                self.send_progress(duration - last_progress)
+            if buffered_smus:
+                rows = self.read_data_block(self.constant_voltage, buffered_smus) #Reads whole blocks at once
+                self.block_signal.emit(rows) #Sends all rows of the block to the main thread at once
+            else:
+                data = self.read_data(self.constant_voltage) #Accumulate the data from all devices
+                self.send_data(data) #Sends the data to the main thread to be saved
+            self.scheduler.wait() #Wait until the next measurement is due (the next fetch for SMUs in logging mode)
+        logging_smus = [smu for smu in buffered_smus if hasattr(smu, 'stop_block')]
+        for smu in logging_smus:
+            smu.stop_block()
+        if logging_smus: #Readings collected since the last fetch
+            self.block_signal.emit(self.read_data_block(self.constant_voltage, buffered_smus, restart = False))
+        if self.running: #The duration is over
+            self.end_measurement(self.constant_voltage)
 
     def run_cv_measurement(self, parameters):
         #This function is used to do CV measurements. This works only with a HAMEG 8118 connected.
-        if parameters['custom_sweep'] == True: #Checks wether a sweep needs to be created or read from a file
-            self.voltages, self.number_of_measurements, self.frequencies = self.read_frequency_sweep(parameters['custom_sweep_file'])
-        else: #Creates the sweep (log or linear)
-            if parameters['logarithmic_frequency_steps'] == True:
-                self.voltages, self.number_of_measurements, self.frequencies = self.frequency_sweep_log(parameters['startV'], parameters['stopV'], parameters['stepV'], parameters['measurements_per_step'], parameters['startFrequency'], parameters['stopFrequency'], parameters['number_of_frequencies'])
-            else:
-                self.voltages, self.number_of_measurements, self.frequencies = self.frequency_sweep_linear(parameters['startV'], parameters['stopV'], parameters['stepV'], parameters['measurements_per_step'], parameters['startFrequency'], parameters['stopFrequency'], parameters['number_of_frequencies'])
         self.time_between_steps = int(parameters['time_between_steps']*1000)
         self.time_between_measurements = int(parameters['time_between_measurements']*1000)
         self.limit_I = parameters['limitI']
-        self.start_measurement(self.voltages[0]) #The measurement is started with the first voltage
-        for i in range(len(self.voltages)): #Loops over all voltages
+        self.set_early_stop(parameters)
+        #Position of the impedance of the first LCR bridge in the data row, it is used for the early stop
+        lcr_column = 1 + 2*self.smu_channel_offset(len(self.device_handler.smu_devices)) + len(self.device_handler.voltmeter_devices)
+        lcr_column += sum(2*lowV.return_num_channels() for lowV in self.device_handler.lowV_devices)
+        self.compile_plan(parameters) #Linear or logarithmic frequencies at every voltage, or a custom sweep file with the frequencies of every voltage
+        first_step, first_frequency = self.resume_point
+        if first_step >= len(self.voltages):
+            return
+        self.send_progress(self.duration_model.remaining(self.latencies, first_step, first_frequency))
+        self.start_measurement(self.voltages[first_step]) #The measurement is started with the first voltage (the next unmeasured voltage when resuming)
+        for i in range(first_step, len(self.voltages)): #Loops over all voltages
             if not self.running: #Checks if the measurement is still running or has been aborted by the user
                 break
             self.set_voltages(self.voltages[i]) #Set the voltage at the SMUs
-            QThread.msleep(self.time_between_steps) #Wait for built up charge to flow away
+            self.pause(self.time_between_steps/1000) #Wait for built up charge to flow away
+            self.adapt_integration(self.voltages[i]) #Adaptive NPLC
+            self.scheduler.restart() #The first measurement of the step is due now
 
-            for j in range(len(self.frequencies)): #Loops over all frequencies at this voltage
+            frequencies = self.plan.step_frequencies(i)
+            for j in range(first_frequency if i == first_step else 0, len(frequencies)): #Loops over all frequencies at this voltage
                 if not self.running: #Checks if the measurement is still running or has been aborted by the user
                     break
-                self.set_frequencies(self.frequencies[j]) #Set the frequency at the capacitance meter
-                data = self.read_data(self.voltages[i], self.frequencies[j]) #Accumulate the data from all devices
-                self.send_data(data) #Sends the data to the main thread to be saved
-                QThread.msleep(self.time_between_measurements) #Sleep for the time between measurements
+                self.set_frequencies(frequencies[j]) #Set the frequency at the capacitance meter
+                #Without early stop every frequency is measured once, with early stop the measurement is repeated until the impedance converged
+                repeats = int(self.plan.repeats[i]) if self.target_rse > 0 else 1
+                statistics = RunningStatistics()
+                for k in range(repeats):
+                    if not self.running:
+                        break
+                    data = self.read_data(self.voltages[i], frequencies[j]) #Accumulate the data from all devices
+                    self.send_data(data) #Sends the data to the main thread to be saved
+                    self.scheduler.wait() #Wait until the next measurement is due
+                    statistics.add(data[lcr_column])
+                    if self.converged(statistics):
+                        break
+                self.send_summary(self.voltages[i], frequencies[j], 'Impedance_LCR_0[Ohm]', statistics)
+                if self.running: #Only completed points are recorded in the journal
+                    if j + 1 < len(frequencies):
+                        self.send_checkpoint(i, j + 1)
+                    else:
+                        self.send_checkpoint(i + 1, 0)
         if self.running:
-            self.abort_measurement()
+            self.end_measurement(self.voltages[-1])
         #If the measurement is still running, the abort function is called, after the measurement is finished
         return 
 
 
-    def read_data(self, voltage = None, frequency = None):
+    def read_data_block(self, voltage, buffered_smus, restart = True):
+        #Function to read whole blocks from the SMUs in buffered mode. Returns one data row per reading of the block
+        #The current columns of the buffered SMUs are filled from their blocks, all other devices are read once per block and their values are repeated in every row
+        #SMUs in logging mode (K2600) return the readings collected since the last call, blocks of different length are padded with NaN
+        #The time of every row is taken from the instrument timestamps of the longest block, aligned so its last reading is at the time of the fetch.
+        #The readout columns (ReadStart/ReadEnd) are the times of the fetch and of the readout of the other devices, they are the same in all rows of a block
+        blocks = {}
+        reference = None #Instrument timestamps of the longest block and the time of its fetch
+        for smu in buffered_smus:
+            timestamps, currents = smu.read_block()
+            fetched = self.clock()
+            if len(timestamps) and (reference is None or len(timestamps) > len(reference[0])):
+                reference = (np.asarray(timestamps, dtype = float), fetched)
+            if restart:
+                smu.start_block() #The next block is collected while this one is processed (logging SMUs keep sampling on their own)
+            currents = np.asarray(currents, dtype = float)
+            if currents.ndim == 1:
+                currents = currents[:, None] #One column per channel
+            first = self.smu_channel_offset(self.device_handler.smu_devices.index(smu))
+            for channel in range(currents.shape[1]):
+                self.burst_signal.emit([f'Current_SMU_{first + channel}[A]', timestamps, currents[:, channel]]) #The instrument timestamps are saved in the companion file
+                blocks[first + channel] = currents[:, channel]
+        data = self.read_data(voltage, skip = buffered_smus)
+        length = max(len(currents) for currents in blocks.values())
+        rows = []
+        for k in range(length):
+            row = list(data)
+            for index, currents in blocks.items():
+                row[2 + 2*index] = float(currents[k]) if k < len(currents) else np.nan
+            if reference is not None and k < len(reference[0]):
+                timestamps, fetched = reference
+                row[self.time_column] = fetched - (timestamps[-1] - timestamps[k])
+            rows.append(row)
+        return rows
+
+    def read_data(self, voltage = None, frequency = None, skip = ()):
         #Function to read the data from all active devices
+        #The currents of the SMUs in skip are not measured (NaN), they are filled in by read_data_block
+        #At the end of the row the time of the sample and the start and end of the readout of every device are appended (seconds since the start of the measurement)
+        #Every device is read with recovery (see read_device), the last column counts the readings of the row that failed and were replaced by NaN
         data = []
         data.append(str(voltage)) #append the voltage to the data list
+        timing = [] #Start and end of the readout of every device
+        sample_time = self.clock()
+        self.failed_reads = 0
 
-        for smu in self.device_handler.smu_devices: #measure the voltage and current for each SMU
-            voltage_smu = smu.measure_voltage() 
-            current_smu = smu.measure_current()
-            data.append(float(voltage_smu))
-            data.append(float(current_smu))
+        for index, smu in enumerate(self.device_handler.smu_devices): #measure the voltage and current for each SMU (each channel of multi-channel SMUs)
+            def read_smu():
+                if smu in skip:
+                    return [float(smu.measure_voltage()), np.nan]*devices.smu_channels(smu)
+                if smu in self.range_predictors:
+                    values = self.read_smu_ranged(smu, self.range_predictors[smu], voltage)
+                else:
+                    values = self.measure_smu(smu)
+                if smu in self.nplc_controllers:
+                    self.nplc_controllers[smu].add(values[1::2])
+                return values
+            start = self.clock()
+            data.extend(self.read_device(smu, f'SMU_{index}', read_smu, 2*devices.smu_channels(smu)))
+            timing.extend([start, self.clock()])
         
-        for voltage_unit in self.device_handler.voltmeter_devices: #measure the quantities for each voltmeter
-            quantity = voltage_unit.measure()
-            data.append(float(quantity))
-
-        for lowV_unit in self.device_handler.lowV_devices: #read the power drawn by the devices at the lowV power supplies (iterates over all channels)
-            U, I = lowV_unit.read_output()
-            data.append(float(U))
-            data.append(float(I))
-
-        for capacitance_unit in self.device_handler.capacitancemeter_devices: 
-            frequency = capacitance_unit.measure_frequency() # Measure the frequency that is set at the capacitance meter
-            impedance, phase = capacitance_unit.measure() #Returns the impedance and phase of the capacitance meter
-
-            data.append(float(impedance))
-            data.append(float(phase))
-            data.append(float(frequency))
+        for index, voltage_unit in enumerate(self.device_handler.voltmeter_devices): #measure the quantities for each voltmeter
+            timing.append(self.clock())
+            if getattr(voltage_unit, 'burst_mode', False): #In burst mode the mean of the burst is saved, the whole burst is sent to the companion file
+                def read_burst():
+                    timestamps, readings = voltage_unit.fetch_burst()
+                    voltage_unit.start_burst() #The next burst is collected until the next call of read_data
+                    self.burst_signal.emit([f'{voltage_unit.type}_{index}', timestamps, readings])
+                    return [float(np.mean(readings)) if len(readings) > 0 else np.nan]
+                def restart_burst(): #After a reconnect the burst has to be started again
+                    voltage_unit.configure_burst()
+                    voltage_unit.start_burst()
+                data.extend(self.read_device(voltage_unit, f'Voltmeter_{index}', read_burst, 1, restart = restart_burst))
+            else:
+                data.extend(self.read_device(voltage_unit, f'Voltmeter_{index}', lambda: [float(voltage_unit.measure())], 1))
+            timing.append(self.clock())
+
+        for index, lowV_unit in enumerate(self.device_handler.lowV_devices): #read the power drawn by the devices at the lowV power supplies (iterates over all channels)
+            start = self.clock()
+            data.extend(self.read_device(lowV_unit, f'lowV_{index}', lambda: lowV_unit.read_output().tolist(), 2*lowV_unit.return_num_channels())) #Voltages of all channels followed by the currents of all channels
+            timing.extend([start, self.clock()])
+
+        for index, capacitance_unit in enumerate(self.device_handler.capacitancemeter_devices): 
+            def read_lcr():
+                frequency = capacitance_unit.measure_frequency() # Measure the frequency that is set at the capacitance meter
+                impedance, phase = capacitance_unit.measure() #Returns the impedance and phase of the capacitance meter
+                return [float(impedance), float(phase), float(frequency)]
+            start = self.clock()
+            data.extend(self.read_device(capacitance_unit, f'LCR_{index}', read_lcr, 3))
+            timing.extend([start, self.clock()])
+        self.time_column = len(data) #Position of the time of the sample, rows of blocks get the times of their readings (read_data_block)
+        data.append(sample_time)
+        data.extend(timing)
+        data.append(self.failed_reads)
+        self.timing['read_row'].add(self.clock() - sample_time)
         return data
+
+    def adapt_integration(self, voltage):
+        #Adaptive NPLC: sets the integration time of the step at the given voltage, the noise model is learned at the first step
+        for index, (smu, controller) in enumerate(self.nplc_controllers.items()):
+            if controller.white is None:
+                def read(nplc):
+                    smu.set_nplc(nplc)
+                    return [np.max(np.abs(self.measure_smu(smu)[1::2])) for k in range(controller.learn_readings)]
+                self.call_with_recovery(smu, f'SMU_{index}', lambda: controller.learn(read))
+            predictor = self.range_predictors.get(smu)
+            nplc = controller.select(predictor.predict(float(voltage)) if predictor is not None else None)
+            self.call_with_recovery(smu, f'SMU_{index}', lambda: smu.set_nplc(nplc))
+
+    def measure_smu(self, smu):
+        #Voltage and current of every channel of the SMU
+        if hasattr(smu, 'measure_iv'): #All channels in one query
+            return smu.measure_iv()
+        voltage_smu = smu.measure_voltage()
+        current_smu = smu.measure_current()
+        return [float(voltage_smu), float(current_smu)]
+
+    def read_smu_ranged(self, smu, predictor, voltage):
+        #Predictive ranging: the measure range is set from the expected current before the reading (the cache skips the write if the range does not change)
+        #If the reading does not fit the range, it is repeated once with autorange
+        current_range = predictor.select(None if voltage is None else float(voltage))
+        smu.set_measure_range(current_range if current_range is not None else 'Auto')
+        values = self.measure_smu(smu)
+        if current_range is not None and not predictor.fits(values[1::2], current_range):
+            predictor.retries += 1
+            smu.set_measure_range('Auto')
+            values = self.measure_smu(smu)
+        predictor.add(None if voltage is None else float(voltage), values[1::2])
+        return values
+
+    def call_with_recovery(self, device, name, call, restart = None):
+        #Calls a function of a device. Transient communication errors are retried with the retry policy of the device (exponential backoff),
+        #before every retry the session is reopened and the cached settings of the device are restored. restart is called after the reconnect (e.g. to restart a burst)
+        #If all retries fail, the last error is raised
+        policy = device.retry
+        for attempt in range(policy.attempts + 1):
+            try:
+                return call()
+            except devices.RECOVERABLE_ERRORS as e:
+                if attempt == policy.attempts or not self.running:
+                    raise
+                delay = policy.wait_time(attempt)
+                print(f'{name}: {e}, reconnecting in {delay:.1f} s (retry {attempt + 1}/{policy.attempts})')
+                if self.stop_event.wait(delay): #Aborted while waiting for the retry
+                    raise
+                try:
+                    devices.reopen_session(device)
+                    if restart is not None:
+                        restart()
+                except devices.RECOVERABLE_ERRORS + (OSError,) as e:
+                    print(f'{name}: reconnect failed: {e}')
+
+    def read_device(self, device, name, read, columns, restart = None):
+        #Reads a device with recovery. If the reading still fails after all retries, its columns are NaN and the failure is counted in the row
+        #The measurement is only aborted if the device fails in more consecutive rows than its retry policy allows
+        try:
+            values = self.call_with_recovery(device, name, read, restart)
+        except devices.RECOVERABLE_ERRORS as e:
+            device.retry.failed_rows += 1
+            if device.retry.failed_rows > device.retry.max_failed_rows:
+                raise RuntimeError(f'{name} failed in {device.retry.failed_rows} consecutive readings, last error: {e}')
+            print(f'{name}: reading failed, written as NaN: {e}')
+            self.failed_reads += 1
+            return [np.nan]*columns
+        device.retry.failed_rows = 0
+        return values
+
+    def smu_channel_offset(self, index):
+        #Number of SMU channels before the SMU with the given index, its first channel has this number in the data columns
+        return sum(devices.smu_channels(smu) for smu in self.device_handler.smu_devices[:index])
+
+    def clock(self):
+        #Returns the time since the start of the measurement in seconds (high resolution, not affected by changes of the system clock)
+        return (time.monotonic_ns() - self.start_time)/1e9
     
     def set_voltages(self, voltage):
         #Funtion to set the voltage for all active SMUs
-        for smu in self.device_handler.smu_devices: #set the voltage for each SMU
-                smu.set_voltage(voltage)
+        start = time.monotonic()
+        for index, smu in enumerate(self.device_handler.smu_devices): #set the voltage for each SMU
+                self.call_with_recovery(smu, f'SMU_{index}', lambda: smu.set_voltage(voltage))
+        self.timing['set_voltage'].add(time.monotonic() - start)
     
     def set_frequencies(self, frequency):
         #Function to set the frequency for all capacitance meters
-        for device in self.device_handler.capacitancemeter_devices: #set the frequency for each capacitance meter
-            device.set_frequency(frequency)
+        start = time.monotonic()
+        for index, device in enumerate(self.device_handler.capacitancemeter_devices): #set the frequency for each capacitance meter
+            self.call_with_recovery(device, f'LCR_{index}', lambda: device.set_frequency(frequency))
+        self.timing['set_frequency'].add(time.monotonic() - start)
+    def end_measurement(self, voltage):
+        #Called when the measurement finished regularly at the given voltage. If the next step of a recipe starts at this voltage, it is kept (no ramp down to 0 V and up again)
+        if self.hold_voltage is not None and np.isclose(voltage, self.hold_voltage):
+            self.running = False
+            self.ended = True
+            print(self.scheduler.statistics())
+            print(f'Keeping {voltage} V for the next measurement')
+            self.restore_integration()
+            self.finished_signal.emit()
+        else:
+            self.abort_measurement()
+
     def abort_measurement(self):
-        #Function to abort the measurement
-        #This function is called when the measurement is aborted or finished
-        #It sets the voltage to 0 and disables the output of the SMUs
-        #It also sets the running flag to False
+        #Function to end the measurement, it runs in the measurement thread (after an abort requested with request_abort or at the end of the measurement)
+        #It ramps the voltage down to 0, disables the output of the SMUs
         #and emits the finished signal to the main thread
         self.running = False
+        if hasattr(self, 'scheduler'):
+            print(self.scheduler.statistics())
+        for smu, predictor in self.range_predictors.items():
+            print(f'{smu.return_assigned_id()}: {predictor.statistics()}')
+        for smu, controller in self.nplc_controllers.items():
+            print(f'{smu.return_assigned_id()}: {controller.statistics()}')
+        self.restore_integration()
+        self.ramp_down()
+        self.ended = True
+        self.finished_signal.emit() #emit the finished signal to the main thread, after the outputs are off (a recipe may start the next measurement)
+
+    def restore_integration(self):
+        #The adaptive NPLC changes the integration time at every step. The NPLC of the settings is set again, so later measurements without adaptive NPLC use it
+        for smu in self.nplc_controllers:
+            try:
+                smu.set_nplc(smu.settings['nplc'])
+            except Exception as e:
+                print(f'WARNING: The NPLC of {smu.return_assigned_id()} could not be restored: {e}')
+
+    def ramp_down(self):
+        #Ramps the voltage of all SMUs down to 0 V in steps of 10 V and switches the outputs off. The ramp is not interrupted by an abort
+        #The progress is sent with the ramp signal, so the GUI shows it while the voltage is ramped down
         voltage = float(self.device_handler.smu_devices[0].measure_voltage())
         if voltage < -0.5:
-            power_down_sequence = np.arange(voltage, 0, 10)
-            for v in power_down_sequence:
-                for smu in self.device_handler.smu_devices:
-                    smu.set_voltage(v)
-                time.sleep(.2)
+            power_down_sequence = np.arange(voltage, 0, sweep_plan.RAMP_STEP)
         elif voltage > 0.5:
-            power_down_sequence = np.arange(voltage, 0, -10)
-            for v in power_down_sequence:
-                for smu in self.device_handler.smu_devices:
-                    smu.set_voltage(v)
-                    time.sleep(.2)
-        self.finished_signal.emit() #emit the finished signal to the main thread
+            power_down_sequence = np.arange(voltage, 0, -sweep_plan.RAMP_STEP)
+        else:
+            power_down_sequence = []
+        for index, v in enumerate(power_down_sequence):
+            self.ramp_signal.emit(float(v), (len(power_down_sequence) - index)*sweep_plan.RAMP_DOWN_WAIT)
+            for smu in self.device_handler.smu_devices:
+                smu.set_voltage(v)
+            time.sleep(sweep_plan.RAMP_DOWN_WAIT)
         for smu in self.device_handler.smu_devices:
             smu.set_voltage(0)
             smu.enable_output(False)
+        self.ramp_signal.emit(0.0, 0.0)
+
+    def invalidate_caches(self):
+        #Function to clear the cached settings of all devices
+        for device in self.device_handler.smu_devices + self.device_handler.voltmeter_devices + self.device_handler.lowV_devices + self.device_handler.capacitancemeter_devices:
+            if hasattr(device, 'cache'):
+                device.cache.invalidate()
 
     def send_data(self, data):
         self.data_signal.emit(data)  # sends the data to the main thread, acts like a button click w/ add data#
 
-    def linear_sweep(self, start, stop, steps, number_of_measurements): 
-        #This function creates a linear sweep from start to stop with the given number of steps
-        if start == stop:
-            raise ValueError('Start and stop voltage are the same, no sweep possible')
-        if start > stop:
-            if steps > 0:
-                raise ValueError('Steps must be negative if start is greater than stop')
-            if abs(stop-start) < abs(steps):
-                raise ValueError('Steps are too big for the given range')
-        else:
-            if steps < 0:
-                raise ValueError('Steps must be positive if start is less than stop')
-            if abs(stop-start) < abs(steps):
-                raise ValueError('Steps are too big for the given range')
-        if steps == 0:
-            raise ValueError('Steps must not be zero')
-        if number_of_measurements <= 0:
-            raise ValueError('Number of measurements must be greater than 0')
-        
+    def set_early_stop(self, parameters):
+        #Early stop: the measurements at a step are stopped as soon as the relative standard error of the mean is below the target
+        #A target of 0 disables the early stop, then always the number of measurements per step is taken
+        self.target_rse = parameters.get('target_rse', 0)/100 #Given in percent
+        self.min_measurements = max(parameters.get('min_measurements_per_step', 2), 2) #At least two measurements are needed for a standard error
 
-        voltages = np.arange(start, stop+steps, steps)
-        n = np.ones(len(voltages))*number_of_measurements
-        return voltages, n
-    
-    def read_sweep(self, file):
-        return np.loadtxt(file, delimiter = ' ', usecols=[0, 1], unpack= True) #reads a csv file with the sweep data
-    
-    def read_frequency_sweep(self, file):
-        voltages, n = np.loadtxt(file, delimiter= ' ', unpack= True, usecols = [0, 1])
-        frequencies = np.loadtxt(file, delimiter= ' ', unpack= True, usecols= [2])
-        return np.array(np.column_stack(voltages, n), frequencies) 
-
-    def frequency_sweep_log(self, startV, stopV, stepV, number_of_measurements, startF, stopF, number_of_frequencies):
-        #Creates an array for voltage and frequency sweeps [voltage, [frequencies at this voltage step]]
-        #For the frequency sweep, the frequencies are logarithmically spaced, and for all voltages the same frequencies are used
-        #If you use different frequencies for each voltage, you need to create the array manually
-#
-        voltages = np.arange(startV, stopV+stepV, stepV)
-        n = np.ones(len(voltages))*number_of_measurements
-        frequencies = np.logspace(np.log10(startF), np.log10(stopF), number_of_frequencies, endpoint=True)
-        
-        return voltages, n, frequencies
-    
-    def frequency_sweep_linear(self, startV, stopV, stepV, number_of_measurements, startF, stopF, number_of_frequencies):
-        #Creates an array for voltage and frequency sweeps [voltage, [frequencies at this voltage step]]
-        #For the frequency sweep, the frequencies are linearly spaced, and for all voltages the same frequencies are used
-        #If you use different frequencies for each voltage, you need to create the array manually
-        voltages = np.arange(startV, stopV+stepV, stepV)
-        n = np.ones(len(voltages))*number_of_measurements
-        frequencies = np.linspace(startF, stopF, number_of_frequencies, endpoint=True)
-        return voltages, n, frequencies
\ No newline at end of file
+    def converged(self, statistics):
+        return self.target_rse > 0 and statistics.n >= self.min_measurements and statistics.relative_sem() < self.target_rse
+
+    def send_summary(self, voltage, frequency, name, statistics):
+        #Sends the summary of a step to the main thread, only if the early stop is enabled
+        if self.target_rse > 0 and statistics.n > 0:
+            self.summary_signal.emit([voltage, frequency, name, statistics.n, statistics.mean, statistics.std(), self.converged(statistics)])
+
+class RampDownThread(MeasurementThread):
+    #Only ramps the voltage down, when no measurement is running (voltage kept by a recipe, crash of the acquisition process), so the GUI stays responsive during the ramp
+    #Emits the ramp signal like a measurement and the finished signal when the outputs are off
+    def run(self):
+        try:
+            self.ramp_down()
+        except Exception as e:
+            self.error_signal.emit(f'The voltage could not be ramped down: {e}')
+        self.finished_signal.emit()
@@ -30,9 +30,9 @@ class ParameterDiaglog_K2400(QDialog):
         self.layout.addRow(QLabel('Source Voltage Range:'), self.voltage_range)
 
         self.current_range = QComboBox(self)
-        self.current_range.addItems(['Auto', '10nA', '100nA', '1uA', '10uA', '100uA', '1mA', '10mA', '100mA', '1A'])
+        self.current_range.addItems(['Auto', 'Predictive', '10nA', '100nA', '1uA', '10uA', '100uA', '1mA', '10mA', '100mA', '1A'])
         self.current_range.setCurrentText('Auto')
-        self.current_range.setToolTip('Select the current range for the measurement')
+        self.current_range.setToolTip('Select the current range for the measurement. Predictive: a fixed range is set before every reading from the trend of the measured currents, without the autorange delay')
         self.current_range.currentTextChanged.connect(self.update_current_range)
         self.layout.addRow(QLabel('Measured Current Range:'), self.current_range)
 
@@ -45,6 +45,19 @@ class ParameterDiaglog_K2400(QDialog):
         self.nlpc.valueChanged.connect(self.update_nplc)
         self.layout.addRow(QLabel('NPLCs (Integration time):'), self.nlpc)
 
+        self.adaptive_nplc = QCheckBox(self)
+        self.adaptive_nplc.setToolTip('Choose the NPLC of every voltage step from the measured current and noise: short integration for high currents, long integration only near the noise floor')
+        self.adaptive_nplc.stateChanged.connect(self.update_adaptive_nplc)
+        self.layout.addRow(QLabel('Adaptive NPLC:'), self.adaptive_nplc)
+
+        self.noise_target = QDoubleSpinBox(self)
+        self.noise_target.setRange(0.001, 100)
+        self.noise_target.setDecimals(3)
+        self.noise_target.setValue(0.1)
+        self.noise_target.setToolTip('Noise of a single reading relative to the current [%], used by the adaptive NPLC')
+        self.noise_target.valueChanged.connect(self.update_adaptive_nplc)
+        self.layout.addRow(QLabel('Noise Target [%]:'), self.noise_target)
+
         self.high_capacitance = QCheckBox(self)
         self.high_capacitance.setToolTip('Enable or disable high capacitance mode for the measurement')
         self.high_capacitance.stateChanged.connect(self.update_high_capacitance)
@@ -95,13 +108,17 @@ class ParameterDiaglog_K2400(QDialog):
             '10mA': 0.01,
             '100mA': 0.1,
             '1A': 1.0,
-            'Auto': 'Auto'
+            'Auto': 'Auto',
+            'Predictive': 'Predictive'
         }
         self.device.set_current_range(current_ranges[self.current_range.currentText()])
 
     def update_nplc(self):
         self.device.set_nplc(self.nlpc.value())
 
+    def update_adaptive_nplc(self):
+        self.device.set_adaptive_nplc(self.adaptive_nplc.isChecked(), self.noise_target.value())
+
     def update_filter(self):
         self.device.set_filter(self.use_filter.isChecked(), self.filter_type.currentText(), self.filter_num.value())
 
@@ -115,15 +132,19 @@ class ParameterDiaglog_K2400(QDialog):
         if settings is None:
             return
         try:
-            self.voltage_range.setCurrentText(settings['voltage_range'])
-            self.current_range.setCurrentText(settings['current_range'])
-            self.nlpc.setValue(settings['nplc'])
-            self.high_capacitance.setChecked(settings['high_capacitance'])
-            self.use_filter.setChecked(settings['use_filter'])
-            self.filter_num.setValue(settings['filter_num'])
-            self.filter_type.setCurrentText(settings['filter_type'])
-            self.auto_zero.setChecked(settings['auto_zero'])
-        except:
+            with self.device.transaction(): # All settings are sent to the device as one message
+                self.voltage_range.setCurrentText(settings['voltage_range'])
+                self.current_range.setCurrentText(settings['current_range'])
+                self.nlpc.setValue(settings['nplc'])
+                self.adaptive_nplc.setChecked(settings.get('adaptive_nplc', False))
+                self.noise_target.setValue(settings.get('noise_target', 0.1))
+                self.high_capacitance.setChecked(settings['high_capacitance'])
+                self.use_filter.setChecked(settings['use_filter'])
+                self.filter_num.setValue(settings['filter_num'])
+                self.filter_type.setCurrentText(settings['filter_type'])
+                self.auto_zero.setChecked(settings['auto_zero'])
+        except Exception as e:
+            print(f'Settings could not be applied: {e}')
             return
         
     def save_settings(self):
@@ -131,6 +152,8 @@ class ParameterDiaglog_K2400(QDialog):
             'voltage_range': self.voltage_range.currentText(),
             'current_range': self.current_range.currentText(),
             'nplc': self.nlpc.value(),
+            'adaptive_nplc': self.adaptive_nplc.isChecked(),
+            'noise_target': self.noise_target.value(),
             'high_capacitance': self.high_capacitance.isChecked(),
             'use_filter': self.use_filter.isChecked(),
             'filter_num': self.filter_num.value(),
@@ -203,9 +226,25 @@ class ParameterDialog_K2000(QDialog):
         self.filter_type.setToolTip('Select the filter type for the measurement')
         self.filter_type.currentTextChanged.connect(self.update_filter)
         layout.addRow(QLabel('Filter Type:'), self.filter_type)
+        layout.addRow(QLabel(''))
+
+        self.burst_mode = QCheckBox(self)
+        self.burst_mode.setToolTip('In burst mode the device collects a number of readings into its buffer while the other devices are measured.\nThe mean is saved in the data file, all readings are saved with timestamps in a companion file.')
+        self.burst_mode.stateChanged.connect(self.update_burst)
+        layout.addRow(QLabel('Burst Mode:'), self.burst_mode)
+
+        self.burst_count = QSpinBox(self)
+        self.burst_count.setRange(1, 1024)
+        self.burst_count.setValue(100)
+        self.burst_count.setToolTip('Number of readings per burst (max. 1024)')
+        self.burst_count.valueChanged.connect(self.update_burst)
+        layout.addRow(QLabel('Readings per Burst:'), self.burst_count)
 
         self.finished.connect(self.save_settings)
 
+    def update_burst(self):
+        self.device.set_burst(self.burst_mode.isChecked(), self.burst_count.value())
+
     def update_measurement_type(self):
         types = {
             'Voltage DC': 'VOLT:DC',
@@ -259,14 +298,18 @@ class ParameterDialog_K2000(QDialog):
         if settings is None:
             return
         try:
-            self.measurement_type.setCurrentText(settings['measurement_type'])
-            self.voltage_range.setCurrentText(settings['voltage_range'])
-            self.current_range.setCurrentText(settings['current_range'])
-            self.resistance_range.setCurrentText(settings['resistance_range'])
-            self.use_filter.setChecked(settings['use_filter'])
-            self.filter_num.setValue(settings['filter_num'])
-            self.filter_type.setCurrentText(settings['filter_type'])
-        except:
+            with self.device.transaction(): # All settings are sent to the device as one message
+                self.measurement_type.setCurrentText(settings['measurement_type'])
+                self.voltage_range.setCurrentText(settings['voltage_range'])
+                self.current_range.setCurrentText(settings['current_range'])
+                self.resistance_range.setCurrentText(settings['resistance_range'])
+                self.use_filter.setChecked(settings['use_filter'])
+                self.filter_num.setValue(settings['filter_num'])
+                self.filter_type.setCurrentText(settings['filter_type'])
+                self.burst_mode.setChecked(settings['burst_mode'])
+                self.burst_count.setValue(settings['burst_count'])
+        except Exception as e:
+            print(f'Settings could not be applied: {e}')
             return
     
     def save_settings(self):
@@ -277,7 +320,9 @@ class ParameterDialog_K2000(QDialog):
             'resistance_range': self.resistance_range.currentText(),
             'use_filter': self.use_filter.isChecked(),
             'filter_num': self.filter_num.value(),
-            'filter_type': self.filter_type.currentText()
+            'filter_type': self.filter_type.currentText(),
+            'burst_mode': self.burst_mode.isChecked(),
+            'burst_count': self.burst_count.value()
         }
         if self in self.logic.open_parameter_dialogs:
             self.logic.open_parameter_dialogs.remove(self)
@@ -308,11 +353,33 @@ class ParameterDialog_K2600(QDialog):
         layout.addRow(QLabel('Source Voltage Range:'), self.voltage_range)
 
         self.current_range = QComboBox(self)
-        self.current_range.addItems(['Auto', '100nA', '1uA', '10uA', '100uA', '1mA', '10mA', '100mA', '1A', '1.5A'])
+        self.current_range.addItems(['Auto', 'Predictive', '100nA', '1uA', '10uA', '100uA', '1mA', '10mA', '100mA', '1A', '1.5A'])
         self.current_range.setCurrentText('Auto')
-        self.current_range.setToolTip('Select the current range for the measurement')
+        self.current_range.setToolTip('Select the current range for the measurement. Predictive: a fixed range is set before every reading from the trend of the measured currents, without the autorange delay')
         self.current_range.currentTextChanged.connect(self.update_current_range)
         layout.addRow(QLabel('Measured Current Range:'), self.current_range)
+
+        self.nplc = QDoubleSpinBox(self)
+        self.nplc.setRange(0.001, 25)
+        self.nplc.setSingleStep(0.01)
+        self.nplc.setDecimals(3)
+        self.nplc.setValue(1)
+        self.nplc.setToolTip('Set the NPLC (Number of Power Line Cycles) for the measurement')
+        self.nplc.valueChanged.connect(self.update_nplc)
+        layout.addRow(QLabel('NPLCs (Integration time):'), self.nplc)
+
+        self.adaptive_nplc = QCheckBox(self)
+        self.adaptive_nplc.setToolTip('Choose the NPLC of every voltage step from the measured current and noise: short integration for high currents, long integration only near the noise floor')
+        self.adaptive_nplc.stateChanged.connect(self.update_adaptive_nplc)
+        layout.addRow(QLabel('Adaptive NPLC:'), self.adaptive_nplc)
+
+        self.noise_target = QDoubleSpinBox(self)
+        self.noise_target.setRange(0.001, 100)
+        self.noise_target.setDecimals(3)
+        self.noise_target.setValue(0.1)
+        self.noise_target.setToolTip('Noise of a single reading relative to the current [%], used by the adaptive NPLC')
+        self.noise_target.valueChanged.connect(self.update_adaptive_nplc)
+        layout.addRow(QLabel('Noise Target [%]:'), self.noise_target)
         
         self.use_filter = QCheckBox(self)
         self.use_filter.setToolTip('Enable or disable the filter for the measurement')
@@ -338,6 +405,25 @@ class ParameterDialog_K2600(QDialog):
         self.high_capacitance.setToolTip('Enable or disable high capacitance mode for the measurement')
         self.high_capacitance.stateChanged.connect(self.update_high_capacitance)
         layout.addRow(QLabel('High Capacitance Mode:'), self.high_capacitance)
+
+        self.use_smub = QCheckBox(self)
+        self.use_smub.setToolTip('Dual-channel models: measure a second DUT at channel B with the same voltage and settings (own voltage and current columns in the data)')
+        self.use_smub.stateChanged.connect(self.update_channels)
+        layout.addRow(QLabel('Use Channel B:'), self.use_smub)
+        layout.addRow(QLabel(''))
+
+        self.logging = QCheckBox(self)
+        self.logging.setToolTip('In logging mode a script on the instrument samples the current at a fixed interval (only for Constant Voltage measurements).\nThe PC fetches the new readings every time between measurements, the instrument timestamps are saved in a companion file.')
+        self.logging.stateChanged.connect(self.update_logging)
+        layout.addRow(QLabel('Logging Mode:'), self.logging)
+
+        self.log_interval = QDoubleSpinBox(self)
+        self.log_interval.setRange(0.01, 3600)
+        self.log_interval.setDecimals(2)
+        self.log_interval.setValue(1)
+        self.log_interval.setToolTip('Time between two readings of the logging script [s]')
+        self.log_interval.valueChanged.connect(self.update_logging)
+        layout.addRow(QLabel('Logging Interval [s]:'), self.log_interval)
         
 
     def update_voltage_range(self):
@@ -361,41 +447,176 @@ class ParameterDialog_K2600(QDialog):
             '100mA': 0.1,
             '1A': 1.0,
             '1.5A': 1.5,
-            'Auto': 'Auto'
+            'Auto': 'Auto',
+            'Predictive': 'Predictive'
         }
         self.device.set_current_range(current_ranges[self.current_range.currentText()])
 
+    def update_nplc(self):
+        self.device.set_nplc(self.nplc.value())
+
+    def update_adaptive_nplc(self):
+        self.device.set_adaptive_nplc(self.adaptive_nplc.isChecked(), self.noise_target.value())
+
     def update_filter(self):
         self.device.set_filter(self.use_filter.isChecked(), self.filter_type.currentText(), self.filter_num.value())
 
     def update_high_capacitance(self):
         self.device.enable_highC(self.high_capacitance.isChecked())
 
+    def update_logging(self):
+        self.device.set_logging(self.logging.isChecked(), self.log_interval.value())
+
+    def update_channels(self):
+        self.device.use_smub(self.use_smub.isChecked())
+        with self.device.transaction(): # The settings are written again for the used channels
+            self.update_voltage_range()
+            self.update_current_range()
+            self.update_nplc()
+            self.update_filter()
+            self.update_high_capacitance()
+
     def load_settings(self, settings):
         if settings is None:
             return
+        self.use_smub.setEnabled(self.device.dual_channel)
         try:
-            self.voltage_range.setCurrentText(settings['voltage_range'])
-            self.current_range.setCurrentText(settings['current_range'])
-            self.use_filter.setChecked(settings['use_filter'])
-            self.filter_num.setValue(settings['filter_num'])
-            self.filter_type.setCurrentText(settings['filter_type'])
-            self.high_capacitance.setChecked(settings['high_capacitance'])
-        except:
+            with self.device.transaction(): # All settings are sent to the device as one message
+                self.voltage_range.setCurrentText(settings['voltage_range'])
+                self.current_range.setCurrentText(settings['current_range'])
+                self.nplc.setValue(settings['nplc'])
+                self.adaptive_nplc.setChecked(settings.get('adaptive_nplc', False))
+                self.noise_target.setValue(settings.get('noise_target', 0.1))
+                self.use_filter.setChecked(settings['use_filter'])
+                self.filter_num.setValue(settings['filter_num'])
+                self.filter_type.setCurrentText(settings['filter_type'])
+                self.high_capacitance.setChecked(settings['high_capacitance'])
+                self.use_smub.setChecked(settings.get('use_smub', False) and self.device.dual_channel)
+                self.logging.setChecked(settings.get('logging', False))
+                self.log_interval.setValue(settings.get('log_interval', 1.0))
+        except Exception as e:
+            print(f'Settings could not be applied: {e}')
             return
         
     def save_settings(self):
         self.device.settings = {
             'voltage_range': self.voltage_range.currentText(),
             'current_range': self.current_range.currentText(),
+            'nplc': self.nplc.value(),
+            'adaptive_nplc': self.adaptive_nplc.isChecked(),
+            'noise_target': self.noise_target.value(),
             'use_filter': self.use_filter.isChecked(),
             'filter_num': self.filter_num.value(),
             'filter_type': self.filter_type.currentText(),
-            'high_capacitance': self.high_capacitance.isChecked()
+            'high_capacitance': self.high_capacitance.isChecked(),
+            'use_smub': self.use_smub.isChecked(),
+            'logging': self.logging.isChecked(),
+            'log_interval': self.log_interval.value()
         }
         if self in self.logic.open_parameter_dialogs:
             self.logic.open_parameter_dialogs.remove(self)
 
 
 
-        
\ No newline at end of file
+        
+
+class ParameterDialog_K6487(QDialog):
+    def __init__(self, device, id, rm, logic):
+        super().__init__()
+        self.setWindowTitle(f'Advanced Settings for {id}') 
+        self.setGeometry(320, 180, 400, 300)
+        self.setup_ui()
+        self.device = device
+        self.rm = rm
+        self.logic = logic
+        self.load_settings(self.device.settings)
+        self.finished.connect(self.save_settings)
+
+    def setup_ui(self):
+        layout = QFormLayout(self)
+        layout.setAlignment(QtCore.Qt.AlignTop)
+        layout.setAlignment(QtCore.Qt.AlignLeft)
+        self.setLayout(layout)
+
+        self.current_range = QComboBox(self)
+        self.current_range.addItems(['Auto', '2nA', '20nA', '200nA', '2uA', '20uA', '200uA', '2mA', '20mA'])
+        self.current_range.setCurrentText('Auto')
+        self.current_range.setToolTip('Select the current range for the measurement. A fixed range avoids the autorange delay')
+        self.current_range.currentTextChanged.connect(self.update_current_range)
+        layout.addRow(QLabel('Measured Current Range:'), self.current_range)
+
+        self.nplc = QDoubleSpinBox(self)
+        self.nplc.setRange(0.01, 50)
+        self.nplc.setSingleStep(0.01)
+        self.nplc.setDecimals(2)
+        self.nplc.setValue(1)
+        self.nplc.setToolTip('Set the NPLC (Number of Power Line Cycles) for the measurement. Small values allow fast acquisitions')
+        self.nplc.valueChanged.connect(self.update_nplc)
+        layout.addRow(QLabel('NPLCs (Integration time):'), self.nplc)
+
+        self.auto_zero = QCheckBox(self)
+        self.auto_zero.setToolTip('Enable or disable auto-zero for the measurement. Disabling it nearly doubles the reading rate')
+        self.auto_zero.setChecked(True)
+        self.auto_zero.stateChanged.connect(self.update_auto_zero)
+        layout.addRow(QLabel('Auto Zero:'), self.auto_zero)
+        layout.addRow(QLabel(''))
+
+        self.buffered = QCheckBox(self)
+        self.buffered.setToolTip('In buffered mode the device collects a block of readings on its own, which is read at once (only for Constant Voltage measurements).\nThe instrument timestamps are saved in a companion file.')
+        self.buffered.stateChanged.connect(self.update_buffer)
+        layout.addRow(QLabel('Buffered Mode:'), self.buffered)
+
+        self.buffer_count = QSpinBox(self)
+        self.buffer_count.setRange(1, 3000)
+        self.buffer_count.setValue(100)
+        self.buffer_count.setToolTip('Number of readings per block (max. 3000)')
+        self.buffer_count.valueChanged.connect(self.update_buffer)
+        layout.addRow(QLabel('Readings per Block:'), self.buffer_count)
+
+    def update_current_range(self):
+        current_ranges = {
+            '2nA': 2e-09,
+            '20nA': 2e-08,
+            '200nA': 2e-07,
+            '2uA': 2e-06,
+            '20uA': 2e-05,
+            '200uA': 2e-04,
+            '2mA': 0.002,
+            '20mA': 0.02,
+            'Auto': 'Auto'
+        }
+        self.device.set_current_range(current_ranges[self.current_range.currentText()])
+
+    def update_nplc(self):
+        self.device.set_nplc(self.nplc.value())
+
+    def update_auto_zero(self):
+        self.device.set_auto_zero(self.auto_zero.isChecked())
+
+    def update_buffer(self):
+        self.device.set_buffer(self.buffered.isChecked(), self.buffer_count.value())
+
+    def load_settings(self, settings):
+        if settings is None:
+            return
+        try:
+            with self.device.transaction(): # All settings are sent to the device as one message
+                self.current_range.setCurrentText(settings['current_range'])
+                self.nplc.setValue(settings['nplc'])
+                self.auto_zero.setChecked(settings['auto_zero'])
+                self.buffered.setChecked(settings['buffered'])
+                self.buffer_count.setValue(settings['buffer_count'])
+        except Exception as e:
+            print(f'Settings could not be applied: {e}')
+            return
+
+    def save_settings(self):
+        self.device.settings = {
+            'current_range': self.current_range.currentText(),
+            'nplc': self.nplc.value(),
+            'auto_zero': self.auto_zero.isChecked(),
+            'buffered': self.buffered.isChecked(),
+            'buffer_count': self.buffer_count.value()
+        }
+        if self in self.logic.open_parameter_dialogs:
+            self.logic.open_parameter_dialogs.remove(self)
@@ -1,19 +1,48 @@
 #In this file all the stuff related to the plotting of the canvas is handled. 
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
-from PyQt5.QtWidgets import QFileDialog
-from PyQt5.QtCore import Qt
-import matplotlib.pyplot as plt
+from PyQt5.QtWidgets import QFileDialog, QWidget, QVBoxLayout
+from PyQt5.QtCore import Qt, QTimer
+import matplotlib
+from matplotlib.colors import LogNorm
+from matplotlib.cm import ScalarMappable
+import importlib.util
 import numpy as np
-import pandas as pd
-from mpl_toolkits.axes_grid1.inset_locator import inset_axes
-from matplotlib.gridspec import GridSpec
+import time
+
+pg = None # pyqtgraph is only imported when its backend is selected (load_pyqtgraph), to keep the startup fast
+BACKENDS = ['matplotlib'] + (['pyqtgraph', 'pyqtgraph (OpenGL)'] if importlib.util.find_spec('pyqtgraph') is not None else []) # Available backends for the live plot, pyqtgraph only if it is installed
+BLUE = (31, 119, 180) # Same colors as tab:blue and tab:orange of matplotlib
+ORANGE = (255, 127, 14)
+FREQUENCY_RANGE = (20, 200e3) # Frequency range of the LCR bridge, used for the colors of the CV curves until the frequencies of the measurement are known
+FREQUENCY_CMAP = matplotlib.colormaps['viridis']
+CV_PANELS = ['phase_voltage', 'phase_frequency', 'impedance_voltage', 'impedance_frequency'] #Panels of the CV plot, in the order of the axes (see history.display_series)
+
+def load_pyqtgraph():
+    global pg
+    if pg is None:
+        import pyqtgraph
+        pg = pyqtgraph
+
+def frequency_norm(low, high):
+    #Logarithmic norm for the colors of the CV curves, spread over the measured frequencies. A single frequency gets the color in the middle of the colormap
+    if high <= low:
+        return LogNorm(vmin=low/2, vmax=low*2)
+    return LogNorm(vmin=low, vmax=high)
+
+def add_cv_point(series, voltage, frequency, impedance, phase):
+    #Adds a CV point to the curve of its frequency (dict frequency -> [voltages, phases, impedances])
+    curve = series.setdefault(frequency, ([], [], []))
+    curve[0].append(voltage)
+    curve[1].append(phase)
+    curve[2].append(impedance)
 
 class PlotCanvas(FigureCanvas):
     def __init__(self, parent=None):
         #Initializes the plot canvas
         
-        self.fig, self.ax = plt.subplots() #Create a figure and axis
+        self.fig = Figure() #Create a figure and axis (without pyplot, which is not needed for an embedded canvas)
+        self.ax = self.fig.add_subplot(111)
         super().__init__(self.fig)
         self.setParent(parent)
         self.ui = parent
@@ -31,46 +60,91 @@ class PlotCanvas(FigureCanvas):
         self.frequencies_cv = []
         self.impedance_cv = [] 
         self.phase_cv = []
+        self.cv_series = {} #CV curves by frequency
+        self.frequency_range = FREQUENCY_RANGE #Frequencies of the measurement, set with set_frequency_range
+        self.frequency_norm = frequency_norm(*FREQUENCY_RANGE)
+        self.cv_colorbars = []
+        self.cv_lines = {} #Line artists of the CV curves by frequency (phase and impedance over voltage), updated in place
+        self.cv_changed = set() #Frequencies with new points since the last redraw
+        self.redraw_interval = 0.2 #Minimum time between two redraws of the CV plot [s]
+        self.last_draw = 0
+        self.overlays = {} #Loaded measurements (history browser) by file: (series, color, artists)
+        self.redraw_timer = QTimer(self) #Draws the last points, if a redraw was skipped
+        self.redraw_timer.setSingleShot(True)
+        self.redraw_timer.timeout.connect(self.redraw)
+
+    def setup_cv_axes(self):
+        #Sets up the four CV panels once, afterwards only the data of the lines is updated
+        #Voltage panels: one curve per frequency (color by frequency), frequency panels: all points
+        self.ax1.set_title('CV Voltage')
+        self.ax2.set_title('CV Frequency')
+        self.ax1.set_xlabel('Voltage [V]')
+        self.ax2.set_xlabel('Frequency [Hz]')
+        self.ax3.set_xlabel('Voltage [V]')
+        self.ax4.set_xlabel('Frequency [Hz]')
+        self.ax1.set_ylabel('Phase [°]')
+        self.ax2.set_ylabel('Phase [°]')
+        self.ax3.set_ylabel('Impedance [Ω]')
+        self.ax4.set_ylabel('Impedance [Ω]')
+        self.ax2.set_xscale('log')
+        self.ax4.set_xscale('log')
+        self.phase_frequency_line, = self.ax2.plot([], [], label='Phase', linestyle='none', marker = 'o', color='tab:blue')
+        self.impedance_frequency_line, = self.ax4.plot([], [], label='Impedance', linestyle='none', marker = 'o', color='tab:orange')
+        self.ax2.legend(loc='upper right')
+        self.ax4.legend(loc='upper right')
+        for ax in [self.ax1, self.ax2, self.ax3, self.ax4]:
+            ax.grid(True)
+        self.cv_colorbars = [self.fig.colorbar(ScalarMappable(norm=self.frequency_norm, cmap=FREQUENCY_CMAP), ax=ax, label='Frequency [Hz]') for ax in [self.ax1, self.ax3]]
+        self.cv_lines = {}
+        self.fig.tight_layout()
+
+    def draw_cv_plot(self):
+        #Updates the CV lines with new points, new frequencies get their own lines
+        for frequency in self.cv_changed:
+            voltage, phase, impedance = self.cv_series[frequency]
+            if frequency not in self.cv_lines:
+                color = FREQUENCY_CMAP(self.frequency_norm(frequency))
+                self.cv_lines[frequency] = (self.ax1.plot([], [], marker='o', markersize=4, color=color)[0],
+                                            self.ax3.plot([], [], marker='o', markersize=4, color=color)[0])
+            phase_line, impedance_line = self.cv_lines[frequency]
+            phase_line.set_data(voltage, phase)
+            impedance_line.set_data(voltage, impedance)
+        self.cv_changed = set()
+        self.phase_frequency_line.set_data(self.frequencies_cv, self.phase_cv)
+        self.impedance_frequency_line.set_data(self.frequencies_cv, self.impedance_cv)
+        for ax in [self.ax1, self.ax2, self.ax3, self.ax4]:
+            ax.relim(visible_only=True) #Hidden overlays do not change the limits
+            ax.autoscale_view()
+        self.request_redraw()
+
+    def set_frequency_range(self, low, high):
+        #Spreads the colors of the CV curves over the frequencies of the measurement, the colorbars and existing curves are updated
+        self.frequency_range = (float(low), float(high))
+        self.frequency_norm = frequency_norm(*self.frequency_range)
+        for colorbar in self.cv_colorbars:
+            colorbar.mappable.set_norm(self.frequency_norm)
+        for frequency, lines in self.cv_lines.items():
+            for line in lines:
+                line.set_color(FREQUENCY_CMAP(self.frequency_norm(frequency)))
+        self.request_redraw()
+
+    def request_redraw(self):
+        #Redraws the canvas at most every redraw_interval seconds. A skipped redraw is done by the timer, so the last points are always shown
+        elapsed = time.monotonic() - self.last_draw
+        if elapsed >= self.redraw_interval:
+            self.redraw()
+        elif not self.redraw_timer.isActive():
+            self.redraw_timer.start(int((self.redraw_interval - elapsed)*1000))
+
+    def redraw(self):
+        self.last_draw = time.monotonic()
+        self.draw_idle()
 
     def draw_plot(self):
         #This function will redraw the plot with the current data
         if self.parameters['type'] == 'CV':
-            self.ax1.clear()
-            self.ax2.clear()
-            self.ax3.clear()
-            self.ax4.clear()
-            
-            self.ax1.plot(self.voltage_cv, self.phase_cv, label='Phase', linestyle='none', marker = 'o', color='tab:blue')
-            self.ax3.plot(self.voltage_cv, self.impedance_cv, label='Impedance', linestyle='none', marker = 'o', color='tab:orange')
-            self.ax2.plot(self.frequencies_cv, self.phase_cv, label='Phase', linestyle='none', marker = 'o', color='tab:blue')
-            self.ax4.plot(self.frequencies_cv, self.impedance_cv, label='Impedance', linestyle='none', marker = 'o', color='tab:orange')
-            
-            self.ax1.set_title('CV Voltage')
-            self.ax2.set_title('CV Frequency')
-
-            self.ax1.set_xlabel('Voltage [V]')
-            self.ax2.set_xlabel('Frequency [Hz]')
-            self.ax3.set_xlabel('Voltage [V]')
-            self.ax4.set_xlabel('Frequency [Hz]')
-            self.ax1.set_ylabel('Phase [°]')
-            self.ax2.set_ylabel('Phase [°]')
-            self.ax3.set_ylabel('Impedance [Ω]')
-            self.ax4.set_ylabel('Impedance [Ω]')
-
-            self.ax1.legend(loc='upper right')
-            self.ax2.legend(loc='upper right')
-            self.ax3.legend(loc='upper right')
-            self.ax4.legend(loc='upper right')
-
-            self.ax2.set_xscale('log')
-            self.ax4.set_xscale('log')
-
-            self.ax1.grid(True)
-            self.ax2.grid(True)
-            self.ax3.grid(True)
-            self.ax4.grid(True)
-
-            self.fig.tight_layout()
+            self.draw_cv_plot()
+            return
         else:
             live_data_lines = [line for line in self.ax.lines if line.get_label() == 'Live Data']
             for line in live_data_lines:
@@ -98,6 +172,8 @@ class PlotCanvas(FigureCanvas):
         self.frequencies_cv.append(float(frequency))
         self.impedance_cv.append(float(impedance))
         self.phase_cv.append(float(phase))
+        add_cv_point(self.cv_series, float(voltage), float(frequency), float(impedance), float(phase))
+        self.cv_changed.add(float(frequency))
 
         
     def change_plot_type(self, type):
@@ -106,12 +182,13 @@ class PlotCanvas(FigureCanvas):
         self.parameters['labels'] = ['Live Data']
         self.live_x_data = []  #Clear all the data 
         self.live_y_data = []
-        self.old_x_data = []
-        self.old_y_data = []
+        self.overlays = {} #The overlays are removed with the figure, the history browser adds them again for the new type
         self.voltage_cv = []
         self.frequencies_cv = []
         self.impedance_cv = [] 
         self.phase_cv = []  
+        self.cv_series = {}
+        self.cv_changed = set()
 
         self.fig.clear()  # Clear the figure   
         if type == 'IV':
@@ -125,9 +202,7 @@ class PlotCanvas(FigureCanvas):
 
             self.ax3= self.fig.add_subplot(2, 2, 3)
             self.ax4 = self.fig.add_subplot(2, 2, 4)    
-
-#
-            self.ax.autoscale_view(scalex=True, scaley=True)
+            self.setup_cv_axes()
         elif type == 'Constant Voltage':
             self.ax = self.fig.add_subplot(111)
             self.parameters['x_label'] = 'Number of Measurements'
@@ -143,29 +218,301 @@ class PlotCanvas(FigureCanvas):
         self.frequencies_cv = [] 
         self.impedance_cv = [] #Only for CV to store impedance data
         self.phase_cv = [] #Only for CV to store phase data        
+        self.cv_series = {}
+        self.cv_changed = set()
+        if self.parameters['type'] == 'CV': #The lines of the last measurement are removed, the axes are kept
+            for lines in self.cv_lines.values():
+                for line in lines:
+                    line.remove()
+            self.cv_lines = {}
         self.draw_plot()
         self.ax.autoscale_view(scalex=True, scaley=True)
         
+    def overlay_axes(self, panel):
+        if panel == 'main':
+            return self.ax
+        return [self.ax1, self.ax2, self.ax3, self.ax4][CV_PANELS.index(panel)]
+
+    def set_overlay(self, key, series, color, visible = True):
+        #Shows a loaded measurement (dict panel -> (x, y), see history.display_series) behind the live data
+        #The label starts with '_', so the overlays are not shown in the legend (the history browser shows the files in their colors)
+        self.remove_overlay(key, redraw = False)
+        artists = []
+        for panel, (x, y) in series.items():
+            line_style = '-' if panel.endswith('_voltage') else 'None' #The CV curves over the voltage are connected like the live data
+            artists.append(self.overlay_axes(panel).plot(x, y, label='_overlay', linestyle=line_style, marker='o', markersize=3, color=color, alpha=0.6, zorder=1, visible=visible)[0])
+        self.overlays[key] = (series, color, artists)
+        self.rescale()
+
+    def set_overlay_visible(self, key, visible):
+        #Shows or hides a loaded measurement, returns False if it is not in the plot
+        if key not in self.overlays:
+            return False
+        for artist in self.overlays[key][2]:
+            artist.set_visible(visible)
+        self.rescale()
+        return True
+
+    def remove_overlay(self, key, redraw = True):
+        if key not in self.overlays:
+            return
+        for artist in self.overlays.pop(key)[2]:
+            artist.remove()
+        if redraw:
+            self.rescale()
+
+    def rescale(self):
+        #Fits the axes to the visible lines (live data and overlays)
+        axes = [self.ax1, self.ax2, self.ax3, self.ax4] if self.parameters['type'] == 'CV' else [self.ax]
+        for ax in axes:
+            ax.relim(visible_only=True)
+            ax.autoscale_view()
+        self.request_redraw()
+
     def clear_old_data(self):
         #This function will clear the old data
-        old_data_lines = [line for line in self.ax.lines if line.get_label() != 'Live Data']
-        for line in old_data_lines:
-            line.remove()
-        self.old_x_data = []
-        self.old_y_data = []
-        self.draw_plot()
-        self.ax.autoscale_view(scalex=True, scaley=True)
-        
-    def load_old_data(self):
-        #This function will load the old data
-        file = QFileDialog.getOpenFileName(self.ui, 'Open File', self.ui.data_path, 'CSV files (*.csv);;All files (*)')[0]
+        for key in list(self.overlays):
+            self.remove_overlay(key, redraw = False)
+        self.rescale()
+
+    def export_figure(self):
+        #Saves the plot as it is shown (png, pdf or svg)
+        file = QFileDialog.getSaveFileName(self.ui, 'Export Plot', self.ui.data_path, 'PNG (*.png);;PDF (*.pdf);;SVG (*.svg)')[0]
         if file:
-            if self.parameters['type'] == 'IV':
-                self.old_x_data, self.old_y_data = np.loadtxt(file, delimiter=' ', unpack=True, skiprows=1, usecols = [1, 2])
-                self.ax.plot(np.array(self.old_x_data), np.array(self.old_y_data), label=str(file), linestyle ='None', marker='o')   
-            elif self.parameters['type'] == 'CV':
-                print('This function is not available for CV Measurements.')
-            elif self.parameters['type'] == 'Constant Voltage': 
-                self.old_x_data, self.old_y_data = np.loadtxt(file, delimiter=' ', unpack=True, skiprows=1, usecols = [1, 2])
-                self.ax.plot(np.arange(len(self.old_y_data)), np.array(self.old_y_data), label=str(file), linestyle ='None', marker='o')
-            self.draw_plot()    
\ No newline at end of file
+            self.fig.savefig(file)
+
+
+class PyQtGraphCanvas(QWidget):
+    #Live plot drawn with pyqtgraph. It offers the same functions as the PlotCanvas, but only updates the data of the existing plot items instead of redrawing the whole figure
+    #This allows much higher refresh rates. For figures in publication quality the plot can be exported with matplotlib (export_figure)
+    def __init__(self, parent=None, use_opengl=False):
+        super().__init__(parent)
+        load_pyqtgraph()
+        self.ui = parent
+        self.parameters = {
+            'type': 'IV',  # Type of measurement (IV, CV, Constant Voltage)
+            'labels': ['Live Data'],
+            'y_label': 'Current [A]',
+            'x_label': 'Voltage [V]',
+        }
+        self.live_x_data = [] # Voltage for IV and CV, Number of Measurements for Constant Voltage
+        self.live_y_data = [] # Current for IV and Constant Voltage
+        self.voltage_cv = []
+        self.frequencies_cv = []
+        self.impedance_cv = [] 
+        self.phase_cv = []
+        self.cv_series = {} #CV curves by frequency
+        self.frequency_range = FREQUENCY_RANGE #Frequencies of the measurement, set with set_frequency_range
+        self.frequency_norm = frequency_norm(*FREQUENCY_RANGE)
+        self.cv_curves = {} #Plot items of the CV curves by frequency (phase and impedance over voltage)
+        self.overlays = {} #Loaded measurements (history browser) by file: (series, color, items)
+
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.graphics = pg.GraphicsLayoutWidget()
+        if use_opengl: # The CPU path is always available, OpenGL needs PyOpenGL
+            try:
+                self.graphics.useOpenGL(True)
+            except Exception as e:
+                print(f'OpenGL could not be enabled, using the CPU: {e}')
+        layout.addWidget(self.graphics)
+        self.setup_plots()
+
+    def setup_plots(self):
+        #Creates the plots for the current measurement type, the data is only set in draw_plot
+        self.graphics.clear()
+        self.overlays = {} #The plot items are removed with the plots, the history browser adds them again
+        if self.parameters['type'] == 'CV':
+            panels = [('CV Voltage', 'Voltage [V]', 'Phase [°]', False, BLUE, 'Phase'),
+                      ('CV Frequency', 'Frequency [Hz]', 'Phase [°]', True, BLUE, 'Phase'),
+                      (None, 'Voltage [V]', 'Impedance [Ω]', False, ORANGE, 'Impedance'),
+                      (None, 'Frequency [Hz]', 'Impedance [Ω]', True, ORANGE, 'Impedance')]
+            self.cv_items = []
+            self.cv_plots = []
+            self.cv_curves = {}
+            for index, (title, x_label, y_label, log_x, color, name) in enumerate(panels):
+                plot = self.graphics.addPlot(row = index // 2, col = index % 2, title = title)
+                plot.setLabel('bottom', x_label)
+                plot.setLabel('left', y_label)
+                plot.setLogMode(x = log_x, y = False)
+                plot.showGrid(x = True, y = True)
+                plot.addLegend()
+                self.cv_plots.append(plot)
+                self.cv_items.append(plot.plot([], [], pen = None, symbol = 'o', symbolSize = 6, symbolPen = None, symbolBrush = color, name = name))
+            self.cv_items[0].setVisible(False) #The voltage panels show one curve per frequency instead
+            self.cv_items[2].setVisible(False)
+        else:
+            self.plot = self.graphics.addPlot(title = self.parameters['type'] + ' Measurement')
+            self.plot.setLabel('bottom', self.parameters['x_label'])
+            self.plot.setLabel('left', self.parameters['y_label'])
+            self.plot.showGrid(x = True, y = True)
+            self.plot.setClipToView(True) # Only the visible points are drawn
+            self.plot.addLegend()
+            self.live_item = self.plot.plot([], [], pen = None, symbol = 'o', symbolSize = 6, symbolPen = None, symbolBrush = BLUE, name = self.parameters['labels'][0])
+
+    def draw_plot(self):
+        #Updates the data of the plot items
+        if self.parameters['type'] == 'CV':
+            voltage = np.array(self.voltage_cv)
+            frequency = np.array(self.frequencies_cv)
+            impedance = np.array(self.impedance_cv)
+            phase = np.array(self.phase_cv)
+            for item, (x, y) in zip(self.cv_items, [(voltage, phase), (frequency, phase), (voltage, impedance), (frequency, impedance)]):
+                item.setData(x, y)
+            for frequency, (voltage, phase, impedance) in self.cv_series.items(): #One curve per frequency in the voltage panels, colored like in matplotlib
+                if frequency not in self.cv_curves:
+                    color = self.frequency_color(frequency)
+                    self.cv_curves[frequency] = (self.cv_plots[0].plot([], [], pen = color, symbol = 'o', symbolSize = 5, symbolPen = None, symbolBrush = color),
+                                                 self.cv_plots[2].plot([], [], pen = color, symbol = 'o', symbolSize = 5, symbolPen = None, symbolBrush = color))
+                phase_curve, impedance_curve = self.cv_curves[frequency]
+                phase_curve.setData(voltage, phase)
+                impedance_curve.setData(voltage, impedance)
+        else:
+            y = np.array(self.live_y_data)
+            x = np.array(self.live_x_data) if self.parameters['type'] == 'IV' else np.arange(len(y))
+            self.live_item.setData(x, y)
+
+    def update_data(self, x_data, y_data):
+        #This function will update the data of the plot
+        self.live_x_data.append(float(x_data))
+        self.live_y_data.append(float(y_data))  
+
+    def update_cv_data(self, voltage, frequency, impedance, phase):
+        self.voltage_cv.append(float(voltage))
+        self.frequencies_cv.append(float(frequency))
+        self.impedance_cv.append(float(impedance))
+        self.phase_cv.append(float(phase))
+        add_cv_point(self.cv_series, float(voltage), float(frequency), float(impedance), float(phase))
+
+    def frequency_color(self, frequency):
+        return tuple(int(255*c) for c in FREQUENCY_CMAP(self.frequency_norm(frequency))[:3])
+
+    def set_frequency_range(self, low, high):
+        #Spreads the colors of the CV curves over the frequencies of the measurement, existing curves are recolored
+        self.frequency_range = (float(low), float(high))
+        self.frequency_norm = frequency_norm(*self.frequency_range)
+        for frequency, curves in self.cv_curves.items():
+            color = self.frequency_color(frequency)
+            for curve in curves:
+                curve.setPen(color)
+                curve.setSymbolBrush(color)
+
+    def change_plot_type(self, type):
+        #This function will change the plot type, all data is cleared
+        self.parameters['type'] = type
+        self.parameters['labels'] = ['Live Data']
+        self.parameters['x_label'] = 'Number of Measurements' if type == 'Constant Voltage' else 'Voltage [V]'
+        self.parameters['y_label'] = 'Current [A]'
+        self.live_x_data = []
+        self.live_y_data = []
+        self.voltage_cv = []
+        self.frequencies_cv = []
+        self.impedance_cv = []
+        self.phase_cv = []
+        self.cv_series = {}
+        self.setup_plots()
+        self.draw_plot()
+
+    def clear_live_data(self):
+        #This function will clear the live data
+        self.live_x_data = []
+        self.live_y_data = []
+        self.voltage_cv = []  
+        self.frequencies_cv = [] 
+        self.impedance_cv = []
+        self.phase_cv = []
+        self.cv_series = {}
+        if self.parameters['type'] == 'CV':
+            for curves in self.cv_curves.values():
+                self.cv_plots[0].removeItem(curves[0])
+                self.cv_plots[2].removeItem(curves[1])
+            self.cv_curves = {}
+        self.draw_plot()
+
+    def overlay_plot(self, panel):
+        if panel == 'main':
+            return self.plot
+        return self.cv_plots[CV_PANELS.index(panel)]
+
+    def set_overlay(self, key, series, color, visible = True):
+        #Shows a loaded measurement (dict panel -> (x, y), see history.display_series), without a legend entry like in the PlotCanvas
+        self.remove_overlay(key)
+        items = []
+        for panel, (x, y) in series.items():
+            pen = pg.mkPen(color) if panel.endswith('_voltage') else None #The CV curves over the voltage are connected, they are separated by NaN
+            item = self.overlay_plot(panel).plot(x, y, pen = pen, connect = 'finite', symbol = 'o', symbolSize = 4, symbolPen = None, symbolBrush = color)
+            item.setZValue(-1) #Behind the live data
+            item.setVisible(visible)
+            items.append(item)
+        self.overlays[key] = (series, color, items)
+
+    def set_overlay_visible(self, key, visible):
+        #Shows or hides a loaded measurement, returns False if it is not in the plot
+        if key not in self.overlays:
+            return False
+        for item in self.overlays[key][2]:
+            item.setVisible(visible)
+        return True
+
+    def remove_overlay(self, key):
+        if key not in self.overlays:
+            return
+        series, color, items = self.overlays.pop(key)
+        for panel, item in zip(series, items):
+            self.overlay_plot(panel).removeItem(item)
+
+    def clear_old_data(self):
+        #This function will clear the old data
+        for key in list(self.overlays):
+            self.remove_overlay(key)
+
+    def export_figure(self):
+        #Renders the current data with matplotlib and saves it (png, pdf or svg), for figures in publication quality
+        file = QFileDialog.getSaveFileName(self.ui, 'Export Plot', self.ui.data_path, 'PNG (*.png);;PDF (*.pdf);;SVG (*.svg)')[0]
+        if not file:
+            return
+        fig = Figure()
+        if self.parameters['type'] == 'CV':
+            axes = fig.subplots(2, 2)
+            panels = [(axes[0][0], self.voltage_cv, self.phase_cv, 'Voltage [V]', 'Phase [°]', 'tab:blue', 'Phase'),
+                      (axes[0][1], self.frequencies_cv, self.phase_cv, 'Frequency [Hz]', 'Phase [°]', 'tab:blue', 'Phase'),
+                      (axes[1][0], self.voltage_cv, self.impedance_cv, 'Voltage [V]', 'Impedance [Ω]', 'tab:orange', 'Impedance'),
+                      (axes[1][1], self.frequencies_cv, self.impedance_cv, 'Frequency [Hz]', 'Impedance [Ω]', 'tab:orange', 'Impedance')]
+            for panel, (ax, x, y, x_label, y_label, color, label) in zip(CV_PANELS, panels):
+                self.export_overlays(ax, panel)
+                if 'Voltage' in x_label: #One curve per frequency
+                    for frequency, (voltage, phase, impedance) in self.cv_series.items():
+                        ax.plot(voltage, phase if label == 'Phase' else impedance, marker='o', markersize=4, color=FREQUENCY_CMAP(self.frequency_norm(frequency)))
+                    fig.colorbar(ScalarMappable(norm=self.frequency_norm, cmap=FREQUENCY_CMAP), ax=ax, label='Frequency [Hz]')
+                    ax.set_xlabel(x_label)
+                    ax.set_ylabel(y_label)
+                    ax.grid(True)
+                    continue
+                ax.plot(x, y, label=label, linestyle='none', marker='o', color=color)
+                ax.set_xlabel(x_label)
+                ax.set_ylabel(y_label)
+                ax.legend(loc='upper right')
+                ax.grid(True)
+            axes[0][0].set_title('CV Voltage')
+            axes[0][1].set_title('CV Frequency')
+            axes[0][1].set_xscale('log')
+            axes[1][1].set_xscale('log')
+        else:
+            ax = fig.subplots()
+            x = self.live_x_data if self.parameters['type'] == 'IV' else np.arange(len(self.live_y_data))
+            ax.plot(x, self.live_y_data, label=self.parameters['labels'][0], linestyle='None', marker='o', color='tab:blue')
+            self.export_overlays(ax, 'main')
+            ax.set_title(self.parameters['type'] + ' Measurement')
+            ax.set_xlabel(self.parameters['x_label'])
+            ax.set_ylabel(self.parameters['y_label'])
+            ax.grid(True)
+            ax.legend()
+        fig.tight_layout()
+        fig.savefig(file)    
+
+    def export_overlays(self, ax, panel):
+        #Draws the visible loaded measurements of a panel into the exported figure, styled like in the PlotCanvas
+        for series, color, items in self.overlays.values():
+            if panel in series and items[0].isVisible():
+                x, y = series[panel]
+                ax.plot(x, y, label='_overlay', linestyle='-' if panel.endswith('_voltage') else 'None', marker='o', markersize=3, color=color, alpha=0.6, zorder=1)
@@ -0,0 +1,155 @@
+#This file contains the publisher, which streams the measured data to external programs (slow control, monitoring) over a local TCP socket
+#Every message starts with a type byte and the length of the payload (little endian, unsigned 32 bit):
+#   b'S': schema, JSON with the column names of the data file (same as the header written by the DataSaver), the data type and the data file. Sent to every new subscriber and when a new measurement starts
+#   b'D': one data row, all columns as float64 (little endian) in the order of the schema
+#Slow subscribers never block the measurement: every subscriber has a limited backlog, rows that do not fit anymore are dropped (and counted)
+import socket
+import selectors
+import threading
+import struct
+import json
+import numpy as np
+
+MESSAGE_HEADER = struct.Struct('<cI') #Type byte and length of the payload
+DTYPE = '<f8'
+
+class Subscriber:
+    def __init__(self, connection, address):
+        self.connection = connection
+        self.address = address
+        self.pending = bytearray() #Data not yet sent to the subscriber
+        self.dropped = 0 #Rows dropped because the subscriber did not keep up
+
+class DataPublisher:
+    def __init__(self, host = '127.0.0.1', port = 5555, max_backlog = 4*1024*1024):
+        self.host = host
+        self.port = port
+        self.max_backlog = max_backlog #Maximum number of bytes waiting for a single subscriber
+        self.schema = None #Last schema message, sent to every new subscriber
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.selector = selectors.DefaultSelector()
+        self.server = socket.create_server((host, port))
+        self.server.setblocking(False)
+        self.port = self.server.getsockname()[1] #The actual port, if port 0 was given
+        self.wakeup_receiver, self.wakeup_sender = socket.socketpair() #Wakes the publisher thread up when new data is waiting
+        self.wakeup_receiver.setblocking(False)
+        self.wakeup_sender.setblocking(False)
+        self.selector.register(self.server, selectors.EVENT_READ)
+        self.selector.register(self.wakeup_receiver, selectors.EVENT_READ)
+        self.running = True
+        self.thread = threading.Thread(target = self.serve, daemon = True)
+        self.thread.start()
+        print(f'Publishing data on {self.host}:{self.port}')
+
+    def set_schema(self, header, file = None):
+        #Sends the column names of a new measurement to all subscribers
+        payload = json.dumps({'columns': list(header), 'dtype': DTYPE, 'file': file}).encode()
+        with self.lock:
+            self.schema = MESSAGE_HEADER.pack(b'S', len(payload)) + payload
+            for subscriber in self.subscribers:
+                subscriber.pending += self.schema #The schema is never dropped
+        self.wakeup()
+
+    def publish(self, data):
+        #Sends one data row to all subscribers. Only queues the row, the sending is done by the publisher thread
+        if not self.subscribers:
+            return
+        payload = np.asarray(data, dtype = float).astype(DTYPE).tobytes()
+        message = MESSAGE_HEADER.pack(b'D', len(payload)) + payload
+        with self.lock:
+            for subscriber in self.subscribers:
+                if len(subscriber.pending) + len(message) > self.max_backlog:
+                    subscriber.dropped += 1
+                else:
+                    subscriber.pending += message
+        self.wakeup()
+
+    def wakeup(self):
+        try:
+            self.wakeup_sender.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass #The thread is already woken up
+
+    def serve(self):
+        #Publisher thread: accepts new subscribers and sends the queued data
+        while self.running:
+            backlog = any(subscriber.pending for subscriber in self.subscribers)
+            for key, events in self.selector.select(timeout = 0.05 if backlog else 1): #Retry soon if a subscriber did not accept all data
+                if key.fileobj is self.server:
+                    self.accept()
+                elif key.fileobj is self.wakeup_receiver:
+                    try:
+                        while self.wakeup_receiver.recv(4096):
+                            pass
+                    except (BlockingIOError, OSError):
+                        pass
+            self.flush()
+
+    def accept(self):
+        try:
+            connection, address = self.server.accept()
+        except (BlockingIOError, OSError):
+            return
+        connection.setblocking(False)
+        subscriber = Subscriber(connection, address)
+        with self.lock:
+            if self.schema is not None:
+                subscriber.pending += self.schema
+            self.subscribers.append(subscriber)
+        print(f'Subscriber {address} connected')
+
+    def flush(self):
+        #Sends as much of the queued data as the subscribers accept without blocking, disconnected subscribers are removed
+        with self.lock:
+            for subscriber in list(self.subscribers):
+                if not subscriber.pending:
+                    continue
+                try:
+                    sent = subscriber.connection.send(subscriber.pending)
+                    del subscriber.pending[:sent]
+                except BlockingIOError:
+                    pass
+                except OSError:
+                    self.remove(subscriber)
+
+    def remove(self, subscriber):
+        self.subscribers.remove(subscriber)
+        try:
+            subscriber.connection.close()
+        except OSError:
+            pass
+        print(f'Subscriber {subscriber.address} disconnected, {subscriber.dropped} rows dropped')
+
+    def close(self):
+        self.running = False
+        self.wakeup()
+        self.thread.join(2)
+        with self.lock:
+            for subscriber in list(self.subscribers):
+                self.remove(subscriber)
+        self.selector.close()
+        self.server.close()
+        self.wakeup_receiver.close()
+        self.wakeup_sender.close()
+
+def receive_exactly(connection, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('Publisher closed the connection')
+        data += chunk
+    return bytes(data)
+
+def subscribe(host = '127.0.0.1', port = 5555):
+    #Simple subscriber for external programs and for testing: yields (schema, row) for every received row, the row is a numpy array
+    with socket.create_connection((host, port)) as connection:
+        schema = None
+        while True:
+            kind, length = MESSAGE_HEADER.unpack(receive_exactly(connection, MESSAGE_HEADER.size))
+            payload = receive_exactly(connection, length)
+            if kind == b'S':
+                schema = json.loads(payload)
+            elif kind == b'D':
+                yield schema, np.frombuffer(payload, dtype = DTYPE)
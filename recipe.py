@@ -0,0 +1,193 @@
+#This file contains the recipes, which run several measurements (e.g. IV -> CV -> 1 h constant voltage) back to back without an operator
+#A recipe is a json file with a list of steps. Every step has the measurement type and its parameters with the same keys as in the config files (see config_manager.py),
+#parameters that are not given are taken from the current settings of the GUI. Example:
+#{
+#    "name": "Sensor characterization",
+#    "steps": [
+#        {"measurement_type": "IV", "parameters": {"startV": 0, "stopV": -500, "stepV": -5}},
+#        {"measurement_type": "CV", "parameters": {"startV": -500, "stopV": 0, "stepV": 5}, "run_if": {"max_abs_current_below": 1e-6}},
+#        {"measurement_type": "Constant Voltage", "parameters": {"constant_voltage": -200, "duration": 3600}, "filename": "{name}_It", "on_error": "continue"}
+#    ]
+#}
+#Optional keys of a step:
+#   filename: name of the data file, {name} (filename in the GUI), {recipe}, {step} (number of the step) and {type} are replaced. Default: {name}_{step}_{type}
+#   run_if: the step is only run if the previous step fulfills the conditions, otherwise it is skipped. max_abs_current_below: maximum absolute current of SMU 0 [A]
+#   on_error: 'stop' (default) ends the recipe if the step fails, 'continue' runs the next step
+#Constant voltage steps need a duration [s], except for the last step (which runs until it is aborted)
+#If a step starts at the voltage the previous step ended at, the voltage is kept between the steps instead of ramping down to 0 V and up again
+import json
+import os
+import numpy as np
+import sweep_plan
+
+MEASUREMENT_TYPES = ['IV', 'CV', 'Constant Voltage']
+STEP_KEYS = ['measurement_type', 'parameters', 'filename', 'run_if', 'on_error']
+CONDITIONS = ['max_abs_current_below']
+DEFAULT_FILENAME = '{name}_{step}_{type}'
+
+def load_recipe(path, defaults):
+    #Reads and validates a recipe. defaults are the settings of the GUI by measurement type (same format as in the config), they fill the parameters missing in the steps
+    #Returns the recipe with complete parameters, raises ValueError if the recipe is not valid
+    with open(path, 'r') as f:
+        recipe = json.load(f)
+    steps = recipe.get('steps')
+    if not isinstance(steps, list) or not steps:
+        raise ValueError('The recipe contains no steps')
+    recipe.setdefault('name', os.path.splitext(os.path.basename(path))[0])
+    for number, step in enumerate(steps, 1):
+        unknown = set(step) - set(STEP_KEYS)
+        if unknown:
+            raise ValueError(f'Step {number}: unknown keys {sorted(unknown)}')
+        if step.get('measurement_type') not in MEASUREMENT_TYPES:
+            raise ValueError(f'Step {number}: unknown measurement type {step.get("measurement_type")}, use one of {MEASUREMENT_TYPES}')
+        parameters = dict(defaults[step['measurement_type']])
+        if step['measurement_type'] == 'Constant Voltage':
+            parameters.setdefault('duration', 0)
+        unknown = set(step.get('parameters', {})) - set(parameters)
+        if unknown:
+            raise ValueError(f'Step {number}: unknown parameters {sorted(unknown)} for a {step["measurement_type"]} measurement')
+        parameters.update(step.get('parameters', {}))
+        step['parameters'] = parameters
+        if step['measurement_type'] == 'Constant Voltage' and parameters['duration'] <= 0 and number < len(steps):
+            raise ValueError(f'Step {number}: a constant voltage measurement needs a duration, otherwise the following steps are never reached')
+        unknown = set(step.get('run_if', {})) - set(CONDITIONS)
+        if unknown:
+            raise ValueError(f'Step {number}: unknown conditions {sorted(unknown)}, use one of {CONDITIONS}')
+        if step.setdefault('on_error', 'stop') not in ('stop', 'continue'):
+            raise ValueError(f'Step {number}: on_error must be stop or continue')
+        step.setdefault('filename', DEFAULT_FILENAME)
+    return recipe
+
+def start_voltage(measurement_type, parameters):
+    #First voltage of a measurement
+    if measurement_type == 'Constant Voltage':
+        return float(parameters['constant_voltage'])
+    return float(sweep_plan.compile_plan(measurement_type, parameters).voltages[0])
+
+def end_voltage(measurement_type, parameters):
+    #Last voltage of a measurement (the voltage the SMUs are at when it finished)
+    if measurement_type == 'Constant Voltage':
+        return float(parameters['constant_voltage'])
+    return float(sweep_plan.compile_plan(measurement_type, parameters).voltages[-1])
+
+class RecipeRunner:
+    #Runs the steps of a recipe one after the other. It is driven by the functionality: finish_measurement and abort_measurement call step_finished and stop
+    def __init__(self, functionality, recipe):
+        self.functionality = functionality
+        self.recipe = recipe
+        self.steps = recipe['steps']
+        self.index = -1 #Step that is running
+        self.running = False
+        self.bias = 0 #Voltage the SMUs are kept at between two steps
+        self.max_abs_current = 0 #Of the running step, used for the conditions of the next step
+        self.results = [] #(step, result) for the log at the end
+
+    def start(self):
+        self.running = True
+        print(f'Starting recipe {self.recipe["name"]} with {len(self.steps)} steps')
+        self.next_step()
+
+    def filename(self, index):
+        step = self.steps[index]
+        return step['filename'].format(name = self.functionality.ui.filename.text(), recipe = self.recipe['name'], step = index + 1, type = step['measurement_type'].replace(' ', ''))
+
+    def conditions_met(self, step):
+        conditions = step.get('run_if', {})
+        if 'max_abs_current_below' in conditions and not self.max_abs_current < conditions['max_abs_current_below']:
+            return False
+        return True
+
+    def hold_voltage(self, index):
+        #The voltage is kept after the step, if the next step starts at its last voltage
+        if index + 1 >= len(self.steps):
+            return None
+        step, following = self.steps[index], self.steps[index + 1]
+        voltage = end_voltage(step['measurement_type'], step['parameters'])
+        if np.isclose(voltage, 0): #Nothing to ramp, the outputs are switched off between the steps
+            return None
+        return voltage if np.isclose(voltage, start_voltage(following['measurement_type'], following['parameters'])) else None
+
+    def next_step(self):
+        #Starts the next step whose conditions are met. Called at the start and when a step is finished
+        while self.running:
+            self.index += 1
+            if self.index >= len(self.steps):
+                self.finish()
+                return
+            step = self.steps[self.index]
+            if self.index > 0 and not self.conditions_met(step):
+                print(f'Recipe step {self.index + 1} ({step["measurement_type"]}) skipped, conditions {step["run_if"]} not met (max. |I| = {self.max_abs_current:.3e} A)')
+                self.results.append((self.index + 1, 'skipped')) #The conditions of the next step refer to the last step that was run
+                self.release_bias()
+                continue
+            print(f'Recipe step {self.index + 1}/{len(self.steps)}: {step["measurement_type"]}')
+            self.max_abs_current = 0
+            try:
+                hold = self.hold_voltage(self.index)
+            except Exception as e:
+                print(f'Start and end voltages of the steps could not be determined, the voltage is ramped down after every step: {e}')
+                hold = None
+            if not self.functionality.launch_measurement(step['measurement_type'], step['parameters'], self.filename(self.index), bias = self.bias, hold = hold):
+                self.stop(f'Step {self.index + 1} could not be started')
+                return
+            self.functionality.measurement_thread.data_signal.connect(self.observe)
+            self.functionality.measurement_thread.block_signal.connect(lambda rows: [self.observe(row) for row in rows])
+            self.bias = hold if hold is not None else 0
+            return
+
+    def observe(self, data):
+        current = abs(float(data[2]))
+        if not np.isnan(current):
+            self.max_abs_current = max(self.max_abs_current, current)
+
+    def step_finished(self):
+        #Called when a step finished (also after a failed step with on_error continue, when the voltage was ramped down)
+        if not self.running:
+            return
+        if hasattr(self.functionality.measurement_thread, 'wait'):
+            self.functionality.measurement_thread.wait() #The previous step has to release the devices first
+        if not self.results or self.results[-1][0] != self.index + 1:
+            self.results.append((self.index + 1, 'finished'))
+        self.next_step()
+
+    def step_failed(self, reason):
+        #Called when a step stopped with an error. Returns True if the recipe continues with the next step
+        if not self.running:
+            return False
+        self.results.append((self.index + 1, f'failed: {reason}'))
+        if self.steps[self.index]['on_error'] == 'continue':
+            print(f'Recipe step {self.index + 1} failed ({reason}), continuing with the next step')
+            self.bias = 0 #The voltage is ramped down after an error
+            return True
+        self.stop(reason)
+        return False
+
+    def release_bias(self):
+        #Ramps the voltage down in a thread, if it was kept for a step that is not run
+        if self.bias != 0:
+            self.functionality.ramp_down()
+            self.bias = 0
+
+    def stop(self, reason, release = True):
+        #Ends the recipe without running the remaining steps. Without release the voltage is ramped down by the caller (abort of the running step)
+        if not self.running:
+            return
+        self.running = False
+        if 0 <= self.index < len(self.steps) and not any(result[0] == self.index + 1 for result in self.results):
+            self.results.append((self.index + 1, f'stopped: {reason}'))
+        if release:
+            self.release_bias()
+        self.bias = 0
+        self.log()
+        self.functionality.recipe_runner = None
+
+    def finish(self):
+        self.running = False
+        self.release_bias()
+        self.log()
+        self.functionality.recipe_runner = None
+
+    def log(self):
+        print(f'Recipe {self.recipe["name"]}:')
+        for number, result in self.results:
+            print(f'    Step {number} ({self.steps[number - 1]["measurement_type"]}): {result}')
@@ -0,0 +1,67 @@
+#This file measures the startup time of the program: the import time of every module (python -X importtime) and the time until the window is shown
+#The listing of the ports is done in the background after the window is shown, its time is reported separately
+#Usage: python startup_benchmark.py [number of modules to show]
+import subprocess
+import sys
+import os
+import json
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+WINDOW_SCRIPT = '''
+import time, json, sys
+start = time.perf_counter()
+from PyQt5.QtWidgets import QApplication
+app = QApplication(sys.argv)
+qt = time.perf_counter()
+import main
+imported = time.perf_counter()
+window = main.Ui_MainWindow(rm=main.ResourceManager)
+window.show()
+app.processEvents()
+shown = time.perf_counter()
+main.ResourceManager.list_resources()
+listed = time.perf_counter()
+print(json.dumps({'Qt application': qt - start, 'Imports': imported - qt, 'Window shown': shown - imported, 'Port listing (background)': listed - shown}))
+sys.stdout.flush()
+'''
+
+def import_times():
+    #Returns (cumulative, self, depth, module) of every import, parsed from the output of python -X importtime
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'], cwd = DIRECTORY, capture_output = True, text = True)
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_time, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2 #Nested imports are indented by two more spaces per level
+        times.append((int(cumulative)/1e6, int(self_time)/1e6, depth, name.strip()))
+    if result.returncode != 0:
+        print(result.stderr.strip().splitlines()[-1])
+    return times
+
+def window_times():
+    #Runs the program until the window is shown and returns the time of every phase
+    result = subprocess.run([sys.executable, '-c', WINDOW_SCRIPT], cwd = DIRECTORY, capture_output = True, text = True)
+    for line in reversed(result.stdout.splitlines()):
+        if line.startswith('{'):
+            return json.loads(line)
+    print('The window could not be shown:', (result.stderr.strip().splitlines() or [''])[-1])
+    return {}
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 15
+    times = import_times()
+    if times:
+        print(f'Total import time of main: {max(times)[0]:.3f} s')
+        print('\nSlowest modules imported by the program (cumulative, including their imports):')
+        for cumulative, self_time, depth, name in sorted((t for t in times if t[2] <= 1), reverse = True)[:count]:
+            print(f'{cumulative:8.3f} s  {name}')
+        print('\nSlowest single modules (without their imports):')
+        for cumulative, self_time, depth, name in sorted(times, key = lambda t: t[1], reverse = True)[:count]:
+            print(f'{self_time:8.3f} s  {name}')
+    phases = window_times()
+    if phases:
+        print('\nStartup phases:')
+        for phase, duration in phases.items():
+            print(f'{duration:8.3f} s  {phase}')
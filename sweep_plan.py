@@ -0,0 +1,221 @@
+#This file contains the sweep plans of IV and CV measurements. A plan is compiled once before the start from the settings (linear sweep, linear or logarithmic frequencies) or a custom sweep file,
+#it is validated and kept in numpy arrays:
+#   voltages[i]: voltage of step i
+#   repeats[i]: number of measurements at step i (maximum if early stop is enabled, for CV per frequency)
+#   frequencies[offsets[i]:offsets[i+1]]: frequencies measured at step i (CV only), so every voltage can have its own frequencies
+#Custom sweep files are text files with one row per point, separated by spaces:
+#   IV: voltage repeats
+#   CV: voltage repeats frequency, consecutive rows with the same voltage form one step with their frequencies
+#Large custom sweeps are compiled once into .npy files next to the sweep file (<file>.plan), which are memory-mapped instead of loaded into memory
+#The duration of a plan is estimated from the waiting times and the measured duration of the commands (CommandLatencies), this also gives the remaining time during the measurement
+import os
+import json
+import numpy as np
+
+MEMMAP_POINTS = 100000 #Custom sweeps with more points are compiled into memory-mapped files
+RAMP_STEP = 10 #Voltage steps of the ramps [V] and the time per step [s], see MeasurementThread.rampup and abort_measurement
+RAMP_UP_WAIT = 0.1
+RAMP_DOWN_WAIT = 0.2
+ARRAYS = ['voltages', 'repeats', 'frequencies', 'offsets']
+
+class SweepPlan:
+    def __init__(self, voltages, repeats, frequencies = None, offsets = None, path = None):
+        self.voltages = voltages
+        self.repeats = repeats
+        self.frequencies = frequencies #None for IV measurements
+        self.offsets = offsets
+        self.path = path #Directory of the memory-mapped arrays, if the plan is stored in files
+        self.validate()
+
+    def __len__(self):
+        return len(self.voltages)
+
+    def step_frequencies(self, step):
+        return self.frequencies[self.offsets[step]:self.offsets[step + 1]]
+
+    def validate(self):
+        #Raises a ValueError if the plan can not be measured
+        if len(self.voltages) == 0:
+            raise ValueError('The sweep contains no voltages')
+        if len(self.repeats) != len(self.voltages):
+            raise ValueError('The sweep needs a number of measurements for every voltage')
+        if not np.all(np.isfinite(self.voltages)):
+            raise ValueError('The sweep contains invalid voltages')
+        if np.any(self.repeats < 1):
+            raise ValueError('The number of measurements must be at least 1 at every voltage')
+        if self.frequencies is not None:
+            if len(self.offsets) != len(self.voltages) + 1 or self.offsets[0] != 0 or self.offsets[-1] != len(self.frequencies):
+                raise ValueError('The frequencies do not match the voltages of the sweep')
+            if np.any(np.diff(self.offsets) < 1):
+                raise ValueError('Every voltage of a CV sweep needs at least one frequency')
+            if not np.all(np.isfinite(self.frequencies)) or np.any(self.frequencies <= 0):
+                raise ValueError('The frequencies must be positive')
+
+    def points(self):
+        #Number of points per step (frequencies for CV, 1 for IV)
+        if self.frequencies is None:
+            return np.ones(len(self.voltages), dtype = np.int64)
+        return np.diff(self.offsets)
+
+    def save(self, path):
+        #Stores the arrays as .npy files in the directory path, so they can be memory-mapped
+        os.makedirs(path, exist_ok = True)
+        for name in ARRAYS:
+            array = getattr(self, name)
+            if array is not None:
+                np.save(os.path.join(path, name + '.npy'), np.asarray(array))
+            elif os.path.exists(os.path.join(path, name + '.npy')):
+                os.remove(os.path.join(path, name + '.npy'))
+        self.path = path
+
+    def to_journal(self):
+        #Representation for the checkpoint journal, plans stored in files are only referenced
+        if self.path is not None:
+            return {'path': self.path}
+        return {
+            'voltages': [float(v) for v in self.voltages],
+            'number_of_measurements': [int(n) for n in self.repeats],
+            'frequencies': [float(f) for f in self.frequencies] if self.frequencies is not None else None,
+            'offsets': [int(o) for o in self.offsets] if self.offsets is not None else None,
+        }
+
+def load_plan(path):
+    #Opens a plan stored with SweepPlan.save, the arrays are memory-mapped
+    arrays = {}
+    for name in ARRAYS:
+        file = os.path.join(path, name + '.npy')
+        arrays[name] = np.load(file, mmap_mode = 'r') if os.path.exists(file) else None
+    return SweepPlan(arrays['voltages'], arrays['repeats'], arrays['frequencies'], arrays['offsets'], path = path)
+
+def plan_from_journal(journal):
+    #Restores the plan of an interrupted measurement. Journals written before the frequencies per voltage measured the same frequencies at all voltages
+    #The plan is memory-mapped (path), in its own file next to the journal (file) or, in older journals, in the journal itself
+    if 'path' in journal:
+        return load_plan(journal['path'])
+    if 'file' in journal:
+        with open(journal['file'], 'r') as f:
+            journal = json.load(f)
+    voltages = np.array(journal['voltages'], dtype = float)
+    repeats = np.array(journal['number_of_measurements'], dtype = np.int64)
+    frequencies = journal.get('frequencies')
+    if frequencies is None:
+        return SweepPlan(voltages, repeats)
+    frequencies = np.array(frequencies, dtype = float)
+    offsets = journal.get('offsets')
+    if offsets is None:
+        offsets = np.arange(len(voltages) + 1)*len(frequencies)
+        frequencies = np.tile(frequencies, len(voltages))
+    return SweepPlan(voltages, repeats, frequencies, np.array(offsets, dtype = np.int64))
+
+def linear_voltages(start, stop, step):
+    #Voltages from start to stop (included) with the given step
+    if start == stop:
+        raise ValueError('Start and stop voltage are the same, no sweep possible')
+    if step == 0:
+        raise ValueError('Steps must not be zero')
+    if start > stop and step > 0:
+        raise ValueError('Steps must be negative if start is greater than stop')
+    if start < stop and step < 0:
+        raise ValueError('Steps must be positive if start is less than stop')
+    if abs(stop - start) < abs(step):
+        raise ValueError('Steps are too big for the given range')
+    return np.arange(start, stop + step, step)
+
+def frequency_list(start, stop, number, logarithmic):
+    if number < 1:
+        raise ValueError('At least one frequency is needed')
+    if logarithmic:
+        return np.logspace(np.log10(start), np.log10(stop), number, endpoint = True)
+    return np.linspace(start, stop, number, endpoint = True)
+
+def read_custom_sweep(file, cv):
+    #Compiles a custom sweep file into a plan. Large sweeps are stored as memory-mapped files next to the sweep file and reused as long as the sweep file is not changed
+    cache = os.path.abspath(file) + '.plan'
+    if os.path.exists(os.path.join(cache, 'voltages.npy')) and os.path.getmtime(os.path.join(cache, 'voltages.npy')) >= os.path.getmtime(file):
+        plan = load_plan(cache)
+        if (plan.frequencies is not None) == cv:
+            return plan
+    columns = 3 if cv else 2
+    data = np.loadtxt(file, delimiter = ' ', usecols = range(columns), ndmin = 2)
+    if cv:
+        voltages = data[:, 0]
+        starts = np.concatenate([[0], np.flatnonzero(np.diff(voltages) != 0) + 1]) if len(voltages) else np.array([], dtype = np.int64) #First row of every step
+        if np.any(data[:, 1] != np.repeat(data[starts, 1], np.diff(np.append(starts, len(data))))):
+            raise ValueError(f'{file}: the number of measurements must be the same for all frequencies of a voltage')
+        plan = SweepPlan(voltages[starts], data[starts, 1].astype(np.int64), data[:, 2].copy(), np.append(starts, len(data)).astype(np.int64))
+    else:
+        plan = SweepPlan(data[:, 0].copy(), data[:, 1].astype(np.int64))
+    if len(data) > MEMMAP_POINTS:
+        plan.save(cache)
+        plan = load_plan(cache)
+    return plan
+
+def compile_plan(measurement_type, parameters):
+    #Creates the validated plan of an IV or CV measurement from its parameters
+    cv = measurement_type == 'CV'
+    if parameters['custom_sweep']:
+        return read_custom_sweep(parameters['custom_sweep_file'], cv)
+    voltages = linear_voltages(parameters['startV'], parameters['stopV'], parameters['stepV'])
+    if parameters['measurements_per_step'] <= 0:
+        raise ValueError('Number of measurements must be greater than 0')
+    repeats = np.full(len(voltages), int(parameters['measurements_per_step']), dtype = np.int64)
+    if not cv:
+        return SweepPlan(voltages, repeats)
+    frequencies = frequency_list(parameters['startFrequency'], parameters['stopFrequency'], parameters['number_of_frequencies'], parameters['logarithmic_frequency_steps'])
+    return SweepPlan(voltages, repeats, np.tile(frequencies, len(voltages)), np.arange(len(voltages) + 1)*len(frequencies))
+
+class CommandLatencies:
+    #Mean duration of the commands of a measurement [s]: reading all devices once (read_row), setting the voltage of all SMUs (set_voltage) and the frequency (set_frequency)
+    #Measured during every measurement, before the first measurement they are estimated from the *IDN? queries of the communication test
+    def __init__(self, read_row = 0.05, set_voltage = 0.01, set_frequency = 0.05):
+        self.read_row = read_row
+        self.set_voltage = set_voltage
+        self.set_frequency = set_frequency
+
+    def update(self, latencies):
+        for name, value in latencies.items():
+            if value is not None and np.isfinite(value):
+                setattr(self, name, value)
+
+    def as_dict(self):
+        return {'read_row': self.read_row, 'set_voltage': self.set_voltage, 'set_frequency': self.set_frequency}
+
+class DurationModel:
+    #Expected duration of a plan. The number of samples, frequency changes and voltage steps after every step are summed up once, so the remaining time is known at every point without going through the plan again
+    def __init__(self, plan, parameters, early_stop = False):
+        self.plan = plan
+        self.time_between_steps = parameters['time_between_steps']
+        self.time_between_measurements = parameters['time_between_measurements']
+        points = plan.points()
+        if plan.frequencies is None:
+            self.samples_per_point = np.asarray(plan.repeats, dtype = float)
+        else:
+            self.samples_per_point = np.asarray(plan.repeats, dtype = float) if early_stop else np.ones(len(plan)) #Without early stop every frequency is measured once
+        samples = points*self.samples_per_point
+        self.samples_after = np.concatenate([np.cumsum(samples[::-1])[::-1], [0]]) #Samples of step i and all following steps
+        self.points_after = np.concatenate([np.cumsum(points[::-1])[::-1], [0]])
+        self.points = points
+
+    def remaining(self, latencies, step = 0, point = 0):
+        #Expected time [s] from the start of the given point (step, index of the frequency) until the end of the measurement, including the ramp down
+        #With early stop the maximum number of measurements is assumed
+        if step >= len(self.plan):
+            return self.ramp_time(self.plan.voltages[-1], 0, RAMP_DOWN_WAIT)
+        sample_time = max(self.time_between_measurements, latencies.read_row) #The scheduler waits at least the time between measurements, a slower readout delays the next sample
+        steps = len(self.plan) - step
+        samples = self.samples_after[step] - point*self.samples_per_point[step]
+        frequency_changes = (self.points_after[step] - point) if self.plan.frequencies is not None else 0
+        duration = steps*(latencies.set_voltage + self.time_between_steps) + samples*sample_time + frequency_changes*latencies.set_frequency
+        return duration + self.ramp_time(self.plan.voltages[-1], 0, RAMP_DOWN_WAIT)
+
+    def total(self, latencies, bias = 0, step = 0, point = 0):
+        #Expected duration of the measurement started at the given point (resumed measurements) with the SMUs at the bias voltage, including the ramps
+        ramp_up = self.ramp_time(bias, self.plan.voltages[step], RAMP_UP_WAIT + latencies.set_voltage) if step < len(self.plan) else 0
+        return ramp_up + self.remaining(latencies, step, point)
+
+    def ramp_time(self, start, stop, wait):
+        return np.ceil(abs(float(stop) - float(start))/RAMP_STEP)*wait
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    return f'{seconds//3600}:{seconds%3600//60:02d}:{seconds%60:02d}'
@@ -0,0 +1,82 @@
+import datetime
+import gzip
+import json
+import os
+import pytest
+import catalog
+
+HEADER = 'Target[V] Voltage_SMU_0[V] Current_SMU_0[A] DMM_0 Time[s] Failed_Reads\n'
+
+
+def write_run(folder, root, max_voltage, temperature, compressed = False, devices = None):
+    os.makedirs(folder, exist_ok = True)
+    rows = ''.join(f'{v} {v} {1e-9*abs(v)} {temperature} {i} 0\n' for i, v in enumerate(range(0, -max_voltage - 1, -50)))
+    path = os.path.join(folder, root + ('.csv.gz' if compressed else '.csv'))
+    if compressed:
+        with open(path, 'wb') as f:
+            f.write(gzip.compress((HEADER + rows).encode()))
+    else:
+        with open(path, 'w') as f:
+            f.write(HEADER + rows)
+    settings = {'measurement_type': 'IV', 'parameters': {'stopV': -max_voltage}, 'device_settings': {'K2400 #1234': {}}}
+    if devices is not None:
+        settings['devices'] = devices
+    with open(os.path.join(folder, root + '_MeasurementSettings.json'), 'w') as f:
+        json.dump(settings, f)
+    return path
+
+
+@pytest.fixture
+def runs(tmp_path):
+    write_run(str(tmp_path / 'a'), 'sensorX_2024-01-01_10-00-00', 600, -20.5, devices = ['K2400 #1234', 'LCR #77'])
+    write_run(str(tmp_path / 'a'), 'sensorX_2024-01-01_11-00-00', 300, -20, compressed = True)
+    write_run(str(tmp_path / 'b'), 'sensorY_2024-01-02_10-00-00', 800, 20)
+    database = catalog.Catalog(str(tmp_path / 'catalog.sqlite'))
+    yield tmp_path, database
+    database.close()
+
+
+def test_scan_is_incremental_and_removes_deleted_files(runs):
+    folder, database = runs
+    assert database.scan(str(folder)) == (3, 0, 0, 0)
+    assert database.scan(str(folder)) == (0, 3, 0, 0)
+    os.remove(folder / 'b' / 'sensorY_2024-01-02_10-00-00.csv')
+    assert database.scan(str(folder)) == (0, 2, 1, 0)
+
+
+def test_query_filters(runs):
+    folder, database = runs
+    database.scan(str(folder))
+    assert [run['name'] for run in database.query()] == ['sensorY_2024-01-02_10-00-00.csv', 'sensorX_2024-01-01_11-00-00.csv.gz', 'sensorX_2024-01-01_10-00-00.csv']
+    assert [run['name'] for run in database.query(name = 'sensorX', min_voltage = 500)] == ['sensorX_2024-01-01_10-00-00.csv']
+    assert [run['name'] for run in database.query(where = ['DMM_0.mean<=-20.2'])] == ['sensorX_2024-01-01_10-00-00.csv']
+    assert [run['name'] for run in database.query(where = ['param.stopV<-500'], after = datetime.datetime(2024, 1, 2))] == ['sensorY_2024-01-02_10-00-00.csv']
+    assert [run['name'] for run in database.query(device = 'LCR')] == ['sensorX_2024-01-01_10-00-00.csv']
+    assert database.query(name = 'sensorX_2024-01-01_10')[0]['devices'] == ['K2400 #1234', 'LCR #77']
+
+
+def test_start_time_is_taken_from_the_file_name(runs):
+    folder, database = runs
+    database.scan(str(folder))
+    started = database.query(name = 'sensorY')[0]['started']
+    assert started == datetime.datetime(2024, 1, 2, 10).timestamp()
+
+
+def test_column_statistics(runs):
+    folder, database = runs
+    path = str(folder / 'a' / 'sensorX_2024-01-01_11-00-00.csv.gz')
+    database.add_run(path)
+    statistics = database.statistics(path)
+    assert list(statistics) == HEADER.split()
+    assert statistics['Target[V]'] == [7, -300, 0, -150]
+
+
+@pytest.mark.parametrize('condition', ['DMM_0.median<1', 'stopV', 'param.stopV'])
+def test_invalid_conditions(condition):
+    with pytest.raises(ValueError):
+        catalog.parse_condition(condition)
+
+
+def test_parse_condition():
+    assert catalog.parse_condition('Current_SMU_0[A].max < 1e-6') == ('column', ('Current_SMU_0[A]', 'max'), '<', 1e-6)
+    assert catalog.parse_condition('param.measurement="IV"') == ('param', 'measurement', '=', 'IV')
@@ -0,0 +1,127 @@
+import gzip
+import json
+import numpy as np
+import data_handler
+import sweep_plan
+
+
+class Setting:
+    #Stands in for the combo and spin boxes of the save settings
+    def __init__(self, value):
+        self.value_ = value
+
+    def currentText(self):
+        return self.value_
+
+    def value(self):
+        return self.value_
+
+
+class DeviceHandler:
+    def __init__(self):
+        self.smu_devices = [object()]
+        self.voltmeter_devices = []
+        self.lowV_devices = []
+        self.capacitancemeter_devices = []
+
+
+class UI:
+    def __init__(self, compression = 'None', digits = 0):
+        self.filename_suffix = Setting('.csv')
+        self.compression_comboBox = Setting(compression)
+        self.digits_spinBox = Setting(digits)
+        self.device_handler = DeviceHandler()
+
+
+def read_data_row(voltage):
+    #Same layout as MeasurementThread.read_data with one SMU: the target voltage is a string
+    return [str(voltage), float(voltage), 1.23456789e-9, 12.3456789, 12.3, 12.4, 0]
+
+
+def test_format_row_converts_strings():
+    assert data_handler.format_row(['5.0', 1.0], ['.6g', '.6g']) == '5 1'
+    assert data_handler.format_row(['None', 1.0], ['.6g', '.6g']) == 'None 1'
+
+
+def test_format_row_full_precision():
+    assert data_handler.format_row(['5.0', 0.1 + 0.2], None) == '5.0 0.30000000000000004'
+
+
+def test_write_data_with_limited_digits(tmp_path):
+    saver = data_handler.DataSaver(str(tmp_path), 'run', False, UI(digits = 4), None)
+    saver.write_data(read_data_row(-5.0))
+    saver.close()
+    lines = data_handler.read_data_lines(saver.filepath)
+    assert lines[0].split() == saver.header
+    assert lines[1].split() == ['-5', '-5', '1.235e-09', '12.345679', '12.300000', '12.400000', '0']
+    assert saver.rows == 1
+
+
+def test_resume_removes_rows_after_checkpoint(tmp_path):
+    saver = data_handler.DataSaver(str(tmp_path), 'run', False, UI(compression = 'gzip'), None)
+    saver.start_journal('IV', {}, {})
+    saver.write_data(read_data_row(-5.0))
+    saver.write_burst(('DMM', [0.1], [1.0]))
+    saver.write_data(read_data_row(-5.0))
+    saver.write_checkpoint({'next': [1, 0], 'completed': False})
+    saver.write_burst(('DMM', [0.2], [2.0])) #Interrupted point
+    saver.write_data(read_data_row(-10.0))
+    saver.close()
+    resumed = data_handler.DataSaver(None, None, False, UI(), None, resume_journal = saver.journal)
+    assert resumed.rows == 2
+    resumed.write_data(read_data_row(-10.0))
+    resumed.close()
+    lines = data_handler.read_data_lines(saver.filepath)
+    assert [line.split()[0] for line in lines[1:]] == ['-5.0', '-5.0', '-10.0']
+    bursts = data_handler.read_data_lines(str(tmp_path / 'run_burst.csv.gz'))
+    assert [line.split()[0] for line in bursts[1:]] == ['1']
+
+
+def test_read_data_lines_stops_at_a_cut_off_frame(tmp_path):
+    path = str(tmp_path / 'run.csv.gz')
+    complete = gzip.compress(b'Target[V] Current_SMU_0[A]\n0 1e-9\n') #One frame per flush
+    cut = gzip.compress(b'-10 2e-9\n-20 3e-9\n')
+    with open(path, 'wb') as f:
+        f.write(complete + cut[:15])
+    assert data_handler.read_data_lines(path) == ['Target[V] Current_SMU_0[A]\n', '0 1e-9\n']
+
+
+def test_data_file_names():
+    assert data_handler.split_data_path('run.csv.gz') == ('run', '.csv.gz')
+    assert data_handler.split_data_path('run.csv') == ('run', '.csv')
+    assert data_handler.is_data_file('run.csv.zst')
+    assert not data_handler.is_data_file('run_burst.csv')
+    assert not data_handler.is_data_file('run_MeasurementSettings.json')
+
+
+def test_resume_after_crash_between_checkpoints(tmp_path):
+    saver = data_handler.DataSaver(str(tmp_path), 'run', False, UI(compression = 'gzip'), None)
+    saver.start_journal('IV', {}, {})
+    saver.write_data(read_data_row(-5.0))
+    saver.write_burst(('DMM', [0.1], [1.0]))
+    saver.write_checkpoint({'next': [1, 0], 'completed': False})
+    saver.write_data(read_data_row(-10.0))
+    saver.file.raw.close() #Crash: the rows collected for the next frame are lost
+    saver.burst_file.raw.close()
+    resumed = data_handler.DataSaver(None, None, False, UI(), None, resume_journal = saver.journal)
+    assert resumed.rows == saver.journal['rows'] == 1
+    resumed.write_data(read_data_row(-10.0))
+    resumed.close()
+    lines = data_handler.read_data_lines(saver.filepath)
+    assert [line.split()[0] for line in lines[1:]] == ['-5.0', '-10.0']
+    bursts = data_handler.read_data_lines(str(tmp_path / 'run_burst.csv.gz'))
+    assert [line.split()[0] for line in bursts[1:]] == ['1']
+
+
+def test_the_plan_is_written_once_next_to_the_journal(tmp_path):
+    saver = data_handler.DataSaver(str(tmp_path), 'run', False, UI(), None)
+    saver.start_journal('IV', {}, {})
+    plan = sweep_plan.SweepPlan(np.linspace(0, -100, 1001), np.ones(1001, dtype = np.int64))
+    saver.write_checkpoint({'plan': plan.to_journal()})
+    saver.write_checkpoint({'next': [1, 0], 'completed': False})
+    saver.close()
+    with open(saver.journal_path()) as f:
+        journal = json.load(f)
+    assert journal['plan'] == {'file': str(tmp_path / 'run_plan.json')}
+    resumed = sweep_plan.plan_from_journal(journal['plan'])
+    assert np.array_equal(resumed.voltages, plan.voltages)
@@ -0,0 +1,33 @@
+import pytest
+import devices
+
+
+class FakeSCPI:
+    #Records the writes and answers the error queries from a list of queued errors
+    def __init__(self, errors = ()):
+        self.written = []
+        self.errors = list(errors)
+
+    def write(self, message):
+        self.written.append(message)
+
+    def query(self, message):
+        error = self.errors.pop(0) if self.errors else '0,"No error"'
+        return '1;' + error if message.startswith('*OPC?') else error
+
+
+def test_scpi_batch_clears_errors_first():
+    device = FakeSCPI()
+    devices.send_scpi_batch(device, ['SOUR:VOLT 5', '*RST'], 'K2400')
+    assert device.written == ['*CLS;:SOUR:VOLT 5;*RST']
+
+
+def test_scpi_batch_reports_all_errors():
+    device = FakeSCPI(['-113,"Undefined header"', '-222,"Data out of range"'])
+    with pytest.raises(RuntimeError, match = 'Undefined header"; -222'):
+        devices.send_scpi_batch(device, ['SOUR:VOLT 5'], 'K2400')
+    assert device.errors == []
+
+
+def test_parse_readings_removes_units():
+    assert list(devices.parse_readings('+1.5E-09A,2.0SECS, 3VDC')) == [1.5e-9, 2.0, 3.0]
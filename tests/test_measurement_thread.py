@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+import measurement_thread
+
+RANGES = [1e-8, 1e-7, 1e-6, 1e-5]
+
+
+def test_range_predictor_extrapolates_exponentially():
+    predictor = measurement_thread.RangePredictor(RANGES)
+    assert predictor.select(-10) is None #Nothing measured yet: autorange
+    predictor.add(-10, [1e-9])
+    predictor.add(-20, [-1e-8, 5e-9]) #The largest absolute current counts
+    assert predictor.predict(-30) == pytest.approx(1e-7)
+    assert predictor.select(-30) == 1e-6 #Headroom of 2
+    assert predictor.predict(-20) == pytest.approx(1e-8) #Constant voltage
+
+
+def test_range_predictor_limits_the_change_and_ignores_overflows():
+    predictor = measurement_thread.RangePredictor(RANGES, max_change = 10)
+    predictor.add(0, [1e-9])
+    predictor.add(-1, [1e-8])
+    predictor.add(-2, [predictor.OVERFLOW])
+    assert predictor.predict(-100) == pytest.approx(1e-7)
+    assert predictor.readings == 3
+    predictor.add(-3, [1e-4])
+    assert predictor.select(-3) is None #Above all ranges
+
+
+def test_range_predictor_fits():
+    predictor = measurement_thread.RangePredictor(RANGES)
+    assert predictor.fits([5e-7], 1e-6)
+    assert not predictor.fits([2e-6], 1e-6)
+    assert not predictor.fits([predictor.OVERFLOW], 1e-6)
+    assert not predictor.fits([np.nan], 1e-6)
+    assert not predictor.fits([1e-10], 1e-6) #Poor resolution, a smaller range exists
+    assert predictor.fits([1e-12], 1e-8)
+
+
+def noisy_read(noise, current = 1e-6, seed = 0):
+    #Readings with white noise of the given standard deviation at 1 NPLC
+    generator = np.random.default_rng(seed)
+    return lambda nplc: current + generator.normal(0, noise/np.sqrt(nplc), 200)
+
+
+def test_nplc_controller_learns_the_noise():
+    controller = measurement_thread.NplcController(1e-3, (0.01, 10))
+    controller.learn(noisy_read(np.sqrt(0.3)*1e-9))
+    assert controller.white == pytest.approx(3e-19, rel = 0.3)
+    assert controller.select() == 0.5 #white/(1e-3*1e-6)**2 = 0.3, rounded up on the ladder
+    assert controller.select(1e-4) == 0.01 #Lower limit
+    assert controller.select(1e-8) == 10 #Upper limit
+
+
+def test_nplc_controller_follows_the_scatter_of_the_steps():
+    controller = measurement_thread.NplcController(1e-2, (0.001, 25), smoothing = 1)
+    controller.white = 1e-18
+    nplc = controller.select(1e-6)
+    assert nplc == 0.01
+    for current in 1e-6 + np.array([-1, 1, -1, 1])*1e-8:
+        controller.add([current])
+    controller.select(1e-6)
+    assert controller.white == pytest.approx(np.var([-1, 1, -1, 1], ddof = 1)*1e-16*nplc)
+
+
+def test_nplc_controller_without_current_uses_the_longest_integration():
+    controller = measurement_thread.NplcController(1e-3, (0.1, 5))
+    controller.white = 1e-18
+    assert controller.select() == 5
+
+
+class FakeSMU:
+    def __init__(self):
+        self.settings = {'nplc': 1}
+        self.nplc = None
+
+    def set_nplc(self, nplc):
+        self.nplc = nplc
+
+    def measure_voltage(self):
+        return 0.0
+
+    def set_voltage(self, voltage):
+        pass
+
+    def enable_output(self, enable):
+        pass
+
+    def return_assigned_id(self):
+        return 'K2400 #1'
+
+
+class DeviceHandler:
+    def __init__(self, smu):
+        self.smu_devices = [smu]
+
+
+def test_the_nplc_of_the_settings_is_restored_at_the_end():
+    smu = FakeSMU()
+    thread = measurement_thread.MeasurementThread(None, DeviceHandler(smu))
+    thread.nplc_controllers = {smu: measurement_thread.NplcController(1e-3, (0.01, 10))}
+    smu.set_nplc(0.02) #Set by the adaptive NPLC for the last step
+    thread.abort_measurement()
+    assert smu.nplc == 1
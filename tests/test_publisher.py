@@ -0,0 +1,58 @@
+import threading
+import time
+import numpy as np
+import publisher
+
+
+def wait_for(condition, timeout = 5):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, 'timed out'
+        time.sleep(0.01)
+
+
+def test_subscriber_receives_schema_and_rows():
+    server = publisher.DataPublisher(port = 0)
+    try:
+        server.set_schema(['Target[V]', 'Current_SMU_0[A]'], 'run.csv')
+        received = []
+        def receive():
+            for schema, row in publisher.subscribe(port = server.port):
+                received.append((schema, row))
+                if len(received) == 2:
+                    return
+        thread = threading.Thread(target = receive, daemon = True)
+        thread.start()
+        wait_for(lambda: server.subscribers)
+        server.publish(['-5.0', 1e-9]) #The target voltage of read_data is a string
+        server.publish([-10.0, np.nan])
+        thread.join(5)
+        assert len(received) == 2
+        schema, row = received[0]
+        assert schema == {'columns': ['Target[V]', 'Current_SMU_0[A]'], 'dtype': publisher.DTYPE, 'file': 'run.csv'}
+        assert list(row) == [-5.0, 1e-9]
+        assert received[1][1][0] == -10.0 and np.isnan(received[1][1][1])
+    finally:
+        server.close()
+
+
+def test_rows_beyond_the_backlog_are_dropped():
+    server = publisher.DataPublisher(port = 0, max_backlog = 10)
+    try:
+        client = publisher.socket.create_connection(('127.0.0.1', server.port))
+        wait_for(lambda: server.subscribers)
+        for _ in range(3):
+            server.publish([1.0, 2.0])
+        assert server.subscribers[0].dropped == 3
+        client.close()
+    finally:
+        server.close()
+
+
+def test_publish_without_subscribers_does_nothing():
+    server = publisher.DataPublisher(port = 0)
+    try:
+        server.publish([1.0])
+        assert server.subscribers == []
+    finally:
+        server.close()
@@ -0,0 +1,46 @@
+import json
+import pytest
+import recipe
+
+DEFAULTS = {'IV': {'startV': 0, 'stopV': -100, 'stepV': -10, 'measurements_per_step': 1, 'custom_sweep': False},
+            'CV': {'startV': -100, 'stopV': 0, 'stepV': 10, 'measurements_per_step': 1, 'custom_sweep': False,
+                   'startFrequency': 1e3, 'stopFrequency': 1e4, 'number_of_frequencies': 2, 'logarithmic_frequency_steps': True},
+            'Constant Voltage': {'constant_voltage': -100}}
+
+
+def write_recipe(tmp_path, steps, **keys):
+    path = tmp_path / 'characterization.json'
+    path.write_text(json.dumps(dict(keys, steps = steps)))
+    return str(path)
+
+
+def test_missing_parameters_are_taken_from_the_defaults(tmp_path):
+    path = write_recipe(tmp_path, [{'measurement_type': 'IV', 'parameters': {'stopV': -50}}, {'measurement_type': 'Constant Voltage'}])
+    loaded = recipe.load_recipe(path, DEFAULTS)
+    assert loaded['name'] == 'characterization'
+    iv, constant = loaded['steps']
+    assert iv['parameters'] == {'startV': 0, 'stopV': -50, 'stepV': -10, 'measurements_per_step': 1, 'custom_sweep': False}
+    assert iv['filename'] == recipe.DEFAULT_FILENAME and iv['on_error'] == 'stop'
+    assert constant['parameters'] == {'constant_voltage': -100, 'duration': 0} #The last step may run until it is aborted
+    assert DEFAULTS['IV']['stopV'] == -100
+
+
+@pytest.mark.parametrize('steps', [
+    [],
+    [{'measurement_type': 'IT'}],
+    [{'measurement_type': 'IV', 'repeat': 2}],
+    [{'measurement_type': 'IV', 'parameters': {'constant_voltage': -10}}],
+    [{'measurement_type': 'Constant Voltage'}, {'measurement_type': 'IV'}],
+    [{'measurement_type': 'IV', 'run_if': {'max_current': 1e-6}}],
+    [{'measurement_type': 'IV', 'on_error': 'retry'}],
+])
+def test_invalid_recipes_are_rejected(tmp_path, steps):
+    with pytest.raises(ValueError):
+        recipe.load_recipe(write_recipe(tmp_path, steps), DEFAULTS)
+
+
+def test_start_and_end_voltages():
+    assert recipe.start_voltage('IV', DEFAULTS['IV']) == 0
+    assert recipe.end_voltage('IV', DEFAULTS['IV']) == -100
+    assert recipe.start_voltage('CV', DEFAULTS['CV']) == -100
+    assert recipe.end_voltage('Constant Voltage', DEFAULTS['Constant Voltage']) == -100
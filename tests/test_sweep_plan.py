@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+import sweep_plan
+
+IV = {'custom_sweep': False, 'startV': 0, 'stopV': -20, 'stepV': -10, 'measurements_per_step': 2, 'time_between_steps': 1, 'time_between_measurements': 0.1}
+CV = dict(IV, startFrequency = 1e3, stopFrequency = 1e5, number_of_frequencies = 3, logarithmic_frequency_steps = True)
+
+
+def test_linear_voltages_include_the_stop_voltage():
+    assert list(sweep_plan.linear_voltages(0, -20, -10)) == [0, -10, -20]
+
+
+@pytest.mark.parametrize('start, stop, step', [(0, 0, 1), (0, 10, 0), (0, 10, -1), (10, 0, 1), (0, 5, 10)])
+def test_linear_voltages_reject_invalid_sweeps(start, stop, step):
+    with pytest.raises(ValueError):
+        sweep_plan.linear_voltages(start, stop, step)
+
+
+def test_compile_iv_plan():
+    plan = sweep_plan.compile_plan('IV', IV)
+    assert list(plan.voltages) == [0, -10, -20]
+    assert list(plan.repeats) == [2, 2, 2]
+    assert plan.frequencies is None
+    assert list(plan.points()) == [1, 1, 1]
+
+
+def test_compile_cv_plan_measures_all_frequencies_at_every_voltage():
+    plan = sweep_plan.compile_plan('CV', CV)
+    assert list(plan.offsets) == [0, 3, 6, 9]
+    assert np.allclose(plan.step_frequencies(1), [1e3, 1e4, 1e5])
+
+
+def test_custom_cv_sweep_groups_rows_by_voltage(tmp_path):
+    file = tmp_path / 'sweep.txt'
+    file.write_text('0 1 1000\n0 1 2000\n-10 3 1000\n')
+    plan = sweep_plan.read_custom_sweep(str(file), cv = True)
+    assert list(plan.voltages) == [0, -10]
+    assert list(plan.repeats) == [1, 3]
+    assert list(plan.step_frequencies(0)) == [1000, 2000]
+    assert list(plan.step_frequencies(1)) == [1000]
+
+
+def test_custom_cv_sweep_needs_the_same_repeats_per_voltage(tmp_path):
+    file = tmp_path / 'sweep.txt'
+    file.write_text('0 1 1000\n0 2 2000\n')
+    with pytest.raises(ValueError):
+        sweep_plan.read_custom_sweep(str(file), cv = True)
+
+
+def test_plan_validation():
+    with pytest.raises(ValueError):
+        sweep_plan.SweepPlan(np.array([0.0, np.nan]), np.array([1, 1]))
+    with pytest.raises(ValueError):
+        sweep_plan.SweepPlan(np.array([0.0]), np.array([0]))
+
+
+def test_saved_plan_is_memory_mapped(tmp_path):
+    plan = sweep_plan.compile_plan('CV', CV)
+    plan.save(str(tmp_path / 'plan'))
+    loaded = sweep_plan.plan_from_journal(plan.to_journal())
+    assert isinstance(loaded.voltages, np.memmap)
+    assert np.array_equal(loaded.frequencies, plan.frequencies)
+
+
+def test_journal_without_offsets_repeats_the_frequencies():
+    journal = {'voltages': [0, -10], 'number_of_measurements': [1, 1], 'frequencies': [1e3, 1e4]}
+    plan = sweep_plan.plan_from_journal(journal)
+    assert list(plan.offsets) == [0, 2, 4]
+    assert list(plan.step_frequencies(1)) == [1e3, 1e4]
+
+
+def test_duration_model():
+    plan = sweep_plan.compile_plan('IV', IV)
+    model = sweep_plan.DurationModel(plan, IV)
+    latencies = sweep_plan.CommandLatencies(read_row = 0.05, set_voltage = 0.01)
+    ramp_down = 2*sweep_plan.RAMP_DOWN_WAIT #From -20 V in steps of 10 V
+    assert model.remaining(latencies) == pytest.approx(3*(0.01 + 1) + 6*0.1 + ramp_down)
+    assert model.remaining(latencies, step = 3) == pytest.approx(ramp_down)
+    assert model.total(latencies, bias = 0) == pytest.approx(model.remaining(latencies)) #The sweep starts at 0 V
+
+
+def test_format_duration():
+    assert sweep_plan.format_duration(3725.4) == '1:02:05'
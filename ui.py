@@ -2,9 +2,10 @@ from PyQt5 import QtCore, QtGui
 from PyQt5.QtWidgets import QApplication, QWidget, QDialog, QGridLayout, QFormLayout, QPushButton, QLabel, QMessageBox, QLineEdit, QComboBox, QScrollArea, QFrame, QVBoxLayout, QGroupBox, QSpinBox, QDoubleSpinBox, QCheckBox, QRadioButton, QSizePolicy
 from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
 from PyQt5.QtCore import QThread, pyqtSignal
-import pyvisa as visa
 import devices
 import plotting
+import history
+import data_handler
 from logic import Functionality, Device_Handler
 from config_manager import config_manager
 import os 
@@ -26,6 +27,8 @@ class Ui_MainWindow(QWidget):
         'time_between_steps': 0,
         'time_between_measurements': 0,
         'measurements_per_step': 0,
+        'target_rse': 0,
+        'min_measurements_per_step': 2,
         'limitI': 0,
         'custom_sweep': False,
         'custom_sweep_file': '',
@@ -46,12 +49,15 @@ class Ui_MainWindow(QWidget):
             'time_between_steps': 0,
             'time_between_measurements': 0,
             'measurements_per_step': 0,
+            'target_rse': 0,
+            'min_measurements_per_step': 2,
             'limitI': 0,
             'custom_sweep': False,
             'custom_sweep_file': '',
         }
         self.logic = Functionality(self)
         self.canvas = plotting.PlotCanvas(self) # Initialize the plot canvas
+        self.history_browser = history.HistoryBrowser(self) # Overlays previous measurements on the plot
         self.measurement_type = 'IV'  # Default measurement type
         self.data_path = data_path # Default data path
         self.setup_ui()
@@ -170,6 +176,41 @@ class Ui_MainWindow(QWidget):
         self.filename_suffix.setCurrentIndex(0)
         self.savefile_settings_layout.addWidget(self.filename_suffix, 1, 2)
 
+        self.resume_button = QPushButton('Resume Measurement') #Continues an interrupted IV/CV measurement from its checkpoint journal
+        self.resume_button.setToolTip('Select the _checkpoint.json file of an interrupted measurement to continue it at the next unmeasured point')
+        self.resume_button.clicked.connect(self.logic.resume_measurement)
+        self.savefile_settings_layout.addWidget(self.resume_button, 2, 0, 1, 3)
+
+        self.separate_process_checkBox = QCheckBox('Acquisition in separate process') #Runs the measurement loop in its own process
+        self.separate_process_checkBox.setToolTip('If checked, the devices are read in a separate process, so a busy GUI (plotting, saving) can not delay the sampling')
+        self.savefile_settings_layout.addWidget(self.separate_process_checkBox, 3, 0, 1, 3)
+
+        self.publish_checkBox = QCheckBox('Publish live data on port') #Streams every row to external programs over a local TCP socket
+        self.publish_checkBox.setToolTip('If checked, every data row is sent to programs connected to this port on localhost (see publisher.py for the format)')
+        self.savefile_settings_layout.addWidget(self.publish_checkBox, 4, 0, 1, 2)
+        self.publish_port_spinBox = QSpinBox()
+        self.publish_port_spinBox.setRange(1024, 65535)
+        self.publish_port_spinBox.setValue(5555)
+        self.savefile_settings_layout.addWidget(self.publish_port_spinBox, 4, 2)
+
+        self.run_recipe_button = QPushButton('Run Recipe') #Runs several measurements back to back (e.g. IV, CV and constant voltage)
+        self.run_recipe_button.setToolTip('Select a recipe file (json) with the measurements to run one after the other, see recipe.py for the format')
+        self.run_recipe_button.clicked.connect(self.logic.run_recipe)
+        self.savefile_settings_layout.addWidget(self.run_recipe_button, 5, 0, 1, 3)
+
+        self.compression_comboBox = QComboBox() #Compression of the data files, zstd only if the zstandard package is installed
+        self.compression_comboBox.addItems(list(data_handler.COMPRESSIONS))
+        self.compression_comboBox.setToolTip('Compressed files are written in frames every few seconds, so they stay readable after a crash. The history browser and the resume read them directly')
+        self.savefile_settings_layout.addWidget(QLabel('Compression'), 6, 0)
+        self.savefile_settings_layout.addWidget(self.compression_comboBox, 6, 1)
+        self.digits_spinBox = QSpinBox() #Significant digits of the written values
+        self.digits_spinBox.setRange(0, 17)
+        self.digits_spinBox.setValue(0)
+        self.digits_spinBox.setPrefix('Digits: ')
+        self.digits_spinBox.setSpecialValueText('Digits: full')
+        self.digits_spinBox.setToolTip('Significant digits of the written values (0 = full precision). Times are always written with microsecond resolution')
+        self.savefile_settings_layout.addWidget(self.digits_spinBox, 6, 2)
+
         self.savefile_settings_box.setLayout(self.savefile_settings_layout)
         self.layout.addWidget(self.savefile_settings_box, 5, 0, 1, 1) #Add the group box to the layout
 
@@ -306,6 +347,22 @@ class Ui_MainWindow(QWidget):
         self.custom_sweep_file.setPlaceholderText('Enter path to sweep file')
         layout.addWidget(self.custom_sweep_file, 8, 0, 1, 2)
 
+        self.target_rse_spinBox = QDoubleSpinBox()
+        self.target_rse_spinBox.setRange(0, 100)
+        self.target_rse_spinBox.setDecimals(3)
+        self.target_rse_spinBox.setSuffix(' %')
+        self.target_rse_spinBox.setToolTip(
+            'Early stop: the measurements at a step are stopped as soon as the relative standard error\n'
+            'of the mean is below this target. The number of measurements per step is the maximum. 0 disables the early stop'
+        )
+        layout.addWidget(QLabel('Early stop target (rel. std. error)'), 9, 0)
+        layout.addWidget(self.target_rse_spinBox, 9, 1)
+
+        self.min_measurements_spinBox = QSpinBox()
+        self.min_measurements_spinBox.setRange(2, 1000)
+        layout.addWidget(QLabel('Minimum measurements per step'), 10, 0)
+        layout.addWidget(self.min_measurements_spinBox, 10, 1)
+
         outer_layout.addLayout(layout)
         outer_layout.setAlignment(QtCore.Qt.AlignTop)
         outer_layout.setAlignment(QtCore.Qt.AlignLeft)
@@ -442,25 +499,78 @@ class Ui_MainWindow(QWidget):
         self.custom_sweep_file.setPlaceholderText('Enter path to sweep file')
         layout.addWidget(self.custom_sweep_file, 12, 0, 1, 2)
 
+        self.target_rse_spinBox = QDoubleSpinBox()
+        self.target_rse_spinBox.setRange(0, 100)
+        self.target_rse_spinBox.setDecimals(3)
+        self.target_rse_spinBox.setSuffix(' %')
+        self.target_rse_spinBox.setToolTip(
+            'Early stop: the measurements at a step are stopped as soon as the relative standard error\n'
+            'of the mean is below this target. The number of measurements per step is the maximum. 0 disables the early stop'
+        )
+        layout.addWidget(QLabel('Early stop target (rel. std. error)'), 13, 0)
+        layout.addWidget(self.target_rse_spinBox, 13, 1)
+
+        self.min_measurements_spinBox = QSpinBox()
+        self.min_measurements_spinBox.setRange(2, 1000)
+        layout.addWidget(QLabel('Minimum measurements per step'), 14, 0)
+        layout.addWidget(self.min_measurements_spinBox, 14, 1)
+
         outer_layout.addLayout(layout)
         outer_layout.setAlignment(QtCore.Qt.AlignTop)
         outer_layout.setAlignment(QtCore.Qt.AlignLeft)
 
         return outer_layout
     
+    def change_plot_backend(self, backend):
+        #Replaces the live plot by one drawn with the selected backend, the live data shown so far is kept
+        old = self.canvas
+        if backend == 'matplotlib':
+            canvas = plotting.PlotCanvas(self)
+        else:
+            canvas = plotting.PyQtGraphCanvas(self, use_opengl = backend == 'pyqtgraph (OpenGL)')
+        canvas.change_plot_type(old.parameters['type'])
+        canvas.set_frequency_range(*old.frequency_range)
+        for name in ['live_x_data', 'live_y_data']:
+            setattr(canvas, name, list(getattr(old, name)))
+        for point in zip(old.voltage_cv, old.frequencies_cv, old.impedance_cv, old.phase_cv):
+            canvas.update_cv_data(*point)
+        self.layout.replaceWidget(old, canvas)
+        self.layout.removeWidget(self.toolbar) #The toolbar only works with matplotlib
+        self.toolbar.deleteLater()
+        if backend == 'matplotlib':
+            self.toolbar = NavigationToolbar(canvas, self)
+        else:
+            self.toolbar = QWidget()
+        self.layout.addWidget(self.toolbar, 5, 1, 1, 2)
+        old.deleteLater()
+        self.canvas = canvas
+        self.canvas.draw_plot()
+        self.history_browser.refresh() #The overlays are taken from the cache of the browser
+
     def canvas_settings_UI(self):
         layout = QGridLayout()
         layout.setAlignment(QtCore.Qt.AlignTop)
         layout.setAlignment(QtCore.Qt.AlignLeft)
 
         self.clear_data_button = QPushButton('Clear Old Data') #Button to clear the live data
-        self.clear_data_button.clicked.connect(self.canvas.clear_old_data)
+        self.clear_data_button.clicked.connect(lambda: self.history_browser.set_all_visible(False)) #Hides all loaded measurements, they stay in the history browser
         layout.addWidget(self.clear_data_button, 0, 0)
 
-        self.load_data_button = QPushButton('Load Old Data') #Button to load data from a file        
-        self.load_data_button.clicked.connect(self.canvas.load_old_data)
+        self.load_data_button = QPushButton('Load Old Data') #Opens the history browser to overlay previous measurements        
+        self.load_data_button.clicked.connect(self.history_browser.show)
         layout.addWidget(self.load_data_button, 1, 0)
 
+        self.export_plot_button = QPushButton('Export Plot') #Saves the plot with matplotlib (png, pdf, svg)
+        self.export_plot_button.clicked.connect(lambda: self.canvas.export_figure())
+        layout.addWidget(self.export_plot_button, 2, 0)
+
+        self.plot_backend_comboBox = QComboBox() #matplotlib or pyqtgraph (much faster, only available if installed)
+        self.plot_backend_comboBox.addItems(plotting.BACKENDS)
+        self.plot_backend_comboBox.setToolTip('Backend of the live plot. pyqtgraph allows much higher refresh rates, matplotlib is used for the export in any case')
+        self.plot_backend_comboBox.currentTextChanged.connect(self.change_plot_backend)
+        layout.addWidget(QLabel('Plot backend'), 3, 0)
+        layout.addWidget(self.plot_backend_comboBox, 3, 1, 1, 2)
+
         self.live_current_label = QLabel('Live Current:')
         layout.addWidget(self.live_current_label, 0, 1)
 
@@ -473,4 +583,10 @@ class Ui_MainWindow(QWidget):
         self.live_voltage_data = QLabel('0 V')
         layout.addWidget(self.live_voltage_data, 1, 2)
 
+        self.live_eta_label = QLabel('Remaining time:') #Estimated before the start, updated after every point
+        layout.addWidget(self.live_eta_label, 2, 1)
+
+        self.live_eta_data = QLabel('-')
+        layout.addWidget(self.live_eta_data, 2, 2)
+
         return layout
\ No newline at end of file